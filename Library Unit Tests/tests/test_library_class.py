@@ -26,9 +26,10 @@ class TestLibraryClass(unittest.TestCase):
         book1 = Book("Sapiens: A Brief History of Humankind",
                      "Yuval Noah Harari", 2011,
                      "Science, History", False, None)
-        library.add_book(book1)
+        # the book the library holds (the same book, if it was already in the library, gets a copy more)
+        added = library.add_book(book1)
 
-        self.assertIn(book1, library.books)
+        self.assertIn(added, library.books)
         self.clear_library()
 
     # to make sure the json file has only [] in it, without any books inside
@@ -40,7 +41,7 @@ class TestLibraryClass(unittest.TestCase):
         # book2 is with author filter
         book2 = Book("Sapiens", "Shibel", 2011,
                      "Science, History", False, None)
-        # book3 is with author filter
+        # book3 is the same book as book2, so it is added as a second copy of it
         book3 = Book("Sapiens", "Shibel", 2011,
                      "Science, History", False, None)
         # book4 is with author filter
@@ -53,8 +54,9 @@ class TestLibraryClass(unittest.TestCase):
         library.add_book(book3)
         library.add_book(book4)
         actual_result = library.list_books()
-        expected_list_books = [book1, book2, book3, book4]
+        expected_list_books = [book1, book2, book4]
         self.assertListEqual(expected_list_books, actual_result)
+        self.assertEqual(2, book2.copies)
         self.clear_library()
 
     def test_list_books_with_filter(self):
@@ -65,7 +67,7 @@ class TestLibraryClass(unittest.TestCase):
         # book2 is with author filter
         book2 = Book("Sapiens", "Shibel", 2010,
                      "Science, History", False, None)
-        # book3 is with author filter
+        # book3 is the same book as book1, so it is added as a second copy of it
         book3 = Book("Sapiens", "Shibel", 2011,
                      "Science, History", False, None)
         # book4 is with author filter
@@ -79,7 +81,8 @@ class TestLibraryClass(unittest.TestCase):
         library.add_book(book4)
         # the filter here is author and publication_year but can be all the other combinations
         actual_result = library.list_books(author="Shibel", publication_year=2011)
-        expected_list_books = [book1, book3]
+        expected_list_books = [book1]
+        self.assertEqual(2, book1.copies)
 
         self.assertListEqual(expected_list_books, actual_result)
         self.clear_library()
@@ -0,0 +1,252 @@
+import hmac
+from flask import Blueprint, jsonify, request
+from book import Book
+from validation import validate_book, validate_details, validate_filters, validate_rows
+
+# ---------------------------
+# A JSON API over a library, for kiosks and other programs, served under
+# /api/ next to the HTML pages (see make_api). Every endpoint answers with
+# JSON; a bad request gets status 400 with {"error": message}.
+#
+#   GET    /api/books                  list the books (filters of list_books, sort, cursor, limit)
+#   GET    /api/books/<id>             get a book
+#   GET    /api/search?q=...           search the books
+#   POST   /api/books                  add a book (or copies of one already there)
+#   POST   /api/books/batch            add many books, saved in a single write
+#   PATCH  /api/books/<id>             edit a book
+#   DELETE /api/books/<id>             delete a book
+#   POST   /api/books/<id>/borrow      borrow a copy of a book
+#   POST   /api/books/<id>/return      return a copy of a book
+#   POST   /api/loans/batch            borrow and return many books, saved in a single write
+#
+# The books are given with the same fields as in an export (see
+# Library.iter_export) plus the number of copies on the shelf and of users
+# waiting; the loans and holds themselves are left out, as they name the
+# users. Borrows and returns are made for the visitor of the session (like
+# the HTML pages). Only a trusted client, sending the API key of the library
+# in the X-API-Key header, may make them for another user, named by the
+# "user" of the request body (or of a batch item). The batch endpoints
+# report the outcome of every item, in order, and a failed item doesn't stop
+# the others.
+# ---------------------------
+
+# the largest number of books listed at once, and of items of a batch
+MAX_LIMIT = 1000
+MAX_BATCH = 10000
+
+
+def book_to_json(book):
+    """
+    Convert a book to the JSON object the API answers with.
+
+    :param book: (Book) The book.
+
+    :returns:
+        dict: The id, title, author, publication_year, genre, copies, is_borrowed, available and holds (the
+              number of users waiting) of the book.
+    """
+    return {"id": book.id, "title": book.title, "author": book.author, "publication_year": book.publication_year,
+            "genre": book.genre, "copies": book.copies, "is_borrowed": book.is_borrowed, "available": book.available,
+            "holds": len(book.holds)}
+
+
+def error(message, status=400):
+    """
+    Make the answer of a failed request.
+
+    :param message: (str) What went wrong.
+    :param status: (int, optional) The HTTP status. Defaults to 400.
+    """
+    return jsonify(error=message), status
+
+
+def _json_body():
+    """
+    Get the JSON object of the request body.
+
+    :raises ValueError: If there is none.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object body.')
+    return data
+
+
+def _batch_items(data, name):
+    """
+    Get the list of items of a batch request body: {name: [...]}.
+
+    :raises ValueError: If it is missing, isn't a list of objects, or is too long.
+    """
+    items = data.get(name)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError(f'Expected "{name}" to be a list of JSON objects.')
+    if len(items) > MAX_BATCH:
+        raise ValueError(f'A batch can have at most {MAX_BATCH} items.')
+    return items
+
+
+def make_api(library, current_user, api_key=None):
+    """
+    Create the blueprint of the JSON API over a library (see the top of this module).
+
+    :param library: (Library) The library.
+    :param current_user: (callable) Returns the user of the session, for the requests that don't name one.
+    :param api_key: (str, optional) The key of the trusted clients, which may name the user of a borrow or a
+                    return. Defaults to None: no client may, every loan is the session's.
+
+    :returns:
+        Blueprint: The blueprint, to register on the Flask application.
+    """
+    api = Blueprint('api', __name__, url_prefix='/api')
+
+    def trusted():
+        """
+        Check whether the request comes from a trusted client, which sent the API key.
+        """
+        key = request.headers.get('X-API-Key')
+        return api_key is not None and key is not None and hmac.compare_digest(key.encode(), api_key.encode())
+
+    def user_of(data):
+        """
+        Get the user named in a request body or a batch item if the client is trusted, or else the user of the
+        session.
+        """
+        user = data.get("user") if isinstance(data, dict) else None
+        if user is not None and not isinstance(user, str):
+            raise ValueError('"user" should be a string.')
+        return user if user and trusted() else current_user()
+
+    @api.errorhandler(ValueError)
+    def bad_request(e):
+        return error(str(e))
+
+    @api.get('/books')
+    def list_books():
+        """
+        List the books, one page at a time: the query string may hold the filters of Library.list_books,
+        the sort, the cursor of the page (the next_cursor of the previous one) and the limit (up to MAX_LIMIT).
+        """
+        args = request.args
+        sort = args.get('sort') or None
+        try:
+            limit = min(int(args.get('limit', 50)), MAX_LIMIT)
+        except ValueError:
+            raise ValueError(f'Invalid limit "{args["limit"]}".')
+        if limit < 1:
+            raise ValueError('The limit should be a positive number.')
+        books = library.list_books(sort=sort, limit=limit + 1, cursor=args.get('cursor'), **validate_filters(args))
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = library.cursor_after(books[-1], sort)
+        return jsonify(books=[book_to_json(book) for book in books], next_cursor=next_cursor)
+
+    @api.get('/books/<int:book_id>')
+    def get_book(book_id):
+        book = library.get_book(book_id)
+        if book is None:
+            return error(f'No book with id {book_id}.', 404)
+        return jsonify(book_to_json(book))
+
+    @api.get('/search')
+    def search():
+        """
+        Search the books for the words of the query (q), best matches first, up to limit (20 by default).
+        """
+        try:
+            limit = min(int(request.args.get('limit', 20)), MAX_LIMIT)
+        except ValueError:
+            raise ValueError(f'Invalid limit "{request.args["limit"]}".')
+        query = request.args.get('q', '').strip()
+        books = library.search(query, limit=limit) if query else []
+        return jsonify(books=[book_to_json(book) for book in books])
+
+    @api.post('/books')
+    def add_book():
+        """
+        Add a book: title, author, year (or publication_year), genre and optionally copies, checked as on the
+        librarian's page. Adding a book already in the library adds copies to it.
+        """
+        book = library.add_book(validate_book(_json_body()))
+        return jsonify(book_to_json(book)), 201
+
+    @api.post('/books/batch')
+    def add_books():
+        """
+        Add many books: {"books": [...]}, each as for POST /api/books. The valid ones are added and saved in a
+        single write; the results say, for every item in order, the book or the error.
+        """
+        items = _batch_items(_json_body(), "books")
+        checked = validate_rows(list(enumerate(items)))
+        added = iter(library.add_books(Book(*fields[:4], copies=fields[4])
+                                       for _, fields, message in checked if message is None))
+        results = [{"ok": True, "book": book_to_json(next(added))} if message is None
+                   else {"ok": False, "error": message} for _, _, message in checked]
+        return jsonify(results=results)
+
+    @api.patch('/books/<int:book_id>')
+    def edit_book(book_id):
+        """
+        Edit a book: any of title, author, year (or publication_year), genre and copies, checked as on the edit
+        page. A book can't be edited while copies of it are borrowed.
+        """
+        book = library.get_book(book_id)
+        if book is None:
+            return error(f'No book with id {book_id}.', 404)
+        data = _json_body()
+        year = data.get('year', data.get('publication_year', book.publication_year))
+        copies = data.get('copies', book.copies)
+        new_details = validate_details(data.get('title'), data.get('author'), year, data.get('genre'), copies)
+        if not library.edit_book(new_details=new_details, book_id=book_id):
+            return error(f'Book "{book.title}" can\'t be edited while copies of it are borrowed.', 409)
+        return jsonify(book_to_json(book))
+
+    @api.delete('/books/<int:book_id>')
+    def delete_book(book_id):
+        book = library.get_book(book_id)
+        if book is None:
+            return error(f'No book with id {book_id}.', 404)
+        if book.loans:
+            return error(f'Book "{book.title}" can\'t be deleted while copies of it are borrowed.', 409)
+        library.delete_book(book_id=book_id)
+        return '', 204
+
+    @api.post('/books/<int:book_id>/borrow')
+    def borrow_book(book_id):
+        book = library.get_book(book_id)
+        if book is None:
+            return error(f'No book with id {book_id}.', 404)
+        success, timestamp = library.borrow_book(book_id=book_id, user=user_of(request.get_json(silent=True)))
+        if not success:
+            return error('No copy of the book is on the shelf.', 409)
+        return jsonify(book=book_to_json(book), timestamp=timestamp)
+
+    @api.post('/books/<int:book_id>/return')
+    def return_book(book_id):
+        book = library.get_book(book_id)
+        if book is None:
+            return error(f'No book with id {book_id}.', 404)
+        success, timestamp = library.return_book(book_id=book_id, user=user_of(request.get_json(silent=True)))
+        if not success:
+            return error('The user has no copy of the book on loan.', 409)
+        return jsonify(book=book_to_json(book), timestamp=timestamp)
+
+    @api.post('/loans/batch')
+    def borrow_and_return():
+        """
+        Borrow and return many books in one request: {"operations": [{"op": "borrow" or "return", "id" or
+        "title", "user"}, ...]}, applied in order and saved in a single write (see Library.borrow_and_return).
+        The results say, for every operation in order, whether it succeeded and its timestamp.
+        """
+        operations = _batch_items(_json_body(), "operations")
+        for operation in operations:
+            if operation.get("id") is not None and not isinstance(operation["id"], int):
+                raise ValueError('The "id" of a book should be an integer.')
+            if operation.get("title") is not None and not isinstance(operation["title"], str):
+                raise ValueError('The "title" of a book should be a string.')
+            operation["user"] = user_of(operation)
+        results = library.borrow_and_return(operations)
+        return jsonify(results=[{"ok": success, "timestamp": timestamp} for success, timestamp in results])
+
+    return api
@@ -1,16 +1,104 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from library import Library
-from book import Book
+import atexit
+import csv
+import io
+import os
+import secrets
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, \
+    stream_with_context
+from library import Library, LOAN_PERIOD
+from validation import validate_book, validate_details, validate_filters
+from importer import format_of, import_books
+from api import make_api
+from storage import open_storage
+from asgi import WsgiToAsgi
 from datetime import datetime
 
 # This Flask application serves as the foundation for the library website.
 
 app = Flask(__name__)
-app.secret_key = 'supersecretkey'  # for the flash messages
-library = Library()
+# Signs the session cookies, which hold the flash messages and the visitor's id (the owner of their loans, see
+# current_user). Set LIBRARY_SECRET_KEY to keep the sessions across restarts, and to the same key in every worker
+# process; without it, each process signs with a random key of its own.
+app.secret_key = os.environ.get('LIBRARY_SECRET_KEY') or secrets.token_hex(32)
+# The storage mode is chosen with the LIBRARY_STORAGE environment variable ("json", "journal" or "sqlite").
+# Set LIBRARY_SHARED=1 when several worker processes serve the app (for example gunicorn -w 4), and
+# LIBRARY_DURABILITY to "none", "fsync" or "full" to choose how much is flushed to disk on every change.
+# With LIBRARY_FLUSH_INTERVAL (in seconds), changes are grouped and written at most once per interval.
+# LIBRARY_LOAN_DAYS sets how many days a copy can be borrowed for (14 by default).
+# With LIBRARY_WRITER_THREAD=1, changes are written by a writer thread and requests never wait for the disk
+# (meant for the asyncio serving mode, see asgi_app at the end of this file).
+flush_interval = os.environ.get('LIBRARY_FLUSH_INTERVAL')
+loan_days = os.environ.get('LIBRARY_LOAN_DAYS')
+
+
+def notify_overdue(book, loan):
+    """
+    Called by the overdue scheduler for every loan that passes its due date.
+
+    :param book: The book of the borrowed copy.
+    :param loan: The overdue loan.
+    """
+    app.logger.warning('Copy %s of "%s" (borrowed at %s) is overdue.', loan.copy, book.title,
+                       loan.borrowed_timestamp)
+
+
+library = Library(storage=open_storage(os.environ.get('LIBRARY_STORAGE', 'json'),
+                                       shared=os.environ.get('LIBRARY_SHARED') == '1',
+                                       durability=os.environ.get('LIBRARY_DURABILITY', 'fsync'),
+                                       flush_interval=float(flush_interval) if flush_interval else None,
+                                       writer_thread=os.environ.get('LIBRARY_WRITER_THREAD') == '1'),
+                  loan_period=float(loan_days) * 86400 if loan_days else LOAN_PERIOD,
+                  on_overdue=notify_overdue)
+# write out the last grouped or queued changes when the server shuts down
+atexit.register(library.close)
+# mark the loans that pass their due date as they do (see overdue.py)
+library.overdue.start()
+atexit.register(library.overdue.stop)
+
+# The number of books listed per page on the books and librarian pages
+PAGE_SIZE = 50
+
+
+@app.before_request
+def refresh_library():
+    """
+    Picks up the changes other worker processes made to the library before handling a request.
+    """
+    library.refresh()
+
 
-# Personal Library (List of borrowed books)
-personal_library = []
+def current_user():
+    """
+    Gets the id of the current visitor, kept in their session cookie. A visitor gets a new random id on their
+    first visit; the books they borrow are recorded under it (see Library.loans_of).
+
+    :return: The user id.
+    """
+    if 'user' not in session:
+        session['user'] = secrets.token_hex(16)
+        session.permanent = True
+    return session['user']
+
+
+# the JSON API, under /api/ (see api.py); the clients sending LIBRARY_API_KEY may borrow and return for any user
+app.register_blueprint(make_api(library, current_user, api_key=os.environ.get('LIBRARY_API_KEY') or None))
+
+
+def list_page():
+    """
+    Lists the page of library books asked for by the query string: its sort ("title", "author" or "year",
+    prefixed with "-" for descending order) and its cursor (from the link to the next page).
+
+    :return: The books of the page, the sort, and the cursor of the next page (None on the last page).
+    :raises ValueError: If the sort or the cursor is invalid.
+    """
+    sort = request.args.get('sort') or None
+    listed_books = library.list_books(sort=sort, limit=PAGE_SIZE + 1, cursor=request.args.get('cursor'))
+    next_cursor = None
+    if len(listed_books) > PAGE_SIZE:
+        listed_books = listed_books[:PAGE_SIZE]
+        next_cursor = library.cursor_after(listed_books[-1], sort)
+    return listed_books, sort, next_cursor
 
 
 @app.route('/')
@@ -26,176 +114,283 @@ def index():
 @app.route('/books')
 def books():
     """
-    Renders the public library books page, listing all available books with options to borrow or return them.
+    Renders the public library books page, listing the books (one row per book with the number of its copies
+    on the shelf, one page at a time, see list_page) with options to borrow them, or to place a hold on them
+    when all their copies are borrowed.
 
     :return: Rendered HTML of the public library books page.
     """
-    listed_books = library.list_books()
-    return render_template('books.html', books=listed_books)
+    try:
+        listed_books, sort, next_cursor = list_page()
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('books'))
+    user = current_user()
+    return render_template('books.html', books=listed_books, sort=sort, next_cursor=next_cursor,
+                           overdue=library.overdue.count, hold_position=lambda book: library.hold_position(book, user))
+
+
+@app.route('/search')
+def search():
+    """
+    Renders the search page, listing the books whose title, author or genre match the words of the query.
+
+    :return: Rendered HTML of the search page.
+    """
+    query = request.args.get('q', '').strip()
+    found_books = library.search(query, limit=50) if query else []
+    return render_template('search.html', query=query, books=found_books)
+
+
+@app.route('/export')
+def export():
+    """
+    Streams the books of the library as a JSON Lines or CSV file (see Library.iter_export), without building
+    the whole file in memory. The query string holds the format ("jsonl" or "csv", JSON Lines by default),
+    the sort as on the books page, and optionally the filters of Library.list_books: author, genre,
+    publication_year, has_genre, year_from, year_to, is_borrowed ("true" or "false") and author_contains.
+
+    :return: The streamed file, or a JSON error with status 400 for a bad request.
+    """
+    args = request.args
+    export_format = args.get('format', 'jsonl')
+    try:
+        lines = library.iter_export(export_format, sort=args.get('sort') or None, **validate_filters(args))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(lines), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=library.{export_format}'})
+
+
+@app.route('/autocomplete')
+def autocomplete():
+    """
+    Suggests completions for a field of the book forms, as the librarian types.
+    The query string holds the field ("title", "author" or "genre"), the typed text (q), and optionally
+    the maximum number of suggestions (limit, up to 50) and of tolerated typos (typos, up to 2).
+
+    :return: JSON list of the suggested values, or a JSON error with status 400 for a bad request.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+        typos = request.args.get('typos')
+        suggestions = library.autocomplete(request.args.get('field', 'title'), request.args.get('q', ''),
+                                           limit, int(typos) if typos else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(suggestions)
 
 
 @app.route('/librarians', methods=['GET', 'POST'])
 def librarians():
     """
     Renders the librarian's page.
-    - If GET request: Display the list of books with options to edit, delete, or add new books.
-    - If POST request: Add a new book to the library.
+    - If GET request: Display the list of books (one page at a time, see list_page) with options to edit,
+      delete, or add new books.
+    - If POST request: Add a new book (or more copies of a book already in the library) to the library.
 
     :return: Rendered HTML of the librarian's page.
     """
     if request.method == 'POST':
         try:
-            data = request.form
-            new_title = data.get('title')
-            author = data.get('author')
-            genre = data.get('genre')
-            year = data.get('year')
-
-            # Check for empty fields
-            if not new_title or not author or not genre or not year:
-                raise ValueError('Please fill in all fields.')
-
-            # Convert year to integer
-            try:
-                publication_year = int(year)
-            except ValueError:
-                raise ValueError('Invalid year format. Please enter a valid year.')
-
-            # Check if author or genre contain digits
-            if any(char.isdigit() for char in author):
-                raise ValueError('Author should not contain numbers.')
-
-            if any(char.isdigit() for char in genre):
-                raise ValueError('Genre should not contain numbers.')
-
-            # If all checks pass, add the book to the library
-            book = Book(new_title, author, publication_year, genre)
-            library.add_book(book)
-            flash(f'Book "{book.title}" added successfully.', 'success')
+            # If all checks pass (see validation.py), add the book to the library
+            book = library.add_book(validate_book(request.form))
+            flash(f'Book "{book.title}" added successfully ({book.copies} copies in the library).', 'success')
 
         except ValueError as e:
             flash(str(e), 'error')
 
         return redirect(url_for('librarians'))
 
-    listed_books = library.list_books()
-    return render_template('manage_books.html', books=listed_books)
+    try:
+        listed_books, sort, next_cursor = list_page()
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('librarians'))
+    return render_template('manage_books.html', books=listed_books, sort=sort, next_cursor=next_cursor)
+
+# The number of rejected rows of an import listed on the librarian's page
+IMPORT_ERRORS_SHOWN = 10
+
+
+@app.route('/librarians/import', methods=['POST'])
+def import_catalog():
+    """
+    Import the books of an uploaded CSV or JSON Lines catalog (see importer.py). The upload is streamed into
+    the library and saved once; the rows that fail validation are skipped and reported.
+
+    :return: Redirect to the librarian's page with a summary of the import.
+    """
+    upload = request.files.get('catalog')
+    if not upload or not upload.filename:
+        flash('Please choose a catalog file.', 'error')
+        return redirect(url_for('librarians'))
+    try:
+        catalog_format = format_of(upload.filename)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('librarians'))
+    try:
+        report = import_books(library, io.TextIOWrapper(upload.stream, encoding='utf-8', newline=''),
+                              catalog_format)
+    except (ValueError, csv.Error) as e:
+        # the books before the unreadable part are imported
+        flash(f'The catalog could not be read to the end: {e}', 'error')
+        return redirect(url_for('librarians'))
+    flash(str(report), 'error' if report.errors else 'success')
+    for number, message in report.errors[:IMPORT_ERRORS_SHOWN]:
+        flash(f'Line {number}: {message}', 'error')
+    if len(report.errors) > IMPORT_ERRORS_SHOWN:
+        flash(f'... and {len(report.errors) - IMPORT_ERRORS_SHOWN} more rejected rows.', 'error')
+    return redirect(url_for('librarians'))
+
+
+@app.route('/borrow/<int:book_id>')
+def borrow_book(book_id):
+    """
+    Borrow a copy of a book from the public library for the current visitor (see current_user).
+
+    :param book_id: Id of the book to borrow.
+    :return: Redirect to the public library books page with a success or error message.
+    """
+    book = library.get_book(book_id)
+    success, timestamp = library.borrow_book(book_id=book_id, user=current_user())
+    if success:
+        flash(f'Book "{book.title}" borrowed successfully at {timestamp}.', 'success')
+    else:
+        flash(f'Book "{book.title if book else book_id}" could not be borrowed.', 'error')
+    return redirect(url_for('books'))
+
 
-@app.route('/borrow/<title>')
-def borrow_book(title):
+@app.route('/return/<int:book_id>')
+def return_book(book_id):
     """
-    Borrow a book from the public library and add it to the personal library.
+    Return a copy of a book the current visitor borrowed to the public library.
 
-    :param title: Title of the book to borrow.
+    :param book_id: Id of the book to return.
     :return: Redirect to the public library books page with a success or error message.
     """
-    success, timestamp = library.borrow_book(title)
+    book = library.get_book(book_id)
+    success, timestamp = library.return_book(book_id=book_id, user=current_user())
     if success:
-        book = next((book for book in library.books if book.title == title), None)
-        if book:
-            personal_library.append(book)
-        flash(f'Book "{title}" borrowed successfully at {timestamp}.', 'success')
+        flash(f'Book "{book.title}" returned successfully at {timestamp}.', 'success')
     else:
-        flash(f'Book "{title}" could not be borrowed.', 'error')
+        flash(f'Book "{book.title if book else book_id}" could not be returned.', 'error')
     return redirect(url_for('books'))
 
 
-@app.route('/return/<title>')
-def return_book(title):
+@app.route('/hold/<int:book_id>')
+def hold_book(book_id):
     """
-    Return a borrowed book from the personal library to the public library.
+    Place a hold on a book with no copy on the shelf for the current visitor: they get the next copy returned
+    once the visitors before them in the queue got theirs.
 
-    :param title: Title of the book to return.
+    :param book_id: Id of the book to hold.
     :return: Redirect to the public library books page with a success or error message.
     """
-    success, timestamp = library.return_book(title)
+    book = library.get_book(book_id)
+    success, position = library.hold_book(book_id=book_id, user=current_user())
     if success:
-        book = next((book for book in personal_library if book.title == title), None)
-        if book:
-            personal_library.remove(book)
-        flash(f'Book "{title}" returned successfully at {timestamp}.', 'success')
+        flash(f'You are number {position} in line for "{book.title}".', 'success')
     else:
-        flash(f'Book "{title}" could not be returned.', 'error')
+        flash(f'A hold on "{book.title if book else book_id}" could not be placed.', 'error')
     return redirect(url_for('books'))
 
 
-@app.route('/edit/<title>', methods=['GET', 'POST'])
-def edit_book(title):
+@app.route('/cancel_hold/<int:book_id>')
+def cancel_hold(book_id):
+    """
+    Take the current visitor out of the queue of holds of a book.
+
+    :param book_id: Id of the held book.
+    :return: Redirect to the public library books page with a success or error message.
+    """
+    book = library.get_book(book_id)
+    if library.cancel_hold(book_id=book_id, user=current_user()):
+        flash(f'Your hold on "{book.title}" was cancelled.', 'success')
+    else:
+        flash(f'You are not waiting for "{book.title if book else book_id}".', 'error')
+    return redirect(url_for('books'))
+
+
+@app.route('/edit/<int:book_id>', methods=['GET', 'POST'])
+def edit_book(book_id):
     """
     Edit the details of an existing book in the library.
     - If GET request: Display the form to edit the book details.
     - If POST request: Update the book details in the library.
 
-    :param title: Title of the book to edit.
+    :param book_id: Id of the book to edit.
     :return: Redirect to the librarian's page with a success or error message.
     """
-    book = next((book for book in library.books if book.title == title), None)
+    book = library.get_book(book_id)
     if not book:
         return redirect(url_for('librarians'))
+    title = book.title
 
     if request.method == 'POST':
         data = request.form
         try:
-            new_year = int(data.get('year'))
-        except ValueError:
-            flash('Invalid year format. Please enter a valid year.', 'error')
-            return redirect(url_for('edit_book', title=title))
-
-        # Check if author or genre contain digits
-        if any(char.isdigit() for char in data.get('author', '')):
-            flash('Author should not contain numbers.', 'error')
-            return redirect(url_for('edit_book', title=title))
-
-        if any(char.isdigit() for char in data.get('genre', '')):
-            flash('Genre should not contain numbers.', 'error')
-            return redirect(url_for('edit_book', title=title))
-
-        new_details = {
-            "title": data.get('new_title'),
-            "author": data.get('author'),
-            "publication_year": new_year,
-            "genre": data.get('genre')
-        }
-
-        if new_year > datetime.now().year:
-            flash('Publication year cannot be in the future.', 'error')
-            return redirect(url_for('edit_book', title=title))
-
-        if library.edit_book(title, new_details):
+            new_details = validate_details(data.get('new_title'), data.get('author'), data.get('year'),
+                                           data.get('genre'), data.get('copies') or str(book.copies))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('edit_book', book_id=book_id))
+
+        if library.edit_book(new_details=new_details, book_id=book_id):
             flash(f'Book "{title}" updated successfully.', 'success')
         else:
-            flash(f'Book "{title}" could not be updated because it is currently borrowed.', 'error')
+            flash(f'Book "{title}" could not be updated because copies of it are currently borrowed.', 'error')
 
         return redirect(url_for('librarians'))
 
     return render_template('edit_book.html', book=book)
 
-@app.route('/delete/<title>')
-def delete_book(title):
+@app.route('/delete/<int:book_id>')
+def delete_book(book_id):
     """
     Delete a book from the library.
 
-    :param title: Title of the book to delete.
+    :param book_id: Id of the book to delete.
     :return: Redirect to the librarian's page with a success or error message.
     """
-    book = next((book for book in library.books if book.title == title), None)
-    if book and not book.is_borrowed:
-        library.delete_book(title)
-        flash(f'Book "{title}" deleted successfully.', 'success')
+    book = library.get_book(book_id)
+    if book and not book.loans:
+        library.delete_book(book_id=book_id)
+        flash(f'Book "{book.title}" deleted successfully.', 'success')
     else:
-        flash(f'Book "{title}" could not be deleted because it is currently borrowed.', 'error')
+        flash(f'Book "{book.title if book else book_id}" could not be deleted because copies of it are currently '
+              'borrowed.', 'error')
     return redirect(url_for('librarians'))
 
 
 @app.route('/personal_library')
 def personal_library_view():
     """
-    Render the personal library page, listing all borrowed books with options to return them.
+    Render the personal library page, listing the copies the current visitor has borrowed (see current_user)
+    with their due dates and options to return them.
 
     :return: Rendered HTML of the personal library page.
     """
-    return render_template('personal_library.html', books=personal_library)
+    return render_template('personal_library.html', loans=library.loans_of(current_user()),
+                           is_overdue=library.overdue.is_overdue)
+
+
+@app.template_filter('date')
+def format_date(seconds):
+    """
+    Formats a time in seconds since the epoch like the borrowed timestamps.
+
+    :param seconds: The time in seconds since the epoch.
+    :return: The formatted local time.
+    """
+    return datetime.fromtimestamp(seconds).strftime("%d-%m-%Y   %H:%M")
+
 
+# The app for an asyncio (ASGI) server, for example: LIBRARY_WRITER_THREAD=1 uvicorn app:asgi_app (see asgi.py).
+# LIBRARY_THREADS sets how many requests are handled at the same time (32 by default).
+asgi_app = WsgiToAsgi(app, threads=int(os.environ.get('LIBRARY_THREADS', 32)))
 
 if __name__ == '__main__':
     app.run(debug=True)
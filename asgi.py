@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import logging
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------
+# This module serves a WSGI application (the Flask app of app.py) from an
+# asyncio ASGI server, such as uvicorn or hypercorn:
+#
+#   LIBRARY_WRITER_THREAD=1 uvicorn app:asgi_app
+#
+# The server's event loop accepts the connections and reads the request
+# bodies, so a slow client only costs a coroutine. Every request is then
+# handled by the (synchronous) Flask views on a pool of threads, and a
+# streamed response (like /export) is sent batch by batch as the view yields
+# it. Browsing the library only reads its in-memory indexes, so many requests
+# are served at once from a single process; with LIBRARY_WRITER_THREAD=1 the
+# changes are written to disk by a dedicated writer thread (see
+# storage.WriterThreadStorage), so no request waits for the disk either.
+# ---------------------------
+
+logger = logging.getLogger(__name__)
+
+# request bodies larger than this are kept in a temporary file instead of memory
+MAX_BODY_IN_MEMORY = 1024 * 1024
+
+
+class WsgiToAsgi:
+    def __init__(self, wsgi_app, threads=32):
+        """
+        Initialize a WsgiToAsgi object, the ASGI application serving a WSGI application.
+
+        :param wsgi_app: (callable) The WSGI application.
+        :param threads: (int, optional) The number of requests handled at the same time. Defaults to 32.
+        """
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-request")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.handle(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send):
+        """
+        Answer the startup and shutdown messages of the server. The request threads are stopped on shutdown.
+        """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle(self, scope, receive, send):
+        """
+        Handle an HTTP request: read its body, run the WSGI application on a request thread and send its
+        response.
+
+        :param scope: (dict) The ASGI connection scope.
+        :param receive: (callable) Awaitable returning the next message of the client.
+        :param send: (callable) Awaitable sending a message to the client.
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_BODY_IN_MEMORY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        # the application and the iteration of its response may run on different request threads: they all run
+        # in the same context, so the request context Flask keeps in context variables follows them
+        context = contextvars.copy_context()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return response.setdefault("written", []).append
+
+        def run():
+            return iter(self.wsgi_app(environ_of(scope, body), start_response))
+
+        # the next message after the body is the client disconnecting; a streamed response then stops early
+        disconnected = asyncio.ensure_future(receive())
+        chunks = None
+        try:
+            chunks = await loop.run_in_executor(self.executor, context.run, run)
+            while not disconnected.done():
+                chunk = await loop.run_in_executor(self.executor, context.run, next, chunks, None)
+                # the bytes given to the write callable of start_response come first
+                data = b"".join(response.pop("written", [])) + (chunk or b"")
+                if not response.get("started"):
+                    response["started"] = True
+                    await send({"type": "http.response.start", "status": response["status"],
+                                "headers": response["headers"]})
+                if chunk is None:
+                    await send({"type": "http.response.body", "body": data, "more_body": False})
+                    break
+                if data:
+                    await send({"type": "http.response.body", "body": data, "more_body": True})
+        except Exception:
+            logger.exception("Error handling %s %s", scope["method"], scope["path"])
+            if not response.get("started"):
+                await send({"type": "http.response.start", "status": 500,
+                            "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+                await send({"type": "http.response.body", "body": b"Internal Server Error"})
+        finally:
+            disconnected.cancel()
+            if chunks is not None and hasattr(chunks, "close"):
+                await loop.run_in_executor(self.executor, context.run, chunks.close)
+            body.close()
+
+
+def environ_of(scope, body):
+    """
+    Build the WSGI environ of an HTTP request (PEP 3333).
+
+    :param scope: (dict) The ASGI connection scope.
+    :param body: (file) The body of the request.
+
+    :returns:
+        dict: The environ.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        # WSGI strings are the bytes of the request decoded as latin-1
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f'HTTP/{scope.get("http_version", "1.1")}',
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
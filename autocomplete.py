@@ -0,0 +1,279 @@
+import heapq
+
+# ---------------------------
+# These classes suggest completions for what a librarian is typing, for the
+# title, author and genre fields of the book forms.
+#
+# The values of a field are kept in a radix trie (a prefix tree where a chain
+# of nodes with a single child is stored as one node with a longer label), so
+# all the values starting with a prefix are under the node reached by
+# following the prefix, and the number of nodes stays proportional to the
+# number of values. Matching ignores letter case.
+#
+# Small typos are tolerated: the trie is walked with a row of the Levenshtein
+# edit distance table between the typed text and the path so far, and every
+# subtree whose path is within the allowed distance of the typed text gives
+# its values. Branches whose row can no longer lead to a closer match are
+# not walked, and the first character must match, so only a small part of
+# the trie is visited. Completions with
+# fewer typos come first, then alphabetically.
+#
+# A value may be shared by several books, so every value is counted, and it
+# is only removed from the trie when its last book is.
+# ---------------------------
+
+FIELDS = ("title", "author", "genre")
+# the most typos that can be asked for
+MAX_DISTANCE = 2
+
+
+def default_max_distance(text):
+    """
+    The number of typos tolerated by default in a typed text: none for texts shorter than 4 characters,
+    which would match almost anything, and one for longer texts. Two typos can be asked for explicitly,
+    but they make the trie walk several times longer.
+
+    :param text: (str) The typed text.
+
+    :returns:
+        int: The maximum edit distance.
+    """
+    return 0 if len(text) < 4 else 1
+
+
+class _Node:
+    __slots__ = ("label", "children", "values")
+
+    def __init__(self, label=""):
+        self.label = label
+        # first character of a child's label -> child
+        self.children = {}
+        # value (as given, not case-folded) -> number of books with it; empty if no value ends here
+        self.values = {}
+
+
+class Trie:
+    def __init__(self, values=()):
+        """
+        Initialize a Trie object.
+
+        :param values: (iterable, optional) The values to add.
+        """
+        self._root = _Node()
+        self._size = 0
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        """
+        The number of distinct values.
+        """
+        return self._size
+
+    def add(self, value):
+        """
+        Add a value (or one more book with the value).
+
+        :param value: (str) The value.
+        """
+        key = value.casefold()
+        node = self._root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                child = node.children[key[i]] = _Node(key[i:])
+                node = child
+                break
+            label = child.label
+            common = 1
+            while common < len(label) and i + common < len(key) and label[common] == key[i + common]:
+                common += 1
+            if common < len(label):
+                # split the child at the end of the common part
+                middle = node.children[key[i]] = _Node(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                child = middle
+            node = child
+            i += common
+        if value not in node.values:
+            self._size += 1
+        node.values[value] = node.values.get(value, 0) + 1
+
+    def remove(self, value):
+        """
+        Remove a value (or one of the books with the value). Removing a value that isn't there does nothing.
+
+        :param value: (str) The value.
+        """
+        key = value.casefold()
+        path = [self._root]
+        i = 0
+        while i < len(key):
+            child = path[-1].children.get(key[i])
+            if child is None or not key.startswith(child.label, i):
+                return
+            path.append(child)
+            i += len(child.label)
+        node = path[-1]
+        if value not in node.values:
+            return
+        node.values[value] -= 1
+        if node.values[value]:
+            return
+        del node.values[value]
+        self._size -= 1
+
+        # drop the nodes left without values, and merge a node left with a single child into it
+        while len(path) > 1 and not node.values and len(node.children) <= 1:
+            parent = path[-2]
+            if node.children:
+                (child,) = node.children.values()
+                child.label = node.label + child.label
+                parent.children[node.label[0]] = child
+                break
+            del parent.children[node.label[0]]
+            path.pop()
+            node = parent
+
+    def complete(self, text, limit=10, max_distance=None):
+        """
+        Find the values starting with a typed text, allowing for typos.
+
+        :param text: (str) The typed text.
+        :param limit: (int, optional) The maximum number of completions. Defaults to 10.
+        :param max_distance: (int, optional) The maximum number of typos (inserted, deleted or replaced
+                             characters), at most MAX_DISTANCE. Defaults to default_max_distance(text).
+
+        :returns:
+            list: The completions, with fewer typos first, then alphabetically.
+        """
+        key = text.casefold()
+        if max_distance is None:
+            max_distance = default_max_distance(key)
+        max_distance = max(0, min(max_distance, MAX_DISTANCE))
+        if limit <= 0:
+            return []
+
+        # the subtrees within the distance, found by walking the trie with a row of the edit distance table
+        matches = []
+        cutoff = max_distance + 1
+        stack = [(self._root, 0, [min(j, cutoff) for j in range(len(key) + 1)], cutoff)]
+        while stack:
+            node, depth, row, found = stack.pop()
+            children = node.children.values()
+            if node is self._root and key:
+                # the first character must be typed right: the top of the trie is too dense to try every letter
+                children = [node.children[key[0]]] if key[0] in node.children else []
+            for child in children:
+                child_depth, child_row, child_found = depth, row, found
+                for char in child.label:
+                    child_depth += 1
+                    child_row = self._next_row(key, child_row, char, child_depth, max_distance)
+                    if child_row[-1] < child_found:
+                        child_found = child_row[-1]
+                        matches.append((child_found, len(matches), child))
+                    # the distance can't get below the smallest of the row further down: stop once that can't
+                    # give a closer match than the one found on the way (or one within max_distance)
+                    if min(child_row) >= child_found:
+                        break
+                else:
+                    stack.append((child, child_depth, child_row, child_found))
+        if len(key) <= max_distance:
+            matches.append((len(key), -1, self._root))
+
+        completions = {}
+        for distance, _, node in sorted(matches):
+            if len(completions) >= limit and distance > max(completions.values()):
+                # the values of this subtree and the next ones come after all the completions found so far
+                break
+            for value in self._values(node, limit):
+                completions.setdefault(value, distance)
+        return [value for value, _ in heapq.nsmallest(limit, completions.items(),
+                                                      key=lambda item: (item[1], item[0].casefold(), item[0]))]
+
+    @staticmethod
+    def _next_row(key, row, char, depth, max_distance):
+        """
+        Extend a row of the edit distance table between the typed text and the path with one more character
+        of the path (which is then depth characters long). row[j] is the distance between the first j
+        characters of the typed text and the path, or max_distance + 1 if it is more than max_distance.
+        Only the cells with |depth - j| <= max_distance can be within max_distance, so only those are computed.
+        """
+        cutoff = max_distance + 1
+        next_row = [cutoff] * len(row)
+        if depth <= max_distance:
+            next_row[0] = depth
+        start = depth - max_distance if depth > max_distance else 1
+        left = next_row[start - 1]
+        for j in range(start, min(len(key), depth + max_distance) + 1):
+            # the cheapest of a replaced (or matching), an inserted and a deleted character
+            cell = row[j - 1] + (key[j - 1] != char)
+            if row[j] + 1 < cell:
+                cell = row[j] + 1
+            if left + 1 < cell:
+                cell = left + 1
+            left = next_row[j] = cell if cell < cutoff else cutoff
+        return next_row
+
+    @staticmethod
+    def _values(node, limit):
+        """
+        Get the first values of a subtree, alphabetically (by case-folded value).
+        """
+        values = []
+        stack = [node]
+        while stack and len(values) < limit:
+            node = stack.pop()
+            values.extend(sorted(node.values))
+            stack.extend(node.children[first] for first in sorted(node.children, reverse=True))
+        return values[:limit]
+
+
+class Autocomplete:
+    def __init__(self, books=()):
+        """
+        Initialize an Autocomplete object, with a trie for every field in FIELDS.
+
+        :param books: (iterable, optional) The books whose values to add.
+        """
+        self.tries = {field: Trie() for field in FIELDS}
+        for book in books:
+            self.add(book)
+
+    def add(self, book):
+        """
+        Add the values of a book.
+
+        :param book: (Book) The book.
+        """
+        for field, trie in self.tries.items():
+            trie.add(getattr(book, field))
+
+    def remove(self, book):
+        """
+        Remove the values of a book.
+
+        :param book: (Book) The book.
+        """
+        for field, trie in self.tries.items():
+            trie.remove(getattr(book, field))
+
+    def complete(self, field, text, limit=10, max_distance=None):
+        """
+        Find the values of a field starting with a typed text, allowing for typos (see Trie.complete).
+
+        :param field: (str) One of FIELDS.
+        :param text: (str) The typed text.
+        :param limit: (int, optional) The maximum number of completions. Defaults to 10.
+        :param max_distance: (int, optional) The maximum number of typos.
+
+        :returns:
+            list: The completions.
+
+        :raises ValueError: If the field isn't one of FIELDS.
+        """
+        if field not in self.tries:
+            raise ValueError(f'Unknown autocomplete field "{field}".')
+        return self.tries[field].complete(text, limit, max_distance)
@@ -0,0 +1,79 @@
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import Book
+
+# ---------------------------
+# This script measures how many bytes a Book takes in memory, comparing the
+# current compact Book (__slots__ and interned author/genre strings) with the
+# previous representation (a plain class with an instance __dict__).
+#
+# The books are built from a JSON catalog, like the library does, so every
+# author and genre value starts out as a separate string object.
+#
+# Usage: python benchmarks/book_memory.py [number_of_books]
+# ---------------------------
+
+AUTHORS = ["Neil Gaiman and Terry Pratchett", "Yuval Noah Harari", "Stephen King", "Dan Brown",
+           "Friedrich Hayek", "Douglas Adams", "Neil deGrasse Tyson"]
+GENRES = ["Comedy, Fantasy", "Science, History", "Horror", "Action, Mystery", "Politics, Economics",
+          "Science Fiction, Comedy", "Science, Astrophysics"]
+
+
+class DictBook:
+    def __init__(self, title, author, publication_year, genre, is_borrowed=False, borrowed_timestamp=None):
+        """
+        The previous Book representation: the same attributes, stored in an instance __dict__.
+        """
+        self.title = title
+        self.author = author
+        self.publication_year = publication_year
+        self.genre = genre
+        self.is_borrowed = is_borrowed
+        self.borrowed_timestamp = borrowed_timestamp
+
+
+def make_catalog(count):
+    """
+    Build the JSON text of a catalog with the given number of books.
+    """
+    random.seed(0)
+    return json.dumps([{"title": f"Book number {i}", "author": random.choice(AUTHORS),
+                        "publication_year": random.randint(1900, 2024), "genre": random.choice(GENRES),
+                        "is_borrowed": False, "borrowed_timestamp": None} for i in range(count)])
+
+
+def bytes_per_book(book_class, catalog, count):
+    """
+    Measure the memory kept by the books of the catalog, per book. The parsed JSON is freed, so what
+    is left are the books and the strings they still refer to.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    book_dicts = json.loads(catalog)
+    books = [book_class(**book_dict) for book_dict in book_dicts]
+    del book_dicts
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del books
+    return (after - before) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    catalog = make_catalog(count)
+    before = bytes_per_book(DictBook, catalog, count)
+    after = bytes_per_book(Book, catalog, count)
+    print(f"{count} books")
+    print(f"before (__dict__):          {before:8.1f} bytes per book")
+    print(f"after (__slots__, interned): {after:8.1f} bytes per book")
+    print(f"saved:                      {before - after:8.1f} bytes per book ({(before - after) / before:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,176 @@
+import sys
+import time
+from collections import deque
 from datetime import datetime
 
 # ---------------------------
 # This class defines the essential characteristics and actions
 # of a book in the library management system.
+#
+# A library may hold a very large number of books, so Book is kept compact:
+# it declares __slots__ (no per-instance __dict__), and the author and genre
+# strings, which repeat across the catalog, are interned so all the books
+# share a single copy of each value. See benchmarks/book_memory.py.
+#
+# Every book in a library has a unique id, an integer the library gives it
+# when it is added. The id never changes, is saved with the book, and tells
+# apart books that share a title.
+#
+# A book is a work (a catalog entry) the library may hold several copies of.
+# The copies are numbered from 1, and every copy on loan has a loan record
+# (a Loan: its number, who borrowed it and when, also as seconds since the
+# epoch so loan durations are cheap to compute, see history.py, and when it
+# is due back, see overdue.py). While copies are on
+# loan, the numbers of the copies on the shelf are kept in a list, so
+# borrowing or returning a copy is a constant-time update however many
+# copies there are. Most books have no copy on loan, so the loan records and
+# the shelf are only created when a copy is borrowed, and dropped again when
+# the last one comes back. A book counts as borrowed when none of its copies
+# is left on the shelf.
+#
+# Users can place a hold on a borrowed book: the holds of a book are a FIFO
+# queue of users (a HoldQueue, also only created when needed), and a copy
+# that comes back goes to the first of them (see Library.return_book).
 # ---------------------------
 
+def _intern(value):
+    """
+    Intern a string value, so equal values share one object. Other values are returned unchanged.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+class Loan:
+    __slots__ = ("copy", "borrowed_timestamp", "user", "borrowed_at", "due_at")
+
+    def __init__(self, copy, borrowed_timestamp=None, user=None, borrowed_at=None, due_at=None):
+        """
+        Constructor method for the Loan class, the record of a copy of a book on loan.
+
+        :param copy: (int) The number of the copy.
+        :param borrowed_timestamp: (str, optional) Timestamp when the copy was borrowed. Defaults to None.
+        :param user: (str, optional) The user who borrowed the copy. Defaults to None, for a loan made
+                     before loans were recorded per user.
+        :param borrowed_at: (float, optional) The time the copy was borrowed, in seconds since the epoch.
+                            Defaults to None, for a loan made before it was recorded.
+        :param due_at: (float, optional) The time the copy is due back, in seconds since the epoch. Defaults to
+                       None, for a loan without a due date.
+        """
+        self.copy = copy
+        self.borrowed_timestamp = borrowed_timestamp
+        self.user = user
+        self.borrowed_at = borrowed_at
+        self.due_at = due_at
+
+    def to_dict(self):
+        """
+        Converts the Loan instance into a dictionary format.
+
+        :returns:
+            dict: The copy, borrowed_timestamp, user, borrowed_at and due_at of the loan.
+        """
+        return {"copy": self.copy, "borrowed_timestamp": self.borrowed_timestamp, "user": self.user,
+                "borrowed_at": self.borrowed_at, "due_at": self.due_at}
+
+
+class HoldQueue:
+    __slots__ = ("_queue", "_tickets")
+
+    def __init__(self, users=()):
+        """
+        Constructor method for the HoldQueue class, the users waiting for a copy of a book, first come first served.
+
+        Every user in the queue has a ticket number, consecutive from the front of the queue to its back, so the
+        position of a user is the difference between their ticket and the ticket of the front: adding a user,
+        serving the front one and looking up a position are constant-time. Only a user leaving from the middle
+        of the queue renumbers the tickets behind them.
+
+        :param users: (iterable, optional) The users waiting, first in line first.
+        """
+        # (ticket, user) from the front of the queue to its back, and user -> ticket
+        self._queue = deque()
+        self._tickets = {}
+        for user in users:
+            self.append(user)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        return (user for _, user in self._queue)
+
+    def __contains__(self, user):
+        return user in self._tickets
+
+    def append(self, user):
+        """
+        Add a user to the back of the queue.
+
+        :param user: (str) The user.
+
+        :returns:
+            int: The position of the user in the queue, from 1.
+
+        :raises ValueError: If the user is already in the queue.
+        """
+        if user in self._tickets:
+            raise ValueError(f'"{user}" is already waiting.')
+        ticket = self._queue[-1][0] + 1 if self._queue else 0
+        self._queue.append((ticket, user))
+        self._tickets[user] = ticket
+        return len(self._queue)
+
+    def first(self):
+        """
+        Get the user at the front of the queue.
+
+        :returns:
+            str: The user, or None if the queue is empty.
+        """
+        return self._queue[0][1] if self._queue else None
+
+    def remove(self, user):
+        """
+        Remove a user from the queue.
+
+        :param user: (str) The user.
+
+        :returns:
+            bool: True if the user was in the queue.
+        """
+        ticket = self._tickets.pop(user, None)
+        if ticket is None:
+            return False
+        if ticket == self._queue[0][0]:
+            self._queue.popleft()
+        else:
+            # the users behind move up one place
+            users = [other for _, other in self._queue if other != user]
+            self._queue.clear()
+            self._tickets.clear()
+            for other in users:
+                self.append(other)
+        return True
+
+    def position(self, user):
+        """
+        Get the position of a user in the queue.
+
+        :param user: (str) The user.
+
+        :returns:
+            int: The position, from 1 for the front of the queue, or None if the user isn't in the queue.
+        """
+        ticket = self._tickets.get(user)
+        return ticket - self._queue[0][0] + 1 if ticket is not None else None
+
+
 class Book:
-    def __init__(self, title, author, publication_year, genre, is_borrowed=False, borrowed_timestamp=None):
+    __slots__ = ("title", "author", "publication_year", "genre", "borrowed_timestamp", "id", "copies", "_loans",
+                 "_shelf", "_holds")
+
+    def __init__(self, title, author, publication_year, genre, is_borrowed=False, borrowed_timestamp=None, id=None,
+                 copies=1, loans=None, holds=None):
         """
         Constructor method for the Book class.
 
@@ -15,19 +179,72 @@ class Book:
         :param publication_year: (int) The year the book was published.
         :param genre: (str) The genre of the book.
         :param borrowed_timestamp: (str, optional) Timestamp when the book was borrowed. Defaults to None.
+        :param id: (int, optional) The unique id of the book in its library. Defaults to None, for a book
+                   that wasn't added to a library yet.
+        :param copies: (int, optional) The number of copies of the book. Defaults to 1.
+        :param loans: (list, optional) The loan records of the copies on loan, as returned by loan_records. Without
+                      them, is_borrowed=True means every copy is on loan since borrowed_timestamp (the way
+                      books were saved before they had copies).
+        :param holds: (list, optional) The users waiting for a copy, first in line first.
 
         Initializes a new instance of the Book class with the given details.
         """
 
         self.title = title
-        self.author = author
+        self.author = _intern(author)
         self.publication_year = publication_year
-        self.genre = genre
-        self.is_borrowed = is_borrowed
+        self.genre = _intern(genre)
         self.borrowed_timestamp = borrowed_timestamp
+        self.id = id
+        self.copies = copies
+        # copy number -> Loan (oldest loan first), and the numbers of the copies on the shelf (the next one to
+        # lend last); both None while no copy is on loan
+        self._loans = None
+        self._shelf = None
+        # HoldQueue, None while nobody is waiting
+        self._holds = HoldQueue(holds) if holds else None
+        if loans:
+            self._open_loans({loan["copy"]: Loan(**loan) for loan in loans})
+        elif is_borrowed and loans is None:
+            self._open_loans({copy: Loan(copy, borrowed_timestamp) for copy in range(1, copies + 1)})
 
+    @property
+    def loans(self):
+        """
+        The copies on loan, as a dictionary of copy number -> Loan, oldest loan first.
+        """
+        return self._loans if self._loans is not None else {}
 
-    def update(self, title=None, author=None, publication_year=None, genre=None):
+    @property
+    def holds(self):
+        """
+        The users waiting for a copy, as a HoldQueue (or an empty tuple), first in line first.
+        """
+        return self._holds if self._holds is not None else ()
+
+    @property
+    def is_borrowed(self):
+        """
+        True if every copy of the book is on loan.
+        """
+        return self._shelf is not None and not self._shelf
+
+    @property
+    def available(self):
+        """
+        The number of copies on the shelf.
+        """
+        return self.copies if self._shelf is None else len(self._shelf)
+
+    def _open_loans(self, loans):
+        """
+        Set the loan records, and the shelf to the copies that are not on loan.
+        """
+        self._loans = loans
+        self._shelf = [copy for copy in range(self.copies, 0, -1) if copy not in loans]
+
+
+    def update(self, title=None, author=None, publication_year=None, genre=None, copies=None):
         """
         Updates the attributes of the Book instance.
 
@@ -35,6 +252,7 @@ class Book:
         :param author: (str, optional) The new author of the book. Defaults to None.
         :param publication_year: (int, optional) The new publication year of the book. Defaults to None.
         :param genre: (str, optional) The new genre of the book. Defaults to None.
+        :param copies: (int, optional) The new number of copies of the book (see set_copies). Defaults to None.
 
         Updates the attributes of the Book instance with the new values provided.
         If a parameter is not provided, the corresponding attribute remains unchanged.
@@ -43,11 +261,37 @@ class Book:
         if title:
             self.title = title
         if author:
-            self.author = author
+            self.author = _intern(author)
         if publication_year:
             self.publication_year = publication_year
         if genre:
-            self.genre = genre
+            self.genre = _intern(genre)
+        if copies:
+            self.set_copies(copies)
+
+    def set_copies(self, copies):
+        """
+        Change the number of copies of the book. Copies can be added at any time, but only copies on the
+        shelf can be taken away: the copies above the new number must not be on loan.
+
+        :param copies: (int) The new number of copies, at least 1.
+
+        :raises ValueError: If the number is less than 1 or a copy above it is on loan.
+        """
+        if copies < 1 or any(copy > copies for copy in self.loans):
+            raise ValueError(f'"{self.title}" can\'t have {copies} copies while its copies above that are on loan.')
+        self.copies = copies
+        if self._loans is not None:
+            self._open_loans(self._loans)
+
+    def genres(self):
+        """
+        Splits the genre of the book, which may combine several genres (like "Comedy, Fantasy").
+
+        :returns:
+            list: The names of the genres of the book.
+        """
+        return [name.strip() for name in str(self.genre).split(',') if name.strip()]
 
     def to_dict(self):
         """
@@ -71,28 +315,112 @@ class Book:
             "borrowed_timestamp": self.borrowed_timestamp
         }
 
+    def to_storage_dict(self):
+        """
+        Converts the Book instance into the dictionary a storage saves it as: the fields of to_dict, plus the
+        id, the number of copies, the loan records of the copies on loan and the users waiting for a copy.
+        Book(**book.to_storage_dict()) builds the same book again.
+
+        :returns:
+            dict: The fields of the book.
+        """
+        book_dict = self.to_dict()
+        book_dict.update(id=self.id, copies=self.copies, loans=self.loan_records(), holds=list(self.holds))
+        return book_dict
+
+    def loan_records(self):
+        """
+        Converts the loans of the copies on loan into dictionaries (see Loan.to_dict), oldest loan first.
 
-    def borrow(self):
+        :returns:
+            list: The loan records.
         """
-       Borrow the book.
+        return [loan.to_dict() for loan in self.loans.values()]
 
-       :returns: (bool) True if the book was successfully borrowed, False if it was already borrowed.
+    def borrow(self, copy=None, user=None, loan_period=None):
+        """
+       Borrow a copy of the book.
+
+       :param copy: (int, optional) The number of the copy to borrow. Defaults to the next copy on the shelf.
+       :param user: (str, optional) The user borrowing the copy. Defaults to None.
+       :param loan_period: (float, optional) The number of seconds until the copy is due back. Defaults to None,
+                           for no due date.
+
+       :returns: (int) The number of the borrowed copy, or None if no copy (or not that copy) is on the shelf.
        """
-        if not self.is_borrowed:
-            self.is_borrowed = True
-            self.borrowed_timestamp = datetime.now().strftime("%d-%m-%Y   %H:%M")
-            return True
-        return False
+        if self._loans is None:
+            self._open_loans({})
+        if copy is None:
+            if not self._shelf:
+                return None
+            copy = self._shelf.pop()
+        elif copy in self._shelf:
+            self._shelf.remove(copy)
+        else:
+            return None
+        self.borrowed_timestamp = datetime.now().strftime("%d-%m-%Y   %H:%M")
+        borrowed_at = time.time()
+        self._loans[copy] = Loan(copy, self.borrowed_timestamp, user, borrowed_at,
+                                 borrowed_at + loan_period if loan_period is not None else None)
+        return copy
+
+    def hold(self, user):
+        """
+        Place a hold on the book: the user waits for a copy to come back.
+
+        :param user: (str) The user.
+
+        :returns:
+            int: The position of the user in the queue of holds, from 1.
+
+        :raises ValueError: If the user is already waiting for the book.
+        """
+        if self._holds is None:
+            self._holds = HoldQueue()
+        return self._holds.append(user)
 
-    def return_book(self):
+    def cancel_hold(self, user):
         """
-        Return the borrowed book.
+        Take a user out of the queue of holds (they gave up waiting, or got a copy).
+
+        :param user: (str) The user.
+
+        :returns:
+            bool: True if the user was waiting for the book.
+        """
+        if self._holds is None or not self._holds.remove(user):
+            return False
+        if not self._holds:
+            self._holds = None
+        return True
+
+    def hold_position(self, user):
+        """
+        Get the position of a user in the queue of holds.
+
+        :param user: (str) The user.
+
+        :returns:
+            int: The position, from 1 for the next user to get a copy, or None if the user isn't waiting.
+        """
+        return self._holds.position(user) if self._holds is not None else None
+
+    def return_book(self, copy=None):
+        """
+        Return a borrowed copy of the book.
+
+        :param copy: (int, optional) The number of the copy to return. Defaults to the copy on loan the longest.
 
         :returns:
-            bool: True if the book was successfully returned, False if it was not borrowed.
+            int: The number of the returned copy, or None if no copy (or not that copy) is on loan.
         """
-        if self.is_borrowed:
-            self.is_borrowed = False
-            self.borrowed_timestamp = datetime.now().strftime("%d-%m-%Y   %H:%M")
-            return True
-        return False
+        if not self._loans or (copy is not None and copy not in self._loans):
+            return None
+        if copy is None:
+            copy = next(iter(self._loans))
+        del self._loans[copy]
+        self._shelf.append(copy)
+        if not self._loans:
+            self._loans = self._shelf = None
+        self.borrowed_timestamp = datetime.now().strftime("%d-%m-%Y   %H:%M")
+        return copy
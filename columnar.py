@@ -0,0 +1,351 @@
+import threading
+from array import array
+from collections import Counter
+from itertools import compress
+from book import Book
+
+# ---------------------------
+# This class stores a catalog of books column by column, for reporting over
+# very large collections (counts per genre, year histograms, borrowed ratios).
+#
+# Instead of one Book object per book, every attribute is kept in its own
+# compact column: the author and genre columns are dictionary-encoded (an
+# array of small integer codes plus the list of distinct values), the years,
+# ids and numbers of copies are integer arrays, and the borrowed state (no
+# copy left on the shelf) is a bitset. The loan records and the holds are
+# only kept for the rows that have some. A book is a
+# row number; a Book object is only built (materialized) when asked for.
+#
+# Filters and aggregates work on whole columns at once: every filter turns a
+# column into a mask with a single C-level pass (map/bytes), the masks are
+# combined as big integers, and the matching rows are picked out with
+# itertools.compress. Deleted rows are only marked as such in the "alive"
+# bitset, so row numbers never change.
+#
+# A catalog created with details=False (the analytics mirror a Library keeps
+# with columnar=True, next to its Book objects) only keeps the columns the
+# filters and aggregates use: no titles, timestamps, loans or holds, so its
+# rows can't be materialized.
+# ---------------------------
+
+# _EXPAND[byte] is the 8-byte mask (one byte per bit, least significant bit first) of a bitset byte
+_EXPAND = [bytes((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
+
+
+class Column:
+    def __init__(self):
+        """
+        Initialize an empty dictionary-encoded column: every row holds the code of its value.
+        """
+        self.values = []
+        self.codes_by_value = {}
+        self.codes = array('I')
+
+    def encode(self, value):
+        """
+        Get the code of a value, giving it a new code if it wasn't seen before.
+
+        :param value: The value.
+
+        :returns:
+            int: The code of the value.
+        """
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = self.codes_by_value[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnarCatalog:
+    def __init__(self, details=True):
+        """
+        Initialize an empty ColumnarCatalog object.
+
+        :param details: (bool, optional) False to keep only the columns of the filters and aggregates, without the
+                        titles, timestamps, loans and holds needed to materialize a row. Defaults to True.
+        """
+        self.details = details
+        # the number of rows, deleted ones included
+        self.size = 0
+        self.titles = []
+        self.authors = Column()
+        self.genres = Column()
+        self.years = array('i')
+        # the book ids, -1 for a book without one
+        self.ids = array('q')
+        self.copies = array('I')
+        # row -> borrowed (or returned) timestamp, row -> loan records (as in Book.loan_records) of the copies on loan
+        self.timestamps = {}
+        self.loans = {}
+        # row -> users waiting for a copy, first in line first
+        self.holds = {}
+        self._alive = bytearray()
+        self._borrowed = bytearray()
+        self._alive_count = 0
+        # guards the bitsets, whose bytes are shared by several rows
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_books(cls, books):
+        """
+        Build a catalog from books, for example the iterator returned by a storage's load method.
+
+        :param books: (iterable) The Book objects (only read, not kept).
+
+        :returns:
+            ColumnarCatalog: The catalog, with the books as rows 0, 1, 2...
+        """
+        catalog = cls()
+        for book in books:
+            catalog.append(book)
+        return catalog
+
+    def __len__(self):
+        """
+        The number of books (not counting deleted rows).
+        """
+        return self._alive_count
+
+    def append(self, book):
+        """
+        Add a book as a new row.
+
+        :param book: (Book) The book to add.
+
+        :returns:
+            int: The row number of the book.
+        """
+        row = self.size
+        self.size += 1
+        if self.details:
+            self.titles.append(book.title)
+        self.authors.codes.append(self.authors.encode(book.author))
+        self.genres.codes.append(self.genres.encode(book.genre))
+        self.years.append(book.publication_year)
+        self.ids.append(book.id if book.id is not None else -1)
+        self.copies.append(book.copies)
+        with self._lock:
+            if row % 8 == 0:
+                self._alive.append(0)
+                self._borrowed.append(0)
+            self._set_bit(self._alive, row, True)
+            self._alive_count += 1
+        self._set_book_borrowed(row, book)
+        return row
+
+    def update(self, row, book):
+        """
+        Replace the values of a row with those of a book.
+
+        :param row: (int) The row number.
+        :param book: (Book) The book holding the new values.
+        """
+        if self.details:
+            self.titles[row] = book.title
+        self.authors.codes[row] = self.authors.encode(book.author)
+        self.genres.codes[row] = self.genres.encode(book.genre)
+        self.years[row] = book.publication_year
+        self.ids[row] = book.id if book.id is not None else -1
+        self.copies[row] = book.copies
+        self._set_book_borrowed(row, book)
+
+    def remove(self, row):
+        """
+        Mark a row as deleted.
+
+        :param row: (int) The row number.
+        """
+        with self._lock:
+            if self._get_bit(self._alive, row):
+                self._set_bit(self._alive, row, False)
+                self._alive_count -= 1
+        if not self.details:
+            return
+        self.titles[row] = None
+        self.timestamps.pop(row, None)
+        self.loans.pop(row, None)
+        self.holds.pop(row, None)
+
+    def set_borrowed(self, row, is_borrowed, borrowed_timestamp=None, loans=None, holds=None):
+        """
+        Set the borrowed state of a row.
+
+        :param row: (int) The row number.
+        :param is_borrowed: (bool) True if the book is borrowed (no copy is left on the shelf).
+        :param borrowed_timestamp: (str, optional) The borrowed (or returned) timestamp of the book. The timestamp,
+                                   loans and holds are only kept by a catalog with details.
+        :param loans: (list, optional) The loan records of the copies on loan, as in Book.loan_records. Without
+                      them, a borrowed book has all its copies on loan since borrowed_timestamp.
+        :param holds: (list, optional) The users waiting for a copy, first in line first.
+        """
+        with self._lock:
+            self._set_bit(self._borrowed, row, is_borrowed)
+        if not self.details:
+            return
+        if borrowed_timestamp is None:
+            self.timestamps.pop(row, None)
+        else:
+            self.timestamps[row] = borrowed_timestamp
+        if loans:
+            self.loans[row] = loans
+        else:
+            self.loans.pop(row, None)
+        if holds:
+            self.holds[row] = holds
+        else:
+            self.holds.pop(row, None)
+
+    def _set_book_borrowed(self, row, book):
+        """
+        Set the borrowed state of a row from its book (see set_borrowed).
+        """
+        if self.details:
+            self.set_borrowed(row, book.is_borrowed, book.borrowed_timestamp, book.loan_records(), list(book.holds))
+        else:
+            self.set_borrowed(row, book.is_borrowed)
+
+    def book(self, row):
+        """
+        Materialize a row as a Book object (a new object, changing it doesn't change the catalog).
+
+        :param row: (int) The row number.
+
+        :returns:
+            Book: The book of the row.
+
+        :raises ValueError: If the catalog doesn't keep the details of its rows.
+        """
+        if not self.details:
+            raise ValueError('The rows of a catalog without details can\'t be materialized.')
+        return Book(self.titles[row], self.authors.values[self.authors.codes[row]], self.years[row],
+                    self.genres.values[self.genres.codes[row]], self._get_bit(self._borrowed, row),
+                    self.timestamps.get(row), self.ids[row] if self.ids[row] != -1 else None, self.copies[row],
+                    self.loans.get(row), self.holds.get(row))
+
+    def select(self, author=None, genre=None, publication_year=None, is_borrowed=None):
+        """
+        Find the rows matching all the given values (like Library.list_books, empty values don't filter).
+
+        :param author: (str, optional) Author's name.
+        :param genre: (str, optional) Genre.
+        :param publication_year: (int, optional) Year of publication.
+        :param is_borrowed: (bool, optional) True for borrowed books only, False for available books only.
+
+        :returns:
+            list: The matching row numbers, in increasing order.
+        """
+        mask = self._mask(self._alive)
+        if author:
+            mask &= self._equal_mask(self.authors, author)
+        if genre:
+            mask &= self._equal_mask(self.genres, genre)
+        if publication_year:
+            mask &= int.from_bytes(bytes(map(publication_year.__eq__, self.years)), 'little')
+        if is_borrowed is not None:
+            borrowed = self._mask(self._borrowed)
+            mask &= borrowed if is_borrowed else ~borrowed
+        return list(compress(range(self.size), self._selectors(mask)))
+
+    def count_by_genre(self, split=False):
+        """
+        Count the books of every genre.
+
+        :param split: (bool, optional) True to count every genre of a combined value like "Comedy, Fantasy"
+                      separately. Defaults to False.
+
+        :returns:
+            Counter: The number of books per genre.
+        """
+        counts = self._count_codes(self.genres)
+        if not split:
+            return counts
+        split_counts = Counter()
+        for value, count in counts.items():
+            for genre in value.split(','):
+                split_counts[genre.strip()] += count
+        return split_counts
+
+    def count_by_author(self):
+        """
+        Count the books of every author.
+
+        :returns:
+            Counter: The number of books per author.
+        """
+        return self._count_codes(self.authors)
+
+    def year_histogram(self, bucket_size=1):
+        """
+        Count the books published in every year (or every bucket of years, like decades).
+
+        :param bucket_size: (int, optional) The number of years per bucket. Defaults to 1.
+
+        :returns:
+            dict: The number of books per bucket, keyed by the first year of the bucket, in increasing order.
+        """
+        counts = Counter(compress(self.years, self._selectors(self._mask(self._alive))))
+        histogram = Counter()
+        for year, count in counts.items():
+            histogram[year - year % bucket_size] += count
+        return dict(sorted(histogram.items()))
+
+    def borrowed_ratio(self):
+        """
+        Get the share of the books that are borrowed.
+
+        :returns:
+            float: The number of borrowed books divided by the number of books (0.0 for an empty catalog).
+        """
+        if not self._alive_count:
+            return 0.0
+        alive = int.from_bytes(self._alive, 'little')
+        borrowed = int.from_bytes(self._borrowed, 'little')
+        return (alive & borrowed).bit_count() / self._alive_count
+
+    def _count_codes(self, column):
+        """
+        Count the rows of every value of a dictionary-encoded column.
+        """
+        counts = Counter(compress(column.codes, self._selectors(self._mask(self._alive))))
+        return Counter({column.values[code]: count for code, count in counts.items()})
+
+    def _equal_mask(self, column, value):
+        """
+        Get the byte mask of the rows of a dictionary-encoded column holding a value.
+        """
+        code = column.codes_by_value.get(value)
+        if code is None:
+            return 0
+        return int.from_bytes(bytes(map(code.__eq__, column.codes)), 'little')
+
+    def _mask(self, bitset):
+        """
+        Expand a bitset into a byte mask (one byte per row, 1 or 0), as an integer.
+        """
+        with self._lock:
+            expanded = b''.join(map(_EXPAND.__getitem__, bitset))
+        return int.from_bytes(expanded[:self.size], 'little')
+
+    def _selectors(self, mask):
+        """
+        Turn a byte mask into the selectors for itertools.compress over the rows.
+        """
+        return mask.to_bytes(self.size, 'little')
+
+    @staticmethod
+    def _get_bit(bitset, row):
+        """
+        Get a bit of a bitset.
+        """
+        return bool(bitset[row >> 3] & (1 << (row & 7)))
+
+    @staticmethod
+    def _set_bit(bitset, row, value):
+        """
+        Set or clear a bit of a bitset.
+        """
+        if value:
+            bitset[row >> 3] |= 1 << (row & 7)
+        else:
+            bitset[row >> 3] &= ~(1 << (row & 7)) & 0xFF
@@ -0,0 +1,191 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+# ---------------------------
+# This class keeps the history of the loans of a library: an append-only
+# stream of events (a copy was borrowed, a copy was returned), each with the
+# time it happened as seconds since the epoch (UTC).
+#
+# The events are appended to a JSON-lines file, one event per line, and are
+# never rewritten. Alongside the file, the history keeps rolling aggregates
+# per hour and per day: for every bucket of time the number of loans per
+# title and per genre, and the number and total duration of the loans that
+# ended in it (loans made before the history was kept have no known duration
+# and are left out). A report over a period adds up the buckets of the
+# period, so it never rescans the raw events. Buckets older than RETENTION
+# are dropped (the events stay in the file).
+#
+# Several processes may append to the same file: each process only reads
+# the events appended since it last looked (remembering how far it has
+# read, like the journal of JournaledStorage), so the aggregates of every
+# process include the events of all of them.
+# ---------------------------
+
+# resolution -> length of a bucket in seconds
+RESOLUTIONS = {"hour": 3600, "day": 86400}
+# resolution -> how long its buckets are kept, in seconds
+RETENTION = {"hour": 7 * 86400, "day": 366 * 86400}
+
+logger = logging.getLogger(__name__)
+
+
+class LoanStats:
+    __slots__ = ("loans", "titles", "genres", "returns", "total_duration")
+
+    def __init__(self):
+        """
+        Initialize an empty LoanStats object, the aggregates of the loan events of a period.
+        """
+        self.loans = 0
+        self.titles = Counter()
+        self.genres = Counter()
+        self.returns = 0
+        self.total_duration = 0.0
+
+    @property
+    def average_duration(self):
+        """
+        The average duration of the loans that ended in the period, in seconds (None if none did).
+        """
+        return self.total_duration / self.returns if self.returns else None
+
+    def add(self, other):
+        """
+        Add the aggregates of another period to these.
+
+        :param other: (LoanStats) The aggregates to add.
+        """
+        self.loans += other.loans
+        self.titles.update(other.titles)
+        self.genres.update(other.genres)
+        self.returns += other.returns
+        self.total_duration += other.total_duration
+
+
+class LoanHistory:
+    def __init__(self, filename=None):
+        """
+        Initialize a LoanHistory object, reading the events already in its file.
+
+        :param filename: (str, optional) The JSON-lines file of the events. Defaults to None, to keep the
+                         aggregates in memory only.
+        """
+        self.filename = filename
+        self._offset = 0
+        self._lock = threading.Lock()
+        # resolution -> {bucket start: LoanStats}, and the time of the newest event
+        self._buckets = {resolution: {} for resolution in RESOLUTIONS}
+        self._latest = 0
+        with self._lock:
+            self._catch_up()
+
+    def record(self, event, book, loan, timestamp=None):
+        """
+        Append the event of a loan to the history.
+
+        :param event: (str) "borrow" or "return".
+        :param book: (Book) The book of the borrowed copy.
+        :param loan: (Loan) The loan of the copy.
+        :param timestamp: (float, optional) The time of the event in seconds since the epoch. Defaults to now.
+        """
+        record = {"event": event, "time": time.time() if timestamp is None else timestamp, "book": book.id,
+                  "copy": loan.copy, "user": loan.user, "title": book.title, "genres": book.genres()}
+        if event == "return" and loan.borrowed_at is not None:
+            record["duration"] = record["time"] - loan.borrowed_at
+        with self._lock:
+            if self.filename is None:
+                self._apply(record)
+                return
+            with open(self.filename, 'ab') as file:
+                file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+            # applied when read back, together with the events other processes appended before it
+            self._catch_up()
+
+    def stats(self, start=None, end=None, resolution="day"):
+        """
+        Add up the aggregates of the buckets of a period.
+
+        :param start: (float, optional) The start of the period in seconds since the epoch. Defaults to the
+                      oldest bucket kept.
+        :param end: (float, optional) The end of the period (excluded). Defaults to the newest bucket.
+        :param resolution: (str, optional) "hour" or "day": the buckets to add up. A bucket counts if it starts
+                           within the period. Defaults to "day".
+
+        :returns:
+            LoanStats: The aggregates of the period.
+
+        :raises ValueError: If the resolution isn't "hour" or "day".
+        """
+        total = LoanStats()
+        for bucket_start, stats in self.buckets(resolution):
+            if (start is None or bucket_start >= start) and (end is None or bucket_start < end):
+                total.add(stats)
+        return total
+
+    def buckets(self, resolution="hour"):
+        """
+        Get the aggregates of every bucket kept for a resolution.
+
+        :param resolution: (str, optional) "hour" or "day". Defaults to "hour".
+
+        :returns:
+            list: List of (bucket start in seconds since the epoch, LoanStats) tuples, oldest first.
+
+        :raises ValueError: If the resolution isn't "hour" or "day".
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown resolution "{resolution}".')
+        with self._lock:
+            self._catch_up()
+            return sorted(self._buckets[resolution].items(), key=lambda item: item[0])
+
+    def _catch_up(self):
+        """
+        Read and apply the events appended to the file since it was last read. The history lock must be held.
+        """
+        if self.filename is None:
+            return
+        try:
+            file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return
+        # read line by line, so a long history is never held in memory at once
+        with file:
+            file.seek(self._offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # the last line may still be being written
+                    break
+                self._offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping a broken loan history event in %s", self.filename)
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        """
+        Add an event to the aggregates of its buckets, and drop the buckets that are too old.
+        """
+        self._latest = max(self._latest, record["time"])
+        for resolution, size in RESOLUTIONS.items():
+            if record["time"] < self._latest - RETENTION[resolution]:
+                continue
+            buckets = self._buckets[resolution]
+            bucket_start = record["time"] // size * size
+            stats = buckets.get(bucket_start)
+            if stats is None:
+                stats = buckets[bucket_start] = LoanStats()
+                for old in [old for old in buckets if old < self._latest - RETENTION[resolution]]:
+                    del buckets[old]
+            if record["event"] == "borrow":
+                stats.loans += 1
+                stats.titles[record["title"]] += 1
+                stats.genres.update(record["genres"])
+            elif record.get("duration") is not None:
+                stats.returns += 1
+                stats.total_duration += record["duration"]
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from book import Book
+from library import Library
+from storage import open_storage
+from validation import validate_rows
+
+# ---------------------------
+# This module imports a catalog of books into a library in bulk, from a CSV
+# file (with a header row: title, author, year, genre and optionally copies)
+# or a JSON Lines file (one JSON object per line, with the same fields, or
+# publication_year instead of year, as in Book.to_dict).
+#
+# The file is streamed: the rows are read in chunks, parsed and validated
+# (with the rules of the librarian's page, see validation.py) and handed to
+# Library.add_books one at a time, and add_books saves all the books in a
+# single write at the end, so importing n books costs one write instead of
+# n. A row that can't be read or fails validation is reported with its line
+# number and skipped; the rest of the file is still imported.
+#
+# Parsing and validating is pure CPU work, so with several workers the
+# chunks are spread over a pool of processes. The checked chunks are taken
+# back in the order of the file, so the books are added (and the errors
+# reported) in the same order whatever the number of workers.
+#
+# Usage: python importer.py catalog.csv [--format csv|jsonl] [--workers n] [--library library.json]
+#                                       [--storage json|journal|sqlite]
+# ---------------------------
+
+# file extension -> format
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+# the number of rows checked at a time
+CHUNK_SIZE = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        """
+        Initialize an empty ImportReport object, the outcome of an import.
+        """
+        # the books in the library the imported rows ended up in, and (line number, message) of the rejected rows
+        self.books = []
+        self.errors = []
+
+    def __str__(self):
+        return f'Imported {len(self.books)} books, {len(self.errors)} rows rejected.'
+
+
+def format_of(filename):
+    """
+    Guess the format of a catalog file from its extension.
+
+    :param filename: (str) The name of the file.
+
+    :returns:
+        str: "csv" or "jsonl".
+
+    :raises ValueError: If the extension isn't one of FORMATS.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unknown catalog format "{extension}", expected one of {", ".join(FORMATS)}.')
+    return FORMATS[extension]
+
+
+def read_chunks(file, format, chunk_size=CHUNK_SIZE):
+    """
+    Read the rows of a catalog file in chunks. CSV rows are parsed here, JSON lines are left for check_chunk
+    to parse (in a worker process when there are several).
+
+    :param file: (file) The catalog, opened in text mode (with newline='' for CSV).
+    :param format: (str) "csv" or "jsonl".
+    :param chunk_size: (int, optional) The number of rows of a chunk. Defaults to CHUNK_SIZE.
+
+    :returns:
+        generator: Lists of (line number, row) tuples, where a row is a dictionary (CSV) or a line (JSON Lines).
+
+    :raises ValueError: If the format is unknown.
+    """
+    if format == "csv":
+        reader = csv.DictReader(file)
+        rows = ((reader.line_num, row) for row in reader)
+    elif format == "jsonl":
+        rows = ((number, line) for number, line in enumerate(file, 1) if line.strip())
+    else:
+        raise ValueError(f'Unknown catalog format "{format}".')
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_chunk(format, chunk):
+    """
+    Parse (for JSON Lines) and validate a chunk of rows (see validate_rows). A module-level function, so it can
+    be run in a worker process.
+
+    :param format: (str) "csv" or "jsonl".
+    :param chunk: (list) A chunk of rows, as read_chunks yields it.
+
+    :returns:
+        list: List of (line number, fields tuple, error message) tuples in the order of the chunk, with either
+              the fields or the error message None.
+    """
+    if format == "csv":
+        return validate_rows(chunk)
+    checked = []
+    for number, line in chunk:
+        try:
+            row = json.loads(line)
+        except ValueError:
+            checked.append((number, None, 'Invalid JSON.'))
+            continue
+        if not isinstance(row, dict):
+            checked.append((number, None, 'Expected a JSON object.'))
+            continue
+        checked.extend(validate_rows([(number, row)]))
+    return checked
+
+
+def check_chunks(chunks, format, workers=1):
+    """
+    Check chunks of rows (see check_chunk), spread over a pool of worker processes when there are several.
+    Only a few chunks per worker are read ahead, so a large file isn't read into memory at once.
+
+    :param chunks: (iterable) The chunks of rows.
+    :param format: (str) "csv" or "jsonl".
+    :param workers: (int, optional) The number of worker processes, 1 to check the rows in this process.
+                    Defaults to 1.
+
+    :returns:
+        generator: The checked chunks, in the order of the given chunks.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield check_chunk(format, chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(check_chunk, format, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_books(library, file, format, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Import the books of a catalog file into a library (see the top of this module).
+
+    :param library: (Library) The library to add the books to.
+    :param file: (file) The catalog, opened in text mode (with newline='' for CSV).
+    :param format: (str) "csv" or "jsonl".
+    :param workers: (int, optional) The number of worker processes parsing and validating the rows, 1 to do it
+                    in this process. Defaults to 1.
+    :param chunk_size: (int, optional) The number of rows handed to a worker at a time. Defaults to CHUNK_SIZE.
+
+    :returns:
+        ImportReport: The imported books and the rejected rows, in the order of the file.
+
+    :raises ValueError: If the format is unknown.
+    """
+    if format not in FORMATS.values():
+        raise ValueError(f'Unknown catalog format "{format}".')
+    report = ImportReport()
+
+    def valid_books():
+        for checked in check_chunks(read_chunks(file, format, chunk_size), format, workers):
+            for number, fields, error in checked:
+                if error is not None:
+                    report.errors.append((number, error))
+                    continue
+                title, author, publication_year, genre, copies = fields
+                yield Book(title, author, publication_year, genre, copies=copies)
+
+    report.books = library.add_books(valid_books())
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a CSV or JSON Lines catalog of books into the library.")
+    parser.add_argument("catalog", help="the catalog file")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())),
+                        help="the format of the catalog (by default, guessed from its extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="the number of processes parsing and validating the rows (default: one per CPU)")
+    parser.add_argument("--library", default="library.json", help="the library's JSON file (default: library.json)")
+    parser.add_argument("--storage", default=os.environ.get('LIBRARY_STORAGE', 'json'),
+                        choices=["json", "journal", "sqlite"], help="the storage mode, as in app.py")
+    args = parser.parse_args(argv)
+    try:
+        format = args.format or format_of(args.catalog)
+    except ValueError as e:
+        parser.error(str(e))
+    # LIBRARY_SHARED=1 when the app is serving the same library, as in app.py
+    library = Library(storage=open_storage(args.storage, args.library, shared=os.environ.get('LIBRARY_SHARED') == '1'))
+    try:
+        with open(args.catalog, encoding="utf-8", newline="") as file:
+            report = import_books(library, file, format, workers=args.workers)
+    except (ValueError, csv.Error) as e:
+        # the books before the unreadable part are imported
+        print(f'{args.catalog}: could not be read to the end: {e}', file=sys.stderr)
+        return 2
+    finally:
+        library.close()
+    for number, message in report.errors:
+        print(f'{args.catalog}:{number}: {message}', file=sys.stderr)
+    print(report)
+    return 1 if report.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
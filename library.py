@@ -1,130 +1,1286 @@
+import csv
+import io
 import json
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack, contextmanager, nullcontext
 from book import Book
+from autocomplete import Autocomplete
+from columnar import ColumnarCatalog
+from history import LoanHistory
+from overdue import OverdueTracker
+from paging import SORT_FIELDS, decode_cursor, encode_cursor, page, parse_sort
+from search import SearchIndex
+from storage import GroupCommitStorage, JsonStorage
 
 # ---------------------------
 # This class provides functionality to manage a collection of books,
 # including adding, listing, editing, and deleting books, as well as saving
-# and loading the library from a JSON file.
+# and loading the library from a JSON file (or another storage, see storage.py).
+#
+# Alongside the list of books, the library keeps dictionary indexes
+# (title, author, genre and publication year) so that lookups don't have
+# to scan the whole collection. The indexes are updated on every add, edit
+# and delete. Every book also gets a unique id when it is added (see
+# book.py), and get_book finds a book by its id with a dictionary lookup.
+# A book is a work with one or more copies: adding a book that is already in
+# the library (same title, author, year and genre) adds copies to it instead
+# of a second entry, and borrowing and returning lend and take back copies.
+# Every loan records the user who borrowed the copy, and the library indexes
+# the loans by user, so loans_of(user) and returning a user's copy only go
+# through that user's loans. The loans are saved with their books, so they
+# survive restarts and are seen by the other processes of a shared storage.
+# Every borrow and return is also appended to the loan history (see
+# history.py), which keeps hourly and daily aggregates for reports. A loan
+# is due back loan_period seconds after it was made, and the overdue tracker
+# (see overdue.py) keeps the due dates in a heap to find the overdue loans.
+# Users can place holds on a book with no copy on the shelf: a returned copy
+# goes straight to the first user in the book's queue of holds instead of
+# back to the shelf, recorded as a return followed by a borrow.
+# list_books combines its filters with a small query planner:
+# every filter says how many books it could match, the smallest of those
+# sets of books is taken, and the other filters are checked on it.
+#
+# A Library can be shared by the threads of a multi-threaded web server: the
+# library lock guards the books list and the indexes, a pool of book locks
+# guards borrowing and returning, and the storage lock keeps writes from
+# interleaving. With a shared storage (see storage.py), several processes
+# can use the same data: changes are made under the storage's file lock, and
+# refresh() picks up what the other processes changed.
+#
+# For reporting over very large collections, a library created with
+# columnar=True also keeps a ColumnarCatalog of its books (see columnar.py),
+# which answers the aggregate queries (counts per genre, year histograms,
+# borrowed ratio) with whole-column passes. It is an analytics mirror next to
+# the Book objects, not a replacement for them: it only holds the filtered and
+# aggregated columns (a few bytes per book, on top of the Book objects). The
+# exact list_books filters keep using the dictionary indexes, which only cost
+# the number of matches; the catalog only replaces the scan of all the books
+# for the available books (is_borrowed=False).
+#
+# search() answers free-text queries over titles, authors and genres from a
+# SearchIndex (see search.py), and autocomplete() suggests completions for
+# the fields of the book forms from the tries of an Autocomplete (see
+# autocomplete.py). Both are built on first use and then kept up to date
+# with every change, like the other indexes.
+#
+# list_books can also return one page of books at a time, sorted by title,
+# author or year (see paging.py). For every sort asked for, the library
+# keeps the books sorted, so a page is found with a binary search.
 # ---------------------------
 
+# the number of seconds a copy can be borrowed for, by default
+LOAN_PERIOD = 14 * 86400
+
+# the fields of an exported book (see iter_export), and the formats of an export
+EXPORT_FIELDS = ("id", "title", "author", "publication_year", "genre", "copies", "is_borrowed")
+EXPORT_FORMATS = ("jsonl", "csv")
+# the number of books exported at a time
+EXPORT_BATCH_SIZE = 1000
+# add_books updates the sorted lists, the full-text index and the autocomplete tries book by book, unless it adds
+# more books than the library had divided by this: then they are dropped, and rebuilt on their next use
+REBUILD_RATIO = 4
+
+
 class Library:
-    def __init__(self, filename="library.json"):
+    def __init__(self, filename="library.json", storage=None, progress=None, columnar=False, history=None,
+                 loan_period=LOAN_PERIOD, on_overdue=None):
         """
         Initialize a Library object.
 
         :param filename: (str, optional) The filename to load and save library data. Defaults to "library.json".
+        :param storage: (optional) The storage object to load and save library data (see storage.py).
+                        Defaults to a JsonStorage for the filename.
+        :param progress: (callable, optional) Called while the library data is loaded, see load_library.
+        :param columnar: (bool, optional) True to also keep the filtered and aggregated columns of the books in a
+                         ColumnarCatalog (without details), available as the columnar attribute. Defaults to False.
+        :param history: (LoanHistory, optional) The loan history, available as the history attribute. Defaults
+                        to a LoanHistory in a ".loans.jsonl" file next to the storage's file.
+        :param loan_period: (float, optional) The number of seconds a copy can be borrowed for, or None for loans
+                            without a due date. Defaults to LOAN_PERIOD (two weeks).
+        :param on_overdue: (callable, optional) Called as on_overdue(book, loan) when a loan becomes overdue
+                           (see OverdueTracker, available as the overdue attribute).
         """
-        self.filename = filename
+        self.storage = storage if storage is not None else JsonStorage(filename)
+        if history is None:
+            history = LoanHistory(os.path.splitext(self.storage.filename)[0] + ".loans.jsonl")
+        self.history = history
+        self.loan_period = loan_period
+        self.overdue = OverdueTracker(on_overdue)
         self.books = []
-        self.load_library()
+        self._lock = threading.RLock()
+        self._storage_lock = threading.Lock()
+        self._book_locks = [threading.Lock() for _ in range(64)]
+        # guards the loans index, which borrows and returns of different books update
+        self._loans_lock = threading.Lock()
+        # the changes held back by _batched, per thread
+        self._batch = threading.local()
+        # a storage writing in the background copies the books it writes under their locks
+        self._deferred = isinstance(self.storage, GroupCommitStorage)
+        if self._deferred:
+            self.storage.book_lock = self._book_lock
+        self._columnar_enabled = columnar
+        self._clear_indexes()
+        self.load_library(progress)
+
+    @property
+    def filename(self):
+        """
+        The file the library data is loaded from and saved to.
+        """
+        return self.storage.filename
+
+    @filename.setter
+    def filename(self, filename):
+        self.storage.filename = filename
+
+    def _clear_indexes(self):
+        """
+        Reset all the lookup indexes of the library.
+
+        The title index maps a title to the list of books with that title (in insertion order), because
+        several books may share a title. The author, genre and year indexes map a value to a set of books.
+        Every book also gets an increasing sequence number, used to return filtered results in the same
+        order as the books list.
+        """
+        self._by_id = {}
+        self._next_id = 1
+        self._by_title = {}
+        self._by_author = {}
+        self._by_genre = {}
+        self._by_year = {}
+        # each single genre name (case-folded) -> set of books, the years with books in increasing order,
+        # and the set of borrowed books
+        self._by_genre_name = {}
+        self._years = []
+        self._borrowed = set()
+        # user -> {(book, copy number): Loan}; the loans of the copies of a book come oldest first
+        self._by_user = {}
+        self.overdue.clear()
+        self._order = {}
+        self._next_order = 0
+        # with columnar=True: the catalog, the row of every book and the book of every row
+        self.columnar = ColumnarCatalog(details=False) if self._columnar_enabled else None
+        self._rows = {}
+        self._row_books = []
+        # the full-text index and the autocomplete tries, built on first use
+        self._search_index = None
+        self._autocomplete = None
+        # field of SORT_FIELDS (or None, in the order the books were added in) -> the books sorted by it (see
+        # _sort_key), built the first time a page is sorted by it
+        self._sorted = {}
+
+    def _index_book(self, book):
+        """
+        Add a book to the lookup indexes.
+
+        :param book: (Book) The Book object to index.
+        """
+        if book not in self._order:
+            self._order[book] = self._next_order
+            self._next_order += 1
+        self._by_id[book.id] = book
+        same_title = self._by_title.setdefault(book.title, [])
+        if same_title and self._order[same_title[-1]] > self._order[book]:
+            # an edited book keeps its place among the books that share its new title
+            insort(same_title, book, key=self._order.__getitem__)
+        else:
+            same_title.append(book)
+        self._by_author.setdefault(book.author, set()).add(book)
+        self._by_genre.setdefault(book.genre, set()).add(book)
+        if book.publication_year not in self._by_year:
+            insort(self._years, book.publication_year)
+        self._by_year.setdefault(book.publication_year, set()).add(book)
+        for name in book.genres():
+            self._by_genre_name.setdefault(name.casefold(), set()).add(book)
+        if book.is_borrowed:
+            self._borrowed.add(book)
+        for loan in book.loans.values():
+            self._index_loan(book, loan)
+        if self.columnar is not None:
+            row = self._rows.get(book)
+            if row is None:
+                self._rows[book] = self.columnar.append(book)
+                self._row_books.append(book)
+            else:
+                self.columnar.update(row, book)
+        if self._search_index is not None:
+            self._search_index.add(book)
+        if self._autocomplete is not None:
+            self._autocomplete.add(book)
+        for field, books in self._sorted.items():
+            insort(books, book, key=self._sort_key(field))
+
+    def _unindex_book(self, book):
+        """
+        Remove a book from the lookup indexes (the sequence number is kept, see edit_book).
+
+        :param book: (Book) The Book object to remove from the indexes.
+        """
+        same_title = self._by_title.get(book.title, [])
+        same_title[:] = [other for other in same_title if other is not book]
+        if not same_title:
+            self._by_title.pop(book.title, None)
+        for index, key in ((self._by_author, book.author),
+                           (self._by_genre, book.genre),
+                           (self._by_year, book.publication_year),
+                           *((self._by_genre_name, name.casefold()) for name in book.genres())):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(book)
+                if not bucket:
+                    del index[key]
+        if book.publication_year not in self._by_year:
+            position = bisect_left(self._years, book.publication_year)
+            if position < len(self._years) and self._years[position] == book.publication_year:
+                del self._years[position]
+        self._borrowed.discard(book)
+        for loan in book.loans.values():
+            self._unindex_loan(book, loan)
+        if self._search_index is not None:
+            self._search_index.remove(book)
+        if self._autocomplete is not None:
+            self._autocomplete.remove(book)
+        for field, books in self._sorted.items():
+            key = self._sort_key(field)
+            del books[bisect_left(books, key(book), key=key)]
+
+    def _index_loan(self, book, loan):
+        """
+        Add a loan of a copy of a book to the loans index (loans without a user aren't indexed) and to the
+        overdue tracker.
+        """
+        self.overdue.add(book, loan)
+        if loan.user is not None:
+            with self._loans_lock:
+                self._by_user.setdefault(loan.user, {})[book, loan.copy] = loan
+
+    def _unindex_loan(self, book, loan):
+        """
+        Remove a loan of a copy of a book from the loans index and the overdue tracker.
+        """
+        self.overdue.remove(book, loan)
+        if loan.user is not None:
+            with self._loans_lock:
+                user_loans = self._by_user.get(loan.user)
+                if user_loans is not None:
+                    user_loans.pop((book, loan.copy), None)
+                    if not user_loans:
+                        del self._by_user[loan.user]
+
+    def loans_of(self, user):
+        """
+        List the copies a user has on loan. The cost depends only on the number of loans of the user.
+
+        :param user: (str) The user.
+
+        :returns:
+            list: List of (Book, Loan) tuples. The loans of several copies of a book come oldest first.
+        """
+        with self._loans_lock:
+            return [(book, loan) for (book, _), loan in self._by_user.get(user, {}).items()]
+
+    def hold_position(self, book, user):
+        """
+        Get the position of a user in the queue of holds of a book, in constant time (the length of the queue
+        is len(book.holds)).
+
+        :param book: (Book) The book.
+        :param user: (str) The user.
+
+        :returns:
+            int: The position, from 1 for the next user to get a copy, or None if the user isn't waiting.
+        """
+        with self._book_lock(book):
+            return book.hold_position(user)
+
+    def get_book(self, book_id):
+        """
+        Find a book by its id.
+
+        :param book_id: (int) The id of the book.
+
+        :returns:
+            Book: The book with that id, or None if there is none.
+        """
+        return self._by_id.get(book_id)
+
+    def find_books(self, title):
+        """
+        Find all the books with the given title.
+
+        :param title: (str) Title of the books to find.
+
+        :returns:
+            list: List of Book objects with that title, in the order they were added.
+        """
+        with self._lock:
+            return list(self._titled(title))
+
+    def _titled(self, title):
+        """
+        Look up the books with the given title, in the order they were added. An indexed storage
+        (such as SQLiteStorage) answers the lookup itself, otherwise the title index is used.
+
+        :param title: (str) Title of the books to look up.
+
+        :returns:
+            list: List of Book objects with that title.
+        """
+        if self.storage.indexed:
+            return self.storage.query(title=title)
+        return self._by_title.get(title, [])
 
     def add_book(self, book):
         """
-        Add a book to the library and save the updated library data.
+        Add a book to the library and save the updated library data. If the library already has the same work
+        (same title, author, publication year and genre), its copies are added to that book instead.
 
         :param book: (Book) The Book object to add to the library.
+
+        :returns:
+            Book: The book in the library, either the given one or the one that got its copies.
         """
-        self.books.append(book)
-        self.save_library()
+        with self._changing(), self._lock:
+            work = self._same_work(book)
+            if work is None:
+                self._add(book)
+                self._write({"op": "add", "book": book.to_storage_dict()}, [book])
+                return book
+            self._add_copies(work, book.copies)
+            self._write({"op": "add_copies", "id": work.id, "count": book.copies}, [work])
+            # the new copies go to the users waiting for the book first
+            with self._book_lock(work):
+                self._serve_holds(work)
+            return work
+
+    def add_books(self, books):
+        """
+        Add many books to the library at once, like add_book for each of them, and save them in a single write.
+
+        The books are taken from the iterable one at a time, so it can stream them (see importer.py). The indexes
+        are updated book by book, but once the batch grows large compared with the library (see REBUILD_RATIO),
+        the sorted lists, the full-text index and the autocomplete tries are dropped and rebuilt on their next
+        use, instead of taking the rest of the books one at a time. The library is locked until all the books
+        are added.
+
+        :param books: (iterable) The Book objects to add.
 
-    def list_books(self, author=None, genre=None, publication_year=None):
+        :returns:
+            list: The books in the library, as add_book returns them, in the order of the given books.
+        """
+        with self._changing(), self._lock:
+            # the number of new books after which the derived indexes are dropped
+            rebuild_after = len(self.books) // REBUILD_RATIO
+            new_books = 0
+            added = []
+            changes = []
+            # (title, author, year, genre) -> book, for the works added by this call (an indexed storage
+            # doesn't know them until they are written)
+            works = {}
+            held = []
+            try:
+                for book in books:
+                    key = (book.title, book.author, book.publication_year, book.genre)
+                    work = works.get(key) or self._same_work(book)
+                    if work is None:
+                        new_books += 1
+                        if new_books > rebuild_after:
+                            self._search_index = None
+                            self._autocomplete = None
+                            self._sorted = {}
+                        self._add(book)
+                        changes.append(({"op": "add", "book": book.to_storage_dict()}, [book]))
+                        if not book.loans:
+                            works[key] = book
+                        added.append(book)
+                    else:
+                        self._add_copies(work, book.copies)
+                        changes.append(({"op": "add_copies", "id": work.id, "count": book.copies}, [work]))
+                        if work.holds:
+                            held.append(work)
+                        added.append(work)
+            finally:
+                # if the iterable fails, the books added before are still saved
+                if changes:
+                    self._write_many(changes)
+            # the holds are served once the copies are written, so their loans are recorded after them
+            for work in held:
+                with self._book_lock(work):
+                    self._serve_holds(work)
+            return added
+
+    def _same_work(self, book):
+        """
+        Find the book of the library with the same title, author, publication year and genre as a new book.
+        A new book with copies on loan is never merged. The library lock must be held.
+
+        :returns: (Book) The book, or None if there is none.
+        """
+        if book.loans:
+            return None
+        for other in self._titled(book.title):
+            if (other.author, other.publication_year, other.genre) == (book.author, book.publication_year, book.genre):
+                return other
+        return None
+
+    def list_books(self, author=None, genre=None, publication_year=None, has_genre=None, year_from=None,
+                   year_to=None, is_borrowed=None, author_contains=None, sort=None, offset=0, limit=None,
+                   cursor=None):
         """
-        List books in the library, optionally filtering by author, genre, or publication year.
+        List books in the library, optionally filtering by author, genre, publication year, a single genre
+        among combined ones, a range of years, borrowed state, or part of the author's name.
+
+        The filters are answered from the indexes: the filter with the fewest possible matches is
+        taken and its books are checked against the other filters, so the cost depends on the number
+        of matches and not on the size of the library (see _filter). An indexed storage (such as
+        SQLiteStorage) answers the author, genre and year filters with its own indexed query instead.
+
+        The books can also be sorted and listed one page at a time (see paging.py): a page starts
+        after the cursor of the previous page (see cursor_after), or after offset books. Without
+        filters, a page is found in the sorted books with a binary search, so its cost doesn't depend
+        on the size of the library either.
 
         :param author: (str, optional) Author's name to filter books.
         :param genre: (str, optional) Genre of the books to filter.
         :param publication_year: (int, optional) Year of publication to filter books.
+        :param has_genre: (str, optional) A genre the books must have, alone or among others (so "Fantasy"
+                          matches "Comedy, Fantasy"). Letter case is ignored.
+        :param year_from: (int, optional) The earliest year of publication.
+        :param year_to: (int, optional) The latest year of publication.
+        :param is_borrowed: (bool, optional) True for borrowed books only, False for available books only.
+        :param author_contains: (str, optional) Text the author's name must contain, ignoring letter case.
+        :param sort: (str, optional) "title", "author" or "year", prefixed with "-" for descending order.
+                     Defaults to the order the books were added in.
+        :param offset: (int, optional) The number of books to skip. Defaults to 0.
+        :param limit: (int, optional) The maximum number of books to return. Defaults to no limit.
+        :param cursor: (str, optional) Start after the book this cursor was made for.
 
         :returns:
             list: List of Book objects that match the filter criteria.
+
+        :raises ValueError: If the sort or the cursor is invalid.
+        """
+        with self._lock:
+            filtered_books = self._filter(author, genre, publication_year, has_genre, year_from, year_to,
+                                          is_borrowed, author_contains)
+            if not sort and not offset and limit is None and not cursor:
+                return filtered_books
+            field, descending = parse_sort(sort)
+            after = decode_cursor(cursor, sort) if cursor else None
+            key = self._sort_key(field)
+            if filtered_books is not self.books:
+                sorted_books = sorted(filtered_books, key=key)
+            else:
+                if field not in self._sorted:
+                    self._sorted[field] = sorted(self.books, key=key)
+                sorted_books = self._sorted[field]
+            try:
+                return page(sorted_books, key, descending, after, offset, limit)
+            except TypeError:
+                # a cursor whose value can't be compared with the values of the field
+                raise ValueError("Invalid cursor.")
+
+    def cursor_after(self, book, sort=None):
+        """
+        Make the cursor of the position after a book, to list the next page of books (see list_books).
+
+        :param book: (Book) The last book of a page.
+        :param sort: (str, optional) The sort of the pages.
+
+        :returns:
+            str: The cursor.
+        """
+        field, _ = parse_sort(sort)
+        with self._lock:
+            return encode_cursor(sort, self._sort_key(field)(book))
+
+    def iter_export(self, format="jsonl", sort=None, batch_size=EXPORT_BATCH_SIZE, **filters):
+        """
+        Export the books of the library, or those matching list_books filters, as JSON Lines or CSV text,
+        a batch of books at a time.
+
+        Without filters, the books are listed one page at a time (see list_books), so an export of any size
+        only holds one batch in memory, and the library isn't locked between batches. With filters, the matching
+        books are found once, and only referenced until their batch is written. Every book is written with the
+        EXPORT_FIELDS (the loans and holds are left out, as they name the users); the CSV text starts with a
+        header row. The output can be imported again (see importer.py).
+
+        :param format: (str, optional) "jsonl" or "csv". Defaults to "jsonl".
+        :param sort: (str, optional) The order of the books, as for list_books. Defaults to the order they were
+                     added in.
+        :param batch_size: (int, optional) The number of books of a batch. Defaults to EXPORT_BATCH_SIZE.
+        :param filters: The filters of list_books (author, genre, publication_year, has_genre, year_from,
+                        year_to, is_borrowed, author_contains).
+
+        :returns:
+            generator: The text of the export, one string per batch.
+
+        :raises ValueError: If the format or the sort is invalid.
+        :raises TypeError: If a filter isn't one of list_books.
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format "{format}".')
+        parse_sort(sort)
+        unknown = set(filters) - {"author", "genre", "publication_year", "has_genre", "year_from", "year_to",
+                                  "is_borrowed", "author_contains"}
+        if unknown:
+            raise TypeError(f'Unknown filters: {", ".join(sorted(unknown))}.')
+        return self._export(format, sort, batch_size, filters)
+
+    def _export(self, format, sort, batch_size, filters):
+        """
+        Generate the text of an export (see iter_export).
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if format == "csv":
+            writer.writerow(EXPORT_FIELDS)
+        for books in self._export_batches(sort, batch_size, filters):
+            for book in books:
+                with self._book_lock(book):
+                    values = [getattr(book, field) for field in EXPORT_FIELDS]
+                if format == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, values))))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def _export_batches(self, sort, batch_size, filters):
+        """
+        List the books of an export (see iter_export) in batches.
         """
-        filtered_books = self.books
+        if any(value is not None and value != '' for value in filters.values()):
+            books = self.list_books(sort=sort, **filters)
+            for start in range(0, len(books), batch_size):
+                yield books[start:start + batch_size]
+            return
+        cursor = None
+        while True:
+            with self._lock:
+                books = self.list_books(sort=sort, limit=batch_size, cursor=cursor)
+                if books:
+                    cursor = self.cursor_after(books[-1], sort)
+            if books:
+                yield books
+            if len(books) < batch_size:
+                return
+
+    def _filter(self, author=None, genre=None, publication_year=None, has_genre=None, year_from=None,
+                year_to=None, is_borrowed=None, author_contains=None):
+        """
+        Find the books matching the list_books filters. The library lock must be held.
+
+        This is a small query planner. Every filter is turned into the number of books it can match
+        (known from its index without going through the books), a way to get those books, and a check
+        of a single book. The filter with the smallest number is used to get the candidate books, and
+        only the checks of the other filters are run on them. The available books (is_borrowed=False)
+        have no index of their own: that filter gets all the books as candidates (or, with a columnar
+        catalog, the books whose borrowed bit is clear, found with a single pass over the bitset), so its
+        check is still run when it is the one chosen.
+
+        :returns:
+            list: The matching books in the order they were added (the books list itself if nothing is filtered).
+        """
+        exact_only = (has_genre is None and year_from is None and year_to is None and is_borrowed is None
+                      and not author_contains)
+        if exact_only and not (author or genre or publication_year):
+            return self.books
+        if exact_only and self.storage.indexed:
+            return self.storage.query(author=author, genre=genre, publication_year=publication_year)
+
+        # (number of matches, books, check, True if the books all pass the check) for every filter
+        plan = []
         if author:
-            filtered_books = [book for book in filtered_books if book.author == author]
+            author_bucket = self._by_author.get(author, ())
+            plan.append((len(author_bucket), lambda: author_bucket, lambda book: book.author == author, True))
         if genre:
-            filtered_books = [book for book in filtered_books if book.genre == genre]
+            genre_bucket = self._by_genre.get(genre, ())
+            plan.append((len(genre_bucket), lambda: genre_bucket, lambda book: book.genre == genre, True))
         if publication_year:
-            filtered_books = [book for book in filtered_books if book.publication_year == publication_year]
+            year_bucket = self._by_year.get(publication_year, ())
+            plan.append((len(year_bucket), lambda: year_bucket,
+                         lambda book: book.publication_year == publication_year, True))
+        if has_genre is not None:
+            name_bucket = self._by_genre_name.get(has_genre.strip().casefold(), set())
+            plan.append((len(name_bucket), lambda: name_bucket, name_bucket.__contains__, True))
+        if year_from is not None or year_to is not None:
+            start = bisect_left(self._years, year_from) if year_from is not None else 0
+            end = bisect_right(self._years, year_to) if year_to is not None else len(self._years)
+            years = self._years[start:end]
+            plan.append((sum(len(self._by_year[year]) for year in years),
+                         lambda: [book for year in years for book in self._by_year[year]],
+                         lambda book: ((year_from is None or book.publication_year >= year_from)
+                                       and (year_to is None or book.publication_year <= year_to)), True))
+        if is_borrowed:
+            # copied, because borrowing and returning change the set without the library lock
+            plan.append((len(self._borrowed), lambda: list(self._borrowed), lambda book: book.is_borrowed, True))
+        elif is_borrowed is not None:
+            plan.append((len(self.books), self._available_candidates, lambda book: not book.is_borrowed, False))
+        if author_contains:
+            text = author_contains.casefold()
+            authors = [name for name in self._by_author if text in name.casefold()]
+            plan.append((sum(len(self._by_author[name]) for name in authors),
+                         lambda: [book for name in authors for book in self._by_author[name]],
+                         lambda book: text in book.author.casefold(), True))
+
+        plan.sort(key=lambda step: step[0])
+        _, books, check, exact = plan[0]
+        candidates = books()
+        checks = [check for _, _, check, _ in plan[1:]]
+        if not exact:
+            checks.append(check)
+        filtered_books = [book for book in candidates if all(check(book) for check in checks)]
+        if candidates is not self.books:
+            filtered_books.sort(key=self._order.__getitem__)
         return filtered_books
 
-    def edit_book(self, title, new_details):
+    def _available_candidates(self):
+        """
+        Get the candidate books of the is_borrowed=False filter: all the books, or with a columnar catalog the
+        books whose borrowed bit is clear. The library lock must be held.
+        """
+        if self.columnar is None:
+            return self.books
+        return [self._row_books[row] for row in self.columnar.select(is_borrowed=False)]
+
+    def _sort_key(self, field):
+        """
+        Get the function giving the position of a book when sorted by a field of SORT_FIELDS (or in the order
+        the books were added in, for None): its value of the field, then its id. Unlike the sequence number,
+        the id of a book doesn't change when the library is loaded again, so the cursors stay valid.
+        """
+        value = SORT_FIELDS[field] if field is not None else lambda book: 0
+        return lambda book: (value(book), book.id)
 
+    def search(self, query, limit=20):
         """
-        Edit details of a book in the library, identified by its title.
+        Search the titles, authors and genres of the books for the words of a query.
+
+        Every word of the query must match the start of a word of the book (so "harr pot" finds
+        "Harry Potter"), and the results are ranked from the best match: exact words before partial ones,
+        title matches before author matches before genre matches, and rare words before common ones.
+
+        :param query: (str) The words to search for.
+        :param limit: (int, optional) The maximum number of books to return. Defaults to 20.
+
+        :returns:
+            list: List of Book objects matching the query, best matches first.
+        """
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(self.books)
+            return self._search_index.search(query, limit, order=self._order.__getitem__)
+
+    def autocomplete(self, field, text, limit=10, max_distance=None):
+        """
+        Suggest values of a field (title, author or genre) starting with what has been typed so far,
+        tolerating small typos (see autocomplete.py).
+
+        :param field: (str) "title", "author" or "genre".
+        :param text: (str) The text typed so far.
+        :param limit: (int, optional) The maximum number of suggestions. Defaults to 10.
+        :param max_distance: (int, optional) The maximum number of typos. Defaults to one for texts of 4
+                             characters or more, none for shorter texts.
+
+        :returns:
+            list: The suggested values, closest first, then alphabetically.
+
+        :raises ValueError: If the field isn't one of "title", "author" or "genre".
+        """
+        with self._lock:
+            if self._autocomplete is None:
+                self._autocomplete = Autocomplete(self.books)
+            return self._autocomplete.complete(field, text, limit, max_distance)
+
+    def edit_book(self, title=None, new_details=None, book_id=None):
+
+        """
+        Edit details of a book in the library, identified by its title (the first book with that title)
+        or by its id. A book can't be edited while any of its copies is on loan.
 
         :param title: (str) Title of the book to edit.
-        :param new_details: (dict) New details to update for the book.
+        :param new_details: (dict) New details to update for the book (title, author, publication_year, genre
+                            and copies).
+        :param book_id: (int, optional) Id of the book to edit, instead of its title.
 
         Returns:
             bool: True if the book was edited successfully, False otherwise.
+
+        :raises ValueError: If the new number of copies is less than 1.
         """
-        for book in self.books:
-            if book.title == title:
-                if not book.is_borrowed:
-                    book.update(**new_details)
-                    self.save_library()
-                    return True
-                else:
-                    return False
-        return False
+        with self._changing(), self._lock:
+            return self._edit(title, new_details, persist=True, book_id=book_id) is not None
 
-    def delete_book(self, title):
+    def delete_book(self, title=None, book_id=None):
         """
-        Delete a book from the library by its title.
+        Delete a book from the library by its title (all the books with that title) or by its id.
 
         :param title: (str) Title of the book to delete.
+        :param book_id: (int, optional) Id of the book to delete, instead of its title.
         """
-        self.books = [book for book in self.books if book.title != title]
-        self.save_library()
+        with self._changing(), self._lock:
+            self._delete(title, persist=True, book_id=book_id)
 
-    def borrow_book(self, title):
+    def borrow_book(self, title=None, book_id=None, user=None):
         """
-        Borrow a book from the library, identified by its title.
+        Borrow a copy of a book from the library, identified by its title (the first book with that title that
+        has a copy on the shelf) or by its id.
+
+        Only the lock of the borrowed book is held while borrowing, so borrows of different books
+        don't wait for each other, and lending a copy is a constant-time update of the book.
 
         :param title: (str) Title of the book to borrow.
+        :param book_id: (int, optional) Id of the book to borrow, instead of its title.
+        :param user: (str, optional) The user borrowing the copy, recorded with the loan (see loans_of).
 
         :returns:
             tuple: A tuple where the first element is a boolean indicating if the book was successfully borrowed,
                    and the second element is the timestamp when the book was borrowed (if successful).
         """
-        for book in self.books:
-            if book.title == title and not book.is_borrowed:
-                book.borrow()
-                self.save_library()
-                return True, book.borrowed_timestamp
-        return False, None
+        with self._changing():
+            book = self._borrow(title, persist=True, book_id=book_id, user=user)
+        if not book:
+            return False, None
+        return True, book.borrowed_timestamp
 
-    def return_book(self, title):
+    def return_book(self, title=None, book_id=None, user=None):
         """
-        This function handles the return of a borrowed book to the library, identified by its title.
+        This function handles the return of a borrowed copy of a book to the library (the copy on loan the
+        longest), identified by its title (the first book with that title that has a copy on loan) or by its id.
+        When a user is given, it is the copy that user borrowed.
 
         :param title: (str) Title of the book to return.
+        :param book_id: (int, optional) Id of the book to return, instead of its title.
+        :param user: (str, optional) The user returning the copy.
 
         :returns:
             tuple: A tuple where the first element is a boolean indicating if the book was successfully returned,
                    and the second element is the timestamp when the book was returned (if successful).
         """
-        for book in self.books:
-            if book.title == title and book.is_borrowed:
-                book.return_book()
-                self.save_library()
+        with self._changing():
+            book = self._return(title, persist=True, book_id=book_id, user=user)
+        if not book:
+            return False, None
+        return True, book.borrowed_timestamp
+
+    def hold_book(self, title=None, book_id=None, user=None):
+        """
+        Place a hold on a book none of whose copies is on the shelf, identified by its title (the first such book
+        with that title) or by its id. The user joins the back of the book's queue of holds, and gets the next
+        copy returned once the users before them got theirs (see return_book).
+
+        :param title: (str) Title of the book to hold.
+        :param book_id: (int, optional) Id of the book to hold, instead of its title.
+        :param user: (str) The user waiting for the book.
+
+        :returns:
+            tuple: A tuple where the first element is a boolean indicating if the hold was placed, and the second
+                   element is the position of the user in the queue of holds, from 1 (if successful).
+        """
+        with self._changing():
+            book, position = self._hold(title, persist=True, book_id=book_id, user=user)
+        if not book:
+            return False, None
+        return True, position
+
+    def cancel_hold(self, title=None, book_id=None, user=None):
+        """
+        Take a user out of the queue of holds of a book, identified by its title (the first book with that title
+        the user waits for) or by its id.
+
+        :param title: (str) Title of the held book.
+        :param book_id: (int, optional) Id of the held book, instead of its title.
+        :param user: (str) The user.
+
+        :returns:
+            bool: True if the user was waiting for the book.
+        """
+        with self._changing():
+            return self._cancel_hold(title, persist=True, book_id=book_id, user=user) is not None
+
+    def borrow_and_return(self, operations):
+        """
+        Borrow and return many books at once, in order, and save all the changes in a single write.
+
+        Every operation is like a call of borrow_book or return_book. The library lock and the locks of all the
+        books the operations name are held until the changes are written, so no other change gets in between
+        them; an operation that fails (no copy on the shelf, or no copy of the user's on loan) doesn't stop
+        the others.
+
+        :param operations: (list) List of dictionaries with the "op" ("borrow" or "return"), the "id" or the
+                           "title" of the book, and optionally the "user".
+
+        :returns:
+            list: For every operation, a tuple as borrow_book or return_book return it.
+
+        :raises ValueError: If an operation isn't a borrow or a return, or doesn't name a book (nothing is done).
+        """
+        for operation in operations:
+            if operation.get("op") not in ("borrow", "return"):
+                raise ValueError(f'Unknown operation "{operation.get("op")}", expected "borrow" or "return".')
+            if operation.get("id") is None and not operation.get("title"):
+                raise ValueError('Every operation needs the "id" or the "title" of a book.')
+        results = []
+        with self._changing(), self._lock:
+            candidates = [list(self._candidates(operation.get("title"), operation.get("id")))
+                          for operation in operations]
+            with ExitStack() as stack:
+                for lock in sorted({self._book_lock(book) for books in candidates for book in books}, key=id):
+                    stack.enter_context(lock)
+                with self._batched():
+                    for operation, books in zip(operations, candidates):
+                        results.append(self._borrow_or_return(operation, books))
+        return results
+
+    def _borrow_or_return(self, operation, books):
+        """
+        Apply an operation of borrow_and_return to the first of its candidate books it succeeds on. The locks
+        of the books must be held.
+        """
+        title, user = operation.get("title"), operation.get("user")
+        for book in books:
+            if (operation.get("id") is None and book.title != title) or book not in self._order:
+                continue
+            if operation["op"] == "borrow":
+                done = self._lend(book, user=user, persist=True)
+            else:
+                done = self._take_back(book, user=user, persist=True)
+            if done is not None:
                 return True, book.borrowed_timestamp
         return False, None
 
-    def save_library(self):
+    def flush(self):
+        """
+        Write out the changes the storage is still holding (see GroupCommitStorage). The storage serializes its
+        own writes and copies the books under their locks, so none of the library's locks is held here.
+        """
+        self.storage.flush()
+
+    def close(self):
+        """
+        Write out the pending changes and close the storage. Should be called when the application shuts down.
+        """
+        if self._deferred:
+            # as in flush, the storage takes the book locks itself
+            self.storage.close()
+            return
+        with self._storage_lock:
+            self.storage.close()
+
+    def refresh(self):
+        """
+        Catch up with the changes other processes made to a shared storage. This is cheap when nothing changed
+        (a file stat for the JSON storages), and for a journaled storage only the new journal records are read.
+
+        :returns:
+            bool: True if the library was updated.
+        """
+        if not self.storage.shared or not self.storage.changed():
+            return False
+        with self.storage.transaction():
+            self._catch_up()
+        return True
+
+    @contextmanager
+    def _changing(self):
+        """
+        Context manager to make a change in. For a shared storage it holds the storage transaction (a lock
+        shared with the other processes) and first catches up with their changes, so the change is made on
+        top of the latest data. It is taken before any of the library locks.
+        """
+        with self.storage.transaction():
+            if self.storage.shared:
+                self._catch_up()
+            yield
+
+    def _catch_up(self):
+        """
+        Apply the changes other processes made to the storage. Must be called inside the storage transaction.
+        """
+        with self._storage_lock:
+            reload, records = self.storage.changes()
+        if reload:
+            self._load()
+        elif records:
+            with self._lock:
+                for record in records:
+                    self._replay(record)
+
+    def _write(self, record, changed):
         """
-        Save the library data to a JSON file.
+        Persist a change through the storage (or hold it back until the end of a batch, see _batched).
+        Writes are serialized by the storage lock.
+
+        :param record: (dict) The record of the change.
+        :param changed: (list) The Book objects that were added, updated or deleted by the change.
         """
-        with open(self.filename, 'w') as file:
-            json.dump([book.to_dict() for book in self.books], file)
+        batch = getattr(self._batch, "changes", None)
+        if batch is not None:
+            batch.append((record, changed))
+            return
+        with self._storage_lock:
+            self.storage.write(record, self.books, changed)
 
-    def load_library(self):
+    @contextmanager
+    def _batched(self):
         """
-        Load the library data from a JSON file.
+        Context manager to make several changes in and persist them together: the records the changes of this
+        thread write are held back and written with a single write_many at the end (see borrow_and_return).
         """
+        self._batch.changes = changes = []
         try:
-            with open(self.filename, 'r') as file:
-                book_dicts = json.load(file)
-                self.books = [Book(**book_dict) for book_dict in book_dicts]
-        except FileNotFoundError:
+            yield
+        finally:
+            self._batch.changes = None
+            if changes:
+                self._write_many(changes)
+
+    def _write_many(self, changes):
+        """
+        Persist several changes through the storage at once (see _write).
+
+        :param changes: (list) List of (record, changed) tuples, in the order the changes were applied.
+        """
+        with self._storage_lock:
+            self.storage.write_many(changes, self.books)
+
+    def _book_lock(self, book):
+        """
+        Get the lock guarding the borrowed state of a book. Books are spread over a fixed pool of locks
+        (lock striping), so there is no per-book lock to create or clean up.
+
+        :param book: (Book) The book to lock.
+
+        :returns:
+            threading.Lock: The lock of the book.
+        """
+        return self._book_locks[(id(book) >> 4) % len(self._book_locks)]
+
+    # ---------------------------
+    # The changes themselves. They update the books and the indexes, and when persist is True
+    # also write the change to the storage while the affected books are still locked. Each change
+    # is described by a record (a small dictionary with an "op" key) that the storage may keep in
+    # a journal; _replay applies such a record again (without persisting it) when loading.
+    #
+    # Locks are always taken in the same order: the storage transaction (only held for a shared
+    # storage), the library lock, then book locks, then the storage lock. Borrowing and returning
+    # don't take the library lock at all.
+    # ---------------------------
+
+    def _add(self, book):
+        """
+        Add a book to the books list and the indexes, giving it the next id unless it already has its own.
+        The library lock must be held.
+        """
+        if not isinstance(book.id, int) or book.id in self._by_id:
+            book.id = self._next_id
+        self._next_id = max(self._next_id, book.id + 1)
+        self.books.append(book)
+        self._index_book(book)
+
+    def _add_copies(self, book, count):
+        """
+        Add copies to a book of the library. The library lock must be held.
+        """
+        with self._book_lock(book):
+            book.set_copies(book.copies + count)
+            self._borrowed.discard(book)
+            if self.columnar is not None:
+                # the number of copies and the borrowed state
+                self.columnar.update(self._rows[book], book)
+
+    def _candidates(self, title, book_id):
+        """
+        Look up the books a change is about: the book with the given id if there is one, otherwise the books
+        with the given title.
+        """
+        if book_id is not None:
+            book = self._by_id.get(book_id)
+            return [book] if book is not None else []
+        return self._titled(title)
+
+    def _edit(self, title, new_details, persist=False, book_id=None):
+        """
+        Update the first book with the given title (or the book with the given id), unless a copy of it is on
+        loan. The library lock must be held.
+
+        :returns: (Book) The edited book, or None if nothing was edited.
+        :raises ValueError: If the new number of copies is less than 1.
+        """
+        candidates = self._candidates(title, book_id)
+        if not candidates:
+            return None
+        book = candidates[0]
+        with self._book_lock(book):
+            if book.loans:
+                return None
+            if new_details.get("copies") is not None and new_details["copies"] < 1:
+                raise ValueError("A book needs at least one copy.")
+            self._unindex_book(book)
+            book.update(**new_details)
+            self._index_book(book)
+            if persist:
+                self._write({"op": "edit", "id": book.id, "details": new_details}, [book])
+        return book
+
+    def _delete(self, title, persist=False, book_id=None):
+        """
+        Remove all the books with the given title (or the book with the given id). The library lock must be held.
+
+        :returns: (list) The removed books.
+        """
+        removed = list(self._candidates(title, book_id))
+        if not removed:
+            return []
+        with ExitStack() as stack:
+            for lock in sorted({self._book_lock(book) for book in removed}, key=id):
+                stack.enter_context(lock)
+            for book in removed:
+                self._unindex_book(book)
+                del self._order[book]
+                del self._by_id[book.id]
+                if self.columnar is not None:
+                    row = self._rows.pop(book)
+                    self.columnar.remove(row)
+                    self._row_books[row] = None
+            removed_books = set(removed)
+            self.books = [book for book in self.books if book not in removed_books]
+            if persist:
+                record = {"op": "delete", "id": book_id} if book_id is not None else {"op": "delete", "title": title}
+                self._write(record, removed)
+        return removed
+
+    def _borrow(self, title, timestamp=None, persist=False, book_id=None, copy=None, user=None, borrowed_at=None,
+                due_at=None):
+        """
+        Borrow a copy of the first book with the given title (or of the book with the given id) that has one on
+        the shelf.
+
+        :param timestamp: (str, optional) The timestamp to record instead of the current time (used on replay).
+        :param copy: (int, optional) The number of the copy to borrow (used on replay).
+        :param user: (str, optional) The user borrowing the copy.
+        :param borrowed_at: (float, optional) The time to record with the timestamp, in seconds since the epoch.
+        :param due_at: (float, optional) The due date to record with the timestamp, in seconds since the epoch.
+        :returns: (Book) The borrowed book, or None if no book could be borrowed.
+        """
+        for book in list(self._candidates(title, book_id)):
+            with self._book_lock(book):
+                # the book may have been edited or deleted since it was looked up
+                if (book_id is None and book.title != title) or book not in self._order:
+                    continue
+                if self._lend(book, copy, user, persist, timestamp, borrowed_at, due_at) is not None:
+                    return book
+        return None
+
+    def _lend(self, book, copy=None, user=None, persist=False, timestamp=None, borrowed_at=None, due_at=None):
+        """
+        Lend a copy of a book (see _borrow for the parameters). A user waiting for the book gets out of its queue
+        of holds. The book lock must be held.
+
+        :returns: (Loan) The loan, or None if the copy isn't on the shelf.
+        """
+        lent = book.borrow(copy, user, self.loan_period)
+        if lent is None:
+            return None
+        loan = book.loans[lent]
+        if timestamp is not None:
+            book.borrowed_timestamp = loan.borrowed_timestamp = timestamp
+            loan.borrowed_at = borrowed_at
+            loan.due_at = due_at
+        book.cancel_hold(user)
+        self._index_loan(book, loan)
+        if book.is_borrowed:
+            self._borrowed.add(book)
+        self._columnar_borrowed(book)
+        if persist:
+            self._write({"op": "borrow", "id": book.id, "copy": lent, "user": user,
+                         "timestamp": book.borrowed_timestamp, "time": loan.borrowed_at, "due": loan.due_at},
+                        [book])
+            self.history.record("borrow", book, loan, loan.borrowed_at)
+        return loan
+
+    def _return(self, title, timestamp=None, persist=False, book_id=None, copy=None, user=None):
+        """
+        Return a borrowed copy of the first book with the given title (or of the book with the given id) that
+        has one on loan.
+
+        :param timestamp: (str, optional) The timestamp to record instead of the current time (used on replay).
+        :param copy: (int, optional) The number of the copy to return (used on replay).
+        :param user: (str, optional) The user returning the copy: only a copy they borrowed can be returned.
+        :returns: (Book) The returned book, or None if no book could be returned.
+        """
+        for book in list(self._candidates(title, book_id)):
+            with self._book_lock(book):
+                if (book_id is None and book.title != title) or book not in self._order:
+                    continue
+                if self._take_back(book, copy, user, persist, timestamp) is not None:
+                    return book
+        return None
+
+    def _take_back(self, book, copy=None, user=None, persist=False, timestamp=None):
+        """
+        Take back a copy of a book (see _return for the parameters), and hand it to the first user waiting for
+        the book, if any. The book lock must be held.
+
+        :returns: (Loan) The ended loan, or None if there is no such loan.
+        """
+        loan = self._loan_to_return(book, copy, user)
+        if loan is None:
+            return None
+        returned = book.return_book(loan.copy)
+        self._unindex_loan(book, loan)
+        if timestamp is not None:
+            book.borrowed_timestamp = timestamp
+        self._borrowed.discard(book)
+        self._columnar_borrowed(book)
+        if persist:
+            self._write({"op": "return", "id": book.id, "copy": returned,
+                         "timestamp": book.borrowed_timestamp}, [book])
+            self.history.record("return", book, loan)
+            # on replay, the borrow records of the holds served follow
+            self._serve_holds(book)
+        return loan
+
+    def _serve_holds(self, book):
+        """
+        Lend the copies on the shelf to the users waiting for a book, first in line first, and persist the loans.
+        A returned copy is the next one on the shelf, so handing it to the next user is constant-time. The book
+        lock must be held.
+        """
+        while book.holds and book.available:
+            self._lend(book, user=book.holds.first(), persist=True)
+
+    def _hold(self, title, persist=False, book_id=None, user=None):
+        """
+        Place a hold on the first borrowed book with the given title (or on the book with the given id) for a user.
+
+        :returns: (tuple) The book and the position of the user in its queue of holds, or (None, None) if the user
+                  is already waiting for it, or a copy of it is on the shelf (it can be borrowed instead).
+        """
+        for book in list(self._candidates(title, book_id)):
+            with self._book_lock(book):
+                if (book_id is None and book.title != title) or book not in self._order:
+                    continue
+                if user in book.holds or (persist and not book.is_borrowed):
+                    continue
+                position = book.hold(user)
+                self._columnar_borrowed(book)
+                if persist:
+                    self._write({"op": "hold", "id": book.id, "user": user}, [book])
+                return book, position
+        return None, None
+
+    def _cancel_hold(self, title, persist=False, book_id=None, user=None):
+        """
+        Take a user out of the queue of holds of the first book with the given title they wait for (or of the
+        book with the given id).
+
+        :returns: (Book) The book, or None if the user wasn't waiting for it.
+        """
+        for book in list(self._candidates(title, book_id)):
+            with self._book_lock(book):
+                if (book_id is None and book.title != title) or book not in self._order:
+                    continue
+                if not book.cancel_hold(user):
+                    continue
+                self._columnar_borrowed(book)
+                if persist:
+                    self._write({"op": "cancel_hold", "id": book.id, "user": user}, [book])
+                return book
+        return None
+
+    def _loan_to_return(self, book, copy=None, user=None):
+        """
+        Pick the loan of a book to end: the user's oldest loan of the book (or of the given copy) if a user is given,
+        otherwise the loan of the given copy, or the oldest loan of the book. The book lock must be held.
+
+        :returns: (Loan) The loan, or None if there is no such loan.
+        """
+        if user is not None:
+            with self._loans_lock:
+                return next((loan for (other, _), loan in self._by_user.get(user, {}).items()
+                             if other is book and (copy is None or loan.copy == copy)), None)
+        if copy is not None:
+            return book.loans.get(copy)
+        return next(iter(book.loans.values()), None)
+
+    def _columnar_borrowed(self, book):
+        """
+        Copy the borrowed state of a book to the columnar catalog, if there is one.
+        """
+        if self.columnar is not None:
+            self.columnar.set_borrowed(self._rows[book], book.is_borrowed)
+
+    def _replay(self, record):
+        """
+        Apply a change record again, without persisting it. The books of a change are identified by their id,
+        or by their title for records written before books had ids.
+
+        :param record: (dict) The record of the change.
+        """
+        op = record["op"]
+        title, book_id = record.get("title"), record.get("id")
+        if op == "add":
+            self._add(Book(**record["book"]))
+        elif op == "add_copies":
+            self._add_copies(self._by_id[book_id], record["count"])
+        elif op == "edit":
+            self._edit(title, record["details"], book_id=book_id)
+        elif op == "delete":
+            self._delete(title, book_id=book_id)
+        elif op == "borrow":
+            self._borrow(title, record["timestamp"], book_id=book_id, copy=record.get("copy"), user=record.get("user"),
+                         borrowed_at=record.get("time"), due_at=record.get("due"))
+        elif op == "return":
+            self._return(title, record["timestamp"], book_id=book_id, copy=record.get("copy"))
+        elif op == "hold":
+            self._hold(title, book_id=book_id, user=record["user"])
+        elif op == "cancel_hold":
+            self._cancel_hold(title, book_id=book_id, user=record["user"])
+        else:
+            raise ValueError(f'Unknown library record "{op}".')
+
+    def save_library(self):
+        """
+        Save the whole library data to the storage (for a journaled storage this also compacts the journal).
+        """
+        with self.storage.transaction(), self._lock, self._storage_lock:
+            self.storage.save(self.books)
+
+    def load_library(self, progress=None):
+        """
+        Load the library data from the storage, replaying any journaled changes on top of it.
+
+        The books are read as a stream and added to the books list and the indexes one at a time, so loading
+        a very large library doesn't need a second copy of it in memory.
+
+        :param progress: (callable, optional) Called as progress(done, total) while loading; done and total are
+                         bytes for the JSON storages and books for SQLiteStorage.
+        """
+        with self.storage.transaction():
+            self._load(progress)
+
+    def _load(self, progress=None):
+        """
+        Load the library data from the storage. For a shared storage, the storage transaction must be held.
+        """
+        if self._deferred:
+            # the pending changes are written before the storage lock is taken, as the storage copies the books
+            # under their locks (see flush); the changes made meanwhile are only queued, so loading doesn't need
+            # the storage lock either (the storage writes them out first, still without it)
+            self.storage.flush()
+        with self._lock, nullcontext() if self._deferred else self._storage_lock:
+            books, records = self.storage.load(progress)
             self.books = []
+            self._clear_indexes()
+            for book in books:
+                self._add(book)
+            # the ids of the deleted books aren't given again either
+            self._next_id = max(self._next_id, self.storage.next_id)
+            for record in records:
+                self._replay(record)
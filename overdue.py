@@ -0,0 +1,226 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# ---------------------------
+# This class finds the loans that are past their due date.
+#
+# The due dates of the loans are kept in a min-heap, so the loan that falls
+# due first is always on top: checking for overdue loans only looks at the
+# top of the heap, and pops the loans whose due date has passed. A returned
+# loan is not searched for in the heap; it is skipped when it reaches the
+# top (lazy deletion), and the heap is rebuilt once most of it is such
+# leftovers.
+#
+# The loans found overdue are marked in a dictionary of book -> {copy
+# number: Loan}, so whether (and how many of) a book's copies are overdue is
+# a dictionary lookup. A scheduler thread (see start) sleeps until the next
+# due date, then marks the loans that fell due and notifies the on_overdue
+# callback.
+#
+# A library reloading its books (see Library.refresh) clears the tracker and
+# adds the new Loan objects again. The loans already found overdue are
+# remembered by (book id, copy number, due date) across a clear, so they are
+# marked again as soon as they are added, without notifying on_overdue twice.
+# ---------------------------
+
+logger = logging.getLogger(__name__)
+
+
+class OverdueTracker:
+    def __init__(self, on_overdue=None):
+        """
+        Initialize an OverdueTracker object.
+
+        :param on_overdue: (callable, optional) Called as on_overdue(book, loan) for every loan found overdue.
+        """
+        self.on_overdue = on_overdue
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        # the keys (see _key) of the loans found overdue
+        self._notified = set()
+        self.clear()
+
+    def clear(self):
+        """
+        Forget all the loans. The loans found overdue before are marked again, without being notified, when they
+        are added back (until the next clear).
+        """
+        with self._condition:
+            # (due date, sequence number, book, loan), and the loans of the heap that are still tracked
+            self._heap = []
+            self._pending = set()
+            self._sequence = itertools.count()
+            self._overdue = {}
+            self._previously_notified, self._notified = self._notified, set()
+
+    def add(self, book, loan):
+        """
+        Start tracking a loan. A loan without a due date is never overdue.
+
+        :param book: (Book) The book of the borrowed copy.
+        :param loan: (Loan) The loan.
+        """
+        if loan.due_at is None:
+            return
+        with self._condition:
+            key = self._key(book, loan)
+            if key in self._notified or key in self._previously_notified:
+                # found overdue before a clear
+                self._notified.add(key)
+                self._overdue.setdefault(book, {})[loan.copy] = loan
+                return
+            heapq.heappush(self._heap, (loan.due_at, next(self._sequence), book, loan))
+            self._pending.add(loan)
+            if self._heap[0][3] is loan:
+                # the scheduler may be sleeping until a later due date
+                self._condition.notify()
+
+    def remove(self, book, loan):
+        """
+        Stop tracking a loan (the copy was returned, or the book deleted).
+
+        :param book: (Book) The book of the borrowed copy.
+        :param loan: (Loan) The loan.
+        """
+        if loan.due_at is None:
+            return
+        with self._condition:
+            book_overdue = self._overdue.get(book)
+            if book_overdue is not None and book_overdue.get(loan.copy) is loan:
+                self._notified.discard(self._key(book, loan))
+                del book_overdue[loan.copy]
+                if not book_overdue:
+                    del self._overdue[book]
+            else:
+                # still in the heap, skipped when it reaches the top
+                self._pending.discard(loan)
+                if len(self._heap) > 64 and len(self._pending) < len(self._heap) // 2:
+                    self._heap = [entry for entry in self._heap if entry[3] in self._pending]
+                    heapq.heapify(self._heap)
+
+    def check(self, now=None):
+        """
+        Mark the loans whose due date has passed as overdue, and notify on_overdue of them.
+
+        :param now: (float, optional) The current time in seconds since the epoch. Defaults to now.
+
+        :returns:
+            list: List of (Book, Loan) tuples of the loans that were just found overdue.
+        """
+        now = time.time() if now is None else now
+        expired = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, book, loan = heapq.heappop(self._heap)
+                if loan not in self._pending:
+                    # returned since
+                    continue
+                self._pending.discard(loan)
+                self._notified.add(self._key(book, loan))
+                self._overdue.setdefault(book, {})[loan.copy] = loan
+                expired.append((book, loan))
+        if self.on_overdue is not None:
+            for book, loan in expired:
+                self.on_overdue(book, loan)
+        return expired
+
+    def count(self, book):
+        """
+        Get the number of copies of a book that are overdue.
+
+        :param book: (Book) The book.
+
+        :returns:
+            int: The number of overdue copies.
+        """
+        return len(self._overdue.get(book, ()))
+
+    def is_overdue(self, book, loan):
+        """
+        Check whether a loan is overdue.
+
+        :param book: (Book) The book of the borrowed copy.
+        :param loan: (Loan) The loan.
+
+        :returns:
+            bool: True if the loan was found overdue.
+        """
+        return self._overdue.get(book, {}).get(loan.copy) is loan
+
+    def overdue_loans(self):
+        """
+        List all the overdue loans.
+
+        :returns:
+            list: List of (Book, Loan) tuples, earliest due date first.
+        """
+        with self._condition:
+            loans = [(book, loan) for book, book_overdue in self._overdue.items() for loan in book_overdue.values()]
+        return sorted(loans, key=lambda item: item[1].due_at)
+
+    def next_due(self):
+        """
+        Get the earliest due date of the loans not overdue yet.
+
+        :returns:
+            float: The due date in seconds since the epoch, or None if there is none.
+        """
+        with self._condition:
+            while self._heap and self._heap[0][3] not in self._pending:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    @staticmethod
+    def _key(book, loan):
+        """
+        Get the key of a loan that stays the same when the library reloads its books.
+        """
+        return book.id, loan.copy, loan.due_at
+
+    def start(self, interval=60.0):
+        """
+        Start the scheduler thread, which checks for overdue loans whenever a due date passes.
+
+        :param interval: (float, optional) The longest the thread sleeps between checks, in seconds. Defaults to 60.
+        """
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="library-overdue",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the scheduler thread.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self, interval):
+        """
+        Body of the scheduler thread.
+        """
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                timeout = interval
+                if self._heap:
+                    timeout = min(interval, max(0.0, self._heap[0][0] - time.time()))
+                self._condition.wait(timeout)
+                if self._stopped:
+                    return
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Checking for overdue loans failed")
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+
+# ---------------------------
+# Helpers to list books one page at a time, in a chosen order.
+#
+# A sort is the name of a field in SORT_FIELDS ("title", "author" or
+# "year"), optionally prefixed with "-" for descending order, or None for
+# the order the books were added in. Books are ordered by the sort value
+# and then by their id (given in the order the books are added), so the
+# order is total and a position in it is a (value, id) pair.
+#
+# A cursor is such a position (the last book of a page) with its sort,
+# encoded as an opaque URL-safe string. Unlike an offset, a cursor stays
+# valid when books are added or deleted before it, and the next page is
+# found with a binary search in the sorted books instead of by skipping
+# over all the books before it. As the ids of the books are saved with them
+# and never reused, a cursor also stays valid when the library is loaded
+# again (after a restart, or a refresh of a shared storage).
+# ---------------------------
+
+SORT_FIELDS = {
+    "title": lambda book: book.title.casefold(),
+    "author": lambda book: book.author.casefold(),
+    "year": lambda book: book.publication_year,
+}
+
+
+def parse_sort(sort):
+    """
+    Split a sort into its field and direction.
+
+    :param sort: (str) A field of SORT_FIELDS, optionally prefixed with "-", or None.
+
+    :returns:
+        tuple: The field (None for the order the books were added in) and True for descending order.
+
+    :raises ValueError: If the field isn't in SORT_FIELDS.
+    """
+    if not sort:
+        return None, False
+    field = sort[1:] if sort.startswith("-") else sort
+    if field not in SORT_FIELDS:
+        raise ValueError(f'Unknown sort "{sort}".')
+    return field, sort.startswith("-")
+
+
+def encode_cursor(sort, position):
+    """
+    Encode a position in the books sorted by a sort as a cursor.
+
+    :param sort: (str) The sort, or None.
+    :param position: (tuple) The sort value and the id of the last book of a page.
+
+    :returns:
+        str: The cursor.
+    """
+    data = json.dumps([sort or None, *position], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """
+    Decode a cursor made by encode_cursor.
+
+    :param cursor: (str) The cursor.
+    :param sort: (str) The sort the cursor must have been made for, or None.
+
+    :returns:
+        tuple: The position stored in the cursor.
+
+    :raises ValueError: If the cursor is malformed or was made for another sort.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, book_id = json.loads(data)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if cursor_sort != (sort or None) or not isinstance(book_id, int):
+        raise ValueError("Invalid cursor.")
+    return value, book_id
+
+
+def page(books, key, descending=False, after=None, offset=0, limit=None):
+    """
+    Take a page of books sorted in ascending order of key.
+
+    :param books: (list) The books, sorted by key.
+    :param key: (callable) Gives the position of a book.
+    :param descending: (bool, optional) True to page through the books from the last one. Defaults to False.
+    :param after: (tuple, optional) Only take the books after this position (before it, when descending).
+    :param offset: (int, optional) The number of books to skip (after the position). Defaults to 0.
+    :param limit: (int, optional) The maximum number of books to take. Defaults to no limit.
+
+    :returns:
+        list: The books of the page, in the requested order.
+    """
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("The offset and the limit can't be negative.")
+    if not descending:
+        start = (bisect_right(books, after, key=key) if after is not None else 0) + offset
+        return books[start:] if limit is None else books[start:start + limit]
+    end = (bisect_left(books, after, key=key) if after is not None else len(books)) - offset
+    start = 0 if limit is None else max(0, end - limit)
+    return books[start:max(0, end)][::-1]
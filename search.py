@@ -0,0 +1,224 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from itertools import islice
+
+# ---------------------------
+# This class is a full-text index over the title, author and genre of books.
+#
+# Every field is split into lowercase words (tokens), and the index maps each
+# token to the books containing it (an inverted index). The tokens are also
+# kept in a sorted list, so all the tokens starting with a prefix are found
+# with a binary search: every query word matches the words it is a prefix
+# of, which makes the index usable for search-as-you-type.
+#
+# A query with several words only matches books containing all of them. The
+# results are ranked by how many of the words matched exactly (a partial word
+# counts for half), in which field (a title match weighs more than an author
+# match, which weighs more than a genre match), and how rare the matched
+# words are in the library. Equally ranked books keep the library order.
+#
+# The books of a token are grouped by the weight the token has in them. The
+# candidates are taken from the groups of the rarest query word, from the
+# group that could give the highest score down: once the results are full
+# and no remaining group can beat the last of them, the search stops. The
+# books of the other query words are intersected as sets before anything is
+# scored, and all the books of a group of a one-word query that matched
+# exactly have the same score, so only the first of them are looked at.
+# ---------------------------
+
+FIELD_WEIGHTS = (("title", 3), ("author", 2), ("genre", 1))
+PREFIX_WEIGHT = 0.5
+# the books of another query word are intersected as a set when there are at most this many times as many
+# as candidates, otherwise each candidate is checked on its own
+FILTER_RATIO = 16
+
+_TOKEN = re.compile(r"\w+")
+# sorts after every character, so term + _LAST_CHAR sorts after all the tokens starting with term
+_LAST_CHAR = chr(0x10FFFF)
+
+
+def tokenize(text):
+    """
+    Split a text into lowercase words.
+
+    :param text: (str) The text.
+
+    :returns:
+        list: The words of the text, in order.
+    """
+    return _TOKEN.findall(str(text).casefold())
+
+
+class SearchIndex:
+    def __init__(self, books=()):
+        """
+        Initialize a SearchIndex object.
+
+        :param books: (iterable, optional) The books to index.
+        """
+        # token -> {weight: set of books}, token -> number of books, book -> {token: weight}
+        self._postings = {}
+        self._counts = {}
+        self._book_tokens = {}
+        self._tokens = []
+        for book in books:
+            self._add_postings(book)
+        self._tokens = sorted(self._postings)
+
+    def __len__(self):
+        """
+        The number of indexed books.
+        """
+        return len(self._book_tokens)
+
+    def add(self, book):
+        """
+        Add a book to the index (or index it again after it was removed and changed).
+
+        :param book: (Book) The book to add.
+        """
+        for token in self._add_postings(book):
+            insort(self._tokens, token)
+
+    def remove(self, book):
+        """
+        Remove a book from the index. Removing a book that isn't indexed does nothing.
+
+        :param book: (Book) The book to remove.
+        """
+        for token, weight in self._book_tokens.pop(book, {}).items():
+            groups = self._postings[token]
+            groups[weight].discard(book)
+            if not groups[weight]:
+                del groups[weight]
+            self._counts[token] -= 1
+            if not self._counts[token]:
+                del self._postings[token]
+                del self._counts[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def search(self, query, limit=20, order=None):
+        """
+        Find the books matching all the words of a query, best matches first.
+
+        :param query: (str) The words to look for.
+        :param limit: (int, optional) The maximum number of results. Defaults to 20.
+        :param order: (callable, optional) Gives the position of a book, used to order equally ranked books.
+
+        :returns:
+            list: The matching Book objects, at most limit of them.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        expansions = [self._expand(term) for term in terms]
+        if not all(expansions):
+            return []
+
+        total = len(self._book_tokens)
+        sizes = [sum(self._counts[token] for token in tokens) for tokens in expansions]
+        rarest = sizes.index(min(sizes))
+        term = terms[rarest]
+        others = [i for i in range(len(terms)) if i != rarest]
+        other_bound = sum(max(self._bound(terms[i], token, max(self._postings[token]), total)
+                              for token in expansions[i]) for i in others)
+        filters = [self._books(expansions[i]) for i in others if sizes[i] <= FILTER_RATIO * sizes[rarest]]
+        groups = sorted(((self._bound(term, token, weight, total), token, books)
+                         for token in expansions[rarest] for weight, books in self._postings[token].items()),
+                        key=lambda group: group[0], reverse=True)
+
+        results = []
+        seen = set()
+        arrival = iter(range(0, -total - 1, -1))
+        rank = (lambda book: -order(book)) if order is not None else (lambda book: next(arrival))
+        for bound, token, books in groups:
+            if len(results) == limit and bound + other_bound < results[0][0]:
+                break
+            candidates = books.difference(seen) if seen else books
+            if filters:
+                candidates = candidates.intersection(*filters)
+            if len(expansions[rarest]) > 1:
+                # a book is in one group of each of its tokens, but may have several tokens with the prefix
+                seen.update(candidates)
+            if not others and token == term:
+                # every book of the group scores the bound, only the first ones can make it into the results
+                if order is not None:
+                    candidates = heapq.nsmallest(limit, candidates, key=order)
+                scored = ((bound, book) for book in islice(candidates, limit))
+            else:
+                scored = ((self._score(terms, self._book_tokens[book], total), book) for book in candidates)
+            for score, book in scored:
+                if score is None:
+                    continue
+                item = (score, rank(book), book)
+                if len(results) < limit:
+                    heapq.heappush(results, item)
+                elif item[:2] > results[0][:2]:
+                    heapq.heapreplace(results, item)
+        return [book for *_, book in sorted(results, key=lambda item: item[:2], reverse=True)]
+
+    def _add_postings(self, book):
+        """
+        Record the tokens of a book in the postings.
+
+        :returns: (list) The tokens that were not in the index before.
+        """
+        book_tokens = {}
+        for field, weight in FIELD_WEIGHTS:
+            for token in set(tokenize(getattr(book, field))):
+                book_tokens[token] = book_tokens.get(token, 0) + weight
+        self._book_tokens[book] = book_tokens
+        new_tokens = []
+        for token, weight in book_tokens.items():
+            groups = self._postings.get(token)
+            if groups is None:
+                groups = self._postings[token] = {}
+                new_tokens.append(token)
+            groups.setdefault(weight, set()).add(book)
+            self._counts[token] = self._counts.get(token, 0) + 1
+        return new_tokens
+
+    def _expand(self, term):
+        """
+        Get all the indexed tokens starting with a term.
+        """
+        start = bisect_left(self._tokens, term)
+        end = bisect_left(self._tokens, term + _LAST_CHAR, start)
+        return self._tokens[start:end]
+
+    def _books(self, tokens):
+        """
+        Get the set of all the books containing any of the tokens.
+        """
+        return set().union(*(books for token in tokens for books in self._postings[token].values()))
+
+    def _idf(self, token, total):
+        """
+        The rarity (inverse document frequency) of a token: higher for tokens found in fewer books.
+        """
+        return math.log(1 + total / self._counts[token])
+
+    def _bound(self, term, token, weight, total):
+        """
+        The score a query word gets from a token with the given weight in a book.
+        """
+        return weight * (1 if token == term else PREFIX_WEIGHT) * self._idf(token, total)
+
+    def _score(self, terms, book_tokens, total):
+        """
+        Score a book against all the words of a query: for every word its exact match, or else its best
+        partial match. None if a word doesn't match.
+        """
+        score = 0.0
+        for term in terms:
+            if term in book_tokens:
+                score += self._bound(term, term, book_tokens[term], total)
+                continue
+            matches = [self._bound(term, token, weight, total)
+                       for token, weight in book_tokens.items() if token.startswith(term)]
+            if not matches:
+                return None
+            score += max(matches)
+        return score
@@ -0,0 +1,31 @@
+// Suggests completions for the inputs with a data-autocomplete attribute (the field to complete:
+// "title", "author" or "genre"), as the librarian types. The suggestions come from the /autocomplete
+// endpoint and are shown with a <datalist>, so the browser displays them under the input.
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+    var field = input.dataset.autocomplete;
+    var list = document.createElement('datalist');
+    list.id = input.name + '-suggestions';
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+    input.after(list);
+
+    var pending = null;
+    input.addEventListener('input', function () {
+        // only the answer to the last keystroke matters
+        if (pending) {
+            pending.abort();
+        }
+        pending = new AbortController();
+        var url = '/autocomplete?field=' + encodeURIComponent(field) + '&q=' + encodeURIComponent(input.value);
+        fetch(url, {signal: pending.signal})
+            .then(function (response) { return response.json(); })
+            .then(function (suggestions) {
+                list.replaceChildren.apply(list, suggestions.map(function (value) {
+                    var option = document.createElement('option');
+                    option.value = value;
+                    return option;
+                }));
+            })
+            .catch(function () {});
+    });
+});
@@ -0,0 +1,1308 @@
+import codecs
+import json
+import logging
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext
+from itertools import chain
+from book import Book
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# ---------------------------
+# This module defines where the library keeps its data.
+#
+# A storage object loads the books when the library starts, and is told about
+# every change the library makes (as a small "record" dictionary) so it can
+# persist it. JsonStorage rewrites the whole JSON file on every change, while
+# JournaledStorage only appends the record to a journal file and folds the
+# journal into the JSON file once in a while (compaction). SQLiteStorage keeps
+# one row per book in an SQLite database and updates only the changed rows.
+#
+# A storage whose "indexed" attribute is True also answers lookups by title,
+# author, genre and publication year itself, through its query method.
+#
+# A storage created with shared=True can be used by several processes at once
+# (for example gunicorn workers): every change is made inside transaction(),
+# which holds an advisory lock on a ".lock" file, and each process cheaply
+# checks with changed() whether another process wrote to the storage, and
+# then catches up with changes().
+#
+# The JSON file is never rewritten in place: it is written to a temporary file
+# that is then renamed over it, so a reader (or a restart after a crash) always
+# sees either the old or the new file. The durability level chooses how much is
+# flushed to disk before a change is considered saved:
+#   "none"  - nothing is fsynced (fastest, a power loss may lose recent changes),
+#   "fsync" - the written file is fsynced before it is renamed (the default),
+#   "full"  - the directory is fsynced too, so the rename itself survives a power loss.
+#
+# Books are loaded as a stream: the JSON file is parsed one book at a time (see
+# iter_json_array), so a very large file is never held in memory as a whole. A
+# file ending in ".jsonl" holds one book per line instead of a JSON array.
+#
+# Every storage also keeps the next_id of the library: one more than the
+# highest id ever given to a book, deleted books included, so a new book never
+# takes the id of a deleted one across restarts. The JSON file holds it next to
+# the books ({"next_id": ..., "books": [...]}, or a first line {"next_id": ...}
+# in a ".jsonl" file; a plain array of books is still read), and an SQLite
+# database in its meta table.
+#
+# GroupCommitStorage wraps another storage to group bursts of changes into a
+# single write (group commit), at most once per interval or batch size.
+# WriterThreadStorage wraps another storage to hand its writes to a dedicated
+# writer thread, so the threads serving requests never wait for the disk (see
+# asgi.py).
+# ---------------------------
+
+DURABILITY_LEVELS = ("none", "fsync", "full")
+
+# the umask of the process (it can only be read by setting it), for the mode of the files atomic_write creates
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(filename):
+    """
+    Hold an exclusive advisory lock on a file while the with block runs. The lock is shared with the other
+    processes (and the other threads) locking the same file.
+
+    :param filename: (str) The lock file. It is created if it doesn't exist.
+    """
+    with open(filename, 'a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def check_durability(durability):
+    """
+    Check that a durability level is one of DURABILITY_LEVELS.
+
+    :param durability: (str) The durability level.
+    """
+    if durability not in DURABILITY_LEVELS:
+        raise ValueError(f'Unknown durability level "{durability}".')
+
+
+def sync_directory(filename):
+    """
+    Fsync the directory of a file, so a file created or renamed in it survives a power loss.
+    Directories can't be opened on every platform; there is nothing to do then.
+
+    :param filename: (str) A file in the directory.
+    """
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def atomic_write(filename, data, durability="fsync"):
+    """
+    Replace the content of a file atomically: the data is written to a temporary file in the same
+    directory, which is then renamed over the file. The file keeps its permissions (a new file gets the
+    ones open() would give it), although the temporary file is created readable by its owner only.
+
+    :param filename: (str) The file to write.
+    :param data: (bytes) The new content of the file.
+    :param durability: (str, optional) One of DURABILITY_LEVELS. Defaults to "fsync".
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    file = tempfile.NamedTemporaryFile(dir=directory, prefix=name + '.', suffix='.tmp', delete=False)
+    try:
+        with file:
+            file.write(data)
+            if durability != "none":
+                file.flush()
+                os.fsync(file.fileno())
+        os.chmod(file.name, mode)
+        os.replace(file.name, filename)
+    except BaseException:
+        try:
+            os.remove(file.name)
+        except FileNotFoundError:
+            pass
+        raise
+    if durability == "full":
+        sync_directory(filename)
+
+
+def file_stamp(filename):
+    """
+    Get a cheap fingerprint of a file, which changes whenever the file is rewritten.
+
+    :param filename: (str) The file.
+
+    :returns:
+        tuple: The inode, size and modification time of the file, or None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def parse_lines(data):
+    """
+    Parse the complete JSON lines at the start of some journal data. Parsing stops at the first line
+    that is not complete (the result of an interrupted write).
+
+    :param data: (bytes) The journal data.
+
+    :returns:
+        tuple: A tuple where the first element is the list of parsed records, and the second element is the
+               number of bytes they took.
+    """
+    records = []
+    consumed = 0
+    while True:
+        end = data.find(b'\n', consumed)
+        if end == -1:
+            break
+        try:
+            records.append(json.loads(data[consumed:end]))
+        except ValueError:
+            break
+        consumed = end + 1
+    return records, consumed
+
+
+def read_chunks(file, chunk_size, progress=None):
+    """
+    Read a file chunk by chunk.
+
+    :param file: The file, opened in binary mode.
+    :param chunk_size: (int) The size of the chunks.
+    :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) after every chunk.
+
+    :returns:
+        generator: The chunks (bytes).
+    """
+    total = os.fstat(file.fileno()).st_size
+    done = 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        done += len(chunk)
+        yield chunk
+        if progress:
+            progress(done, total)
+
+
+def iter_json_array(chunks, header=None):
+    """
+    Parse a JSON array incrementally, one element at a time.
+
+    Only the part of the text that hasn't been parsed yet is kept, so the memory needed is bounded by
+    the size of a chunk and of a single element, whatever the size of the array.
+
+    The array may also be the "books" member of a JSON object (the library file saved with its next_id,
+    see JsonStorage): the other members of the object are then put in the header dictionary.
+
+    :param chunks: (iterable) The UTF-8 encoded text of the array, in chunks of bytes.
+    :param header: (dict, optional) Filled with the other members of the object around the array.
+
+    :returns:
+        generator: The elements of the array.
+    """
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    eof = False
+    # then "first" (after "["), "element" (after ","), "separator" and "end"; and around the array of an object,
+    # "key", "colon", "value" (of a member that isn't the array), "array" (before "[") and "member"
+    state = "start"
+    wrapped = False
+    # the key of the member being read, and whether the array was found in the object
+    key = None
+    found = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                break
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buffer = text_decoder.decode(chunk or b'', final=eof)
+            position = 0
+            continue
+
+        char = buffer[position]
+        if state == "start":
+            if char not in '[{':
+                raise ValueError('The library file should hold a JSON array.')
+            position += 1
+            wrapped = char == '{'
+            state = "key" if wrapped else "first"
+        elif state == "colon":
+            if char != ':':
+                raise ValueError('The library file holds a broken JSON object.')
+            position += 1
+            state = "array" if key == "books" and not found else "value"
+        elif state == "array":
+            if char != '[':
+                raise ValueError('The books of the library file should be a JSON array.')
+            position += 1
+            found = True
+            state = "first"
+        elif state == "member":
+            if char not in ',}':
+                raise ValueError('The members of the library file should be separated by commas.')
+            position += 1
+            state = "key" if char == ',' else "end"
+        elif state in ("first", "element", "key", "value"):
+            if state == "first" and char == ']':
+                position += 1
+                state = "member" if wrapped else "end"
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                element, end = None, None
+            if end is None or (end == len(buffer) and not isinstance(element, (dict, list))):
+                # the element is (or may be) cut by the end of the chunk
+                if eof:
+                    raise ValueError('The library file ends in the middle of a book.')
+                chunk = next(chunks, None)
+                eof = chunk is None
+                buffer = buffer[position:] + text_decoder.decode(chunk or b'', final=eof)
+                position = 0
+                continue
+            position = end
+            if state == "key":
+                key = element
+                state = "colon"
+            elif state == "value":
+                if header is not None:
+                    header[key] = element
+                state = "member"
+            else:
+                yield element
+                state = "separator"
+        elif state == "separator":
+            if char not in ',]':
+                raise ValueError('The books of the library file should be separated by commas.')
+            position += 1
+            state = "element" if char == ',' else "member" if wrapped else "end"
+        else:
+            raise ValueError('The library file has extra data after the JSON array.')
+    if state not in ("start", "end"):
+        raise ValueError('The library file ends before the end of the JSON array.')
+    if wrapped and not found:
+        raise ValueError('The library file should hold a JSON array of books.')
+
+
+def next_id_after(next_id, book_id):
+    """
+    Get the next_id of a library (see the top of this module) once it holds a book.
+
+    :param next_id: (int) The next_id so far.
+    :param book_id: (int) The id of the book (None for a book saved before books had ids).
+
+    :returns:
+        int: The next_id, above the id of the book.
+    """
+    return max(next_id, book_id + 1) if isinstance(book_id, int) else next_id
+
+
+def iter_json_lines(chunks):
+    """
+    Parse JSON Lines (one JSON value per line) incrementally.
+
+    :param chunks: (iterable) The UTF-8 encoded text, in chunks of bytes.
+
+    :returns:
+        generator: The values, one per non-empty line.
+    """
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+
+class JsonStorage:
+    indexed = False
+
+    # size of the chunks the JSON file is read in
+    chunk_size = 1 << 16
+
+    def __init__(self, filename="library.json", shared=False, durability="fsync"):
+        """
+        Initialize a JsonStorage object.
+
+        :param filename: (str, optional) The JSON file holding the list of books. Defaults to "library.json".
+        :param shared: (bool, optional) True if several processes use the file at the same time. Defaults to False.
+        :param durability: (str, optional) One of DURABILITY_LEVELS. Defaults to "fsync".
+        """
+        if shared and fcntl is None:
+            raise OSError('Sharing the storage between processes needs file locking, which is not available here.')
+        check_durability(durability)
+        self.filename = filename
+        self.shared = shared
+        self.durability = durability
+        self._stamp = None
+        # one more than the highest id given to a book so far (see the top of this module)
+        self.next_id = 1
+
+    def transaction(self):
+        """
+        Get the context manager to make a change in. For a shared storage it holds the lock file of the storage,
+        otherwise it does nothing.
+
+        :returns:
+            A context manager.
+        """
+        if not self.shared:
+            return nullcontext()
+        return file_lock(self.filename + ".lock")
+
+    def changed(self):
+        """
+        Check (cheaply) whether the storage was written by someone else since it was last read or written.
+
+        :returns:
+            bool: True if the storage changed.
+        """
+        return file_stamp(self.filename) != self._stamp
+
+    def changes(self):
+        """
+        Catch up with the changes written by someone else. Should be called inside transaction().
+
+        :returns:
+            tuple: A tuple where the first element is True if the books have to be loaded again, and the second
+                   element is the list of records to replay otherwise (a JSON file can only be loaded again).
+        """
+        return self.changed(), []
+
+    def load(self, progress=None):
+        """
+        Load the books from the JSON file.
+
+        :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) while the file is read.
+
+        :returns:
+            tuple: A tuple where the first element is an iterator over the Book objects (the file is read while
+                   iterating), and the second element is the list of records that still have to be replayed on top
+                   of them (always empty here).
+        """
+        return self._iter_snapshot(progress), []
+
+    def save(self, books):
+        """
+        Save all the books to the JSON file.
+
+        :param books: (list) List of Book objects to save.
+        """
+        self._write_snapshot(books)
+
+    def write(self, record, books, changed):
+        """
+        Persist a single change of the library.
+
+        :param record: (dict) The change that was applied (see Library for the record format).
+        :param books: (list) The list of Book objects after the change.
+        :param changed: (list) The Book objects that were added, updated or deleted by the change.
+        """
+        self.write_many([(record, changed)], books)
+
+    def write_many(self, changes, books):
+        """
+        Persist several changes of the library at once. The whole file is rewritten (once).
+
+        :param changes: (list) List of (record, changed) tuples, in the order the changes were applied.
+        :param books: (list) The list of Book objects after the changes.
+        """
+        self._note_ids(record for record, _ in changes)
+        self.save(books)
+
+    def flush(self):
+        """
+        Write out any change that is not persisted yet. Changes are persisted right away here.
+        """
+
+    def close(self):
+        """
+        Release the resources of the storage. There is nothing to release here.
+        """
+
+    def _iter_snapshot(self, progress=None):
+        """
+        Read the books of the JSON file one at a time.
+
+        :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) after every chunk.
+
+        :returns:
+            generator: The Book objects.
+        """
+        self._stamp = file_stamp(self.filename)
+        self.next_id = 1
+        try:
+            file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return
+        header = {}
+        with file:
+            chunks = self._read_chunks(file, progress)
+            if self.filename.endswith('.jsonl'):
+                book_dicts = iter_json_lines(chunks)
+            else:
+                book_dicts = iter_json_array(chunks, header)
+            for book_dict in book_dicts:
+                if "title" not in book_dict and "next_id" in book_dict:
+                    # the first line of a JSON Lines file
+                    header.update(book_dict)
+                    continue
+                book = Book(**book_dict)
+                self._note_id(book.id)
+                yield book
+        self.next_id = max(self.next_id, header.get("next_id", 1))
+
+    def _read_chunks(self, file, progress):
+        """
+        Read the JSON file in chunks.
+
+        :param file: The JSON file, opened in binary mode.
+        :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) after every chunk.
+
+        :returns:
+            generator: The chunks (bytes).
+        """
+        return read_chunks(file, self.chunk_size, progress)
+
+    def _write_snapshot(self, books):
+        """
+        Write the books to the JSON file, atomically.
+
+        :param books: (list) List of Book objects to save.
+
+        :returns:
+            bytes: The data that was written.
+        """
+        book_dicts = [book.to_storage_dict() for book in books]
+        for book_dict in book_dicts:
+            self._note_id(book_dict["id"])
+        if self.filename.endswith('.jsonl'):
+            data = ''.join(json.dumps(book_dict) + '\n' for book_dict in [{"next_id": self.next_id}] + book_dicts)
+            data = data.encode()
+        else:
+            data = json.dumps({"next_id": self.next_id, "books": book_dicts}).encode()
+        atomic_write(self.filename, data, self.durability)
+        self._stamp = file_stamp(self.filename)
+        return data
+
+
+    def _note_id(self, book_id):
+        """
+        Make sure next_id is above the id of a book (None for a book saved before books had ids).
+        """
+        self.next_id = next_id_after(self.next_id, book_id)
+
+    def _note_ids(self, records):
+        """
+        Make sure next_id is above the ids of the books added by change records.
+        """
+        for record in records:
+            if record.get("op") == "add":
+                self._note_id(record["book"].get("id"))
+
+
+class JournaledStorage(JsonStorage):
+    def __init__(self, filename="library.json", journal_filename=None, compact_every=1000, shared=False,
+                 durability="fsync"):
+        """
+        Initialize a JournaledStorage object.
+
+        The journal is a text file with one JSON record per line. Its first line is a header holding the
+        checksum of the JSON file the records apply to, so a journal that was already folded into the JSON
+        file (for example when the process stopped in the middle of a compaction) is not replayed twice.
+
+        The storage remembers how far it has read the journal, so when another process appends records
+        only the new ones are read and replayed.
+
+        :param filename: (str, optional) The JSON file holding the list of books. Defaults to "library.json".
+        :param journal_filename: (str, optional) The journal file. Defaults to the filename followed by ".journal".
+        :param compact_every: (int, optional) Number of journal records after which the journal is folded into
+                              the JSON file. Defaults to 1000.
+        :param shared: (bool, optional) True if several processes use the files at the same time. Defaults to False.
+        :param durability: (str, optional) One of DURABILITY_LEVELS. Unless it is "none", every appended record
+                           is fsynced. Defaults to "fsync".
+        """
+        super().__init__(filename, shared, durability)
+        self.journal_filename = journal_filename or filename + ".journal"
+        self.compact_every = compact_every
+        self.journal_length = 0
+        self._snapshot_checksum = None
+        self._journal_offset = None
+
+    def changed(self):
+        """
+        Check (cheaply) whether the JSON file was rewritten or the journal grew since they were last read.
+
+        :returns:
+            bool: True if the storage changed.
+        """
+        if file_stamp(self.filename) != self._stamp:
+            return True
+        try:
+            return os.path.getsize(self.journal_filename) != (self._journal_offset or 0)
+        except FileNotFoundError:
+            return self._journal_offset is not None
+
+    def changes(self):
+        """
+        Catch up with the changes written by other processes. Should be called inside transaction().
+
+        :returns:
+            tuple: A tuple where the first element is True if the books have to be loaded again (the JSON file
+                   was rewritten), and the second element is the list of new journal records to replay otherwise.
+        """
+        if file_stamp(self.filename) != self._stamp or self._journal_offset is None:
+            return True, []
+        try:
+            with open(self.journal_filename, 'rb') as file:
+                file.seek(self._journal_offset)
+                data = file.read()
+        except FileNotFoundError:
+            return True, []
+        records, consumed = parse_lines(data)
+        self._journal_offset += consumed
+        self.journal_length += len(records)
+        self._note_ids(records)
+        return False, records
+
+    def load(self, progress=None):
+        """
+        Load the books from the JSON file, together with the records of the journal.
+
+        :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) while the file is read.
+
+        :returns:
+            tuple: A tuple where the first element is an iterator over the Book objects of the JSON file, and the
+                   second element an iterator over the journal records to replay on top of them, in order. The
+                   records must be iterated after the books, as the journal is checked against the JSON file
+                   that was read.
+        """
+        self._snapshot_checksum = 0
+        return self._iter_snapshot(progress), self._iter_journal()
+
+    def _read_chunks(self, file, progress):
+        """
+        Read the JSON file in chunks, computing its checksum along the way.
+
+        :param file: The JSON file, opened in binary mode.
+        :param progress: (callable, optional) Called as progress(bytes_read, total_bytes) after every chunk.
+
+        :returns:
+            generator: The chunks (bytes).
+        """
+        for chunk in read_chunks(file, self.chunk_size, progress):
+            self._snapshot_checksum = zlib.crc32(chunk, self._snapshot_checksum)
+            yield chunk
+
+    def _iter_journal(self):
+        """
+        Read the records of the journal, once the JSON file has been read.
+
+        :returns:
+            generator: The record dictionaries.
+        """
+        records = self._read_journal()
+        self.journal_length = len(records)
+        self._note_ids(records)
+        yield from records
+
+    def _read_journal(self):
+        """
+        Read the records of the journal that apply to the current JSON file.
+
+        A last line that can't be parsed is the result of an interrupted write and is ignored (and overwritten
+        by the next record).
+
+        :returns:
+            list: List of record dictionaries.
+        """
+        self._journal_offset = None
+        try:
+            with open(self.journal_filename, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+
+        records, consumed = parse_lines(data)
+        if not records or records[0].get("snapshot") != self._snapshot_checksum:
+            # the journal belongs to an older JSON file, it is replaced on the next write
+            return []
+        self._journal_offset = consumed
+        return records[1:]
+
+    def save(self, books):
+        """
+        Save all the books to the JSON file and start a new, empty journal (compaction).
+
+        :param books: (list) List of Book objects to save.
+        """
+        data = self._write_snapshot(books)
+        self._snapshot_checksum = zlib.crc32(data)
+        self._start_journal()
+
+    def write_many(self, changes, books):
+        """
+        Append changes of the library to the journal (in a single write, fsynced once), and compact the journal
+        when it gets too long.
+
+        :param changes: (list) List of (record, changed) tuples, in the order the changes were applied.
+        :param books: (list) The list of Book objects after the changes, used for compaction.
+        """
+        if self._snapshot_checksum is None:
+            # read the files first, to know which JSON file the journal applies to
+            loaded, records = self.load()
+            for _ in chain(loaded, records):
+                pass
+        if self._journal_offset is None:
+            self._start_journal()
+        data = b''.join(json.dumps(record, separators=(',', ':')).encode() + b'\n' for record, _ in changes)
+        with open(self.journal_filename, 'r+b') as file:
+            # drop what is left of an interrupted write
+            file.truncate(self._journal_offset)
+            file.seek(self._journal_offset)
+            file.write(data)
+            self._journal_offset = file.tell()
+            if self.durability != "none":
+                file.flush()
+                os.fsync(file.fileno())
+        self.journal_length += len(changes)
+        self._note_ids(record for record, _ in changes)
+        if self.journal_length >= self.compact_every:
+            self.save(books)
+
+    def _start_journal(self):
+        """
+        Replace the journal with an empty one that applies to the current JSON file.
+        """
+        header = json.dumps({"snapshot": self._snapshot_checksum}).encode() + b'\n'
+        atomic_write(self.journal_filename, header, self.durability)
+        self._journal_offset = len(header)
+        self.journal_length = 0
+
+
+class SQLiteStorage:
+    indexed = True
+
+    COLUMNS = ("title", "author", "publication_year", "genre", "is_borrowed", "borrowed_timestamp", "copies", "loans",
+               "holds")
+
+    SYNCHRONOUS = {"none": "OFF", "fsync": "NORMAL", "full": "FULL"}
+
+    def __init__(self, filename="library.db", seed_filename=None, shared=False, durability="fsync"):
+        """
+        Initialize an SQLiteStorage object. The database is opened when the books are first loaded.
+
+        Every book is stored in its own row, whose id is the id of the book, with indexes on the title,
+        author, genre and publication_year columns. The loan records of its copies and the users holding it
+        are kept as JSON in the loans and holds columns. The storage remembers which row belongs to which Book object,
+        so a change only touches the rows of the changed books, in a single transaction. The
+        connection is shared by all threads and guarded by a lock.
+
+        :param filename: (str, optional) The SQLite database file. Defaults to "library.db".
+        :param seed_filename: (str, optional) A JSON file to import the books from when the database is empty,
+                              for example the "library.json" used before switching to SQLite.
+        :param shared: (bool, optional) True if several processes use the database at the same time.
+                       Defaults to False.
+        :param durability: (str, optional) One of DURABILITY_LEVELS, mapped to SQLite's "synchronous" setting
+                           (OFF, NORMAL or FULL). Defaults to "fsync".
+        """
+        if shared and fcntl is None:
+            raise OSError('Sharing the storage between processes needs file locking, which is not available here.')
+        check_durability(durability)
+        self.durability = durability
+        self.filename = filename
+        self.seed_filename = seed_filename
+        self.shared = shared
+        self.connection = None
+        self._data_version = None
+        self._lock = threading.RLock()
+        # one more than the highest id given to a book so far (see the top of this module)
+        self.next_id = 1
+        # row id (the id of the book) -> Book object, to answer queries with
+        self._books_by_row = {}
+
+    def _connect(self):
+        """
+        Open the database (once) and create the books table and its indexes if they don't exist.
+
+        :returns:
+            sqlite3.Connection: The open connection.
+        """
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+            self.connection.execute(f"PRAGMA synchronous = {self.SYNCHRONOUS[self.durability]}")
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, title TEXT NOT NULL, "
+                    "author TEXT, publication_year INTEGER, genre TEXT, is_borrowed INTEGER NOT NULL DEFAULT 0, "
+                    "borrowed_timestamp TEXT, copies INTEGER NOT NULL DEFAULT 1, loans TEXT, holds TEXT)")
+                # databases created before books had copies
+                columns = {row[1] for row in self.connection.execute("PRAGMA table_info(books)")}
+                if "copies" not in columns:
+                    self.connection.execute("ALTER TABLE books ADD COLUMN copies INTEGER NOT NULL DEFAULT 1")
+                    self.connection.execute("ALTER TABLE books ADD COLUMN loans TEXT")
+                # and before books had holds
+                if "holds" not in columns:
+                    self.connection.execute("ALTER TABLE books ADD COLUMN holds TEXT")
+                for column in ("title", "author", "genre", "publication_year"):
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS books_{column} ON books ({column})")
+                # name -> value, for the next_id
+                self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        return self.connection
+
+    def transaction(self):
+        """
+        Get the context manager to make a change in. For a shared storage it holds the lock file of the database,
+        so the change is made on top of the latest data, otherwise it does nothing.
+
+        :returns:
+            A context manager.
+        """
+        if not self.shared:
+            return nullcontext()
+        return file_lock(self.filename + ".lock")
+
+    def changed(self):
+        """
+        Check (cheaply) whether another connection committed changes to the database since it was last read.
+
+        :returns:
+            bool: True if the database changed.
+        """
+        with self._lock:
+            return self._connect().execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def changes(self):
+        """
+        Catch up with the changes committed by other processes. Should be called inside transaction().
+
+        :returns:
+            tuple: A tuple where the first element is True if the books have to be loaded again, and the second
+                   element is an empty list of records.
+        """
+        return self.changed(), []
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def load(self, progress=None):
+        """
+        Load the books from the database.
+
+        :param progress: (callable, optional) Called as progress(books_read, total_books) every 10000 books.
+
+        :returns:
+            tuple: A tuple where the first element is an iterator over the Book objects (in the order they were
+                   added, read from the database while iterating), and the second element is an empty list of
+                   records to replay.
+        """
+        return self._iter_books(progress), []
+
+    def _iter_books(self, progress=None):
+        """
+        Read the books of the database one row at a time.
+
+        :param progress: (callable, optional) Called as progress(books_read, total_books) every 10000 books.
+
+        :returns:
+            generator: The Book objects.
+        """
+        with self._lock:
+            connection = self._connect()
+            if self.seed_filename and not connection.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+                seed_books, _ = JsonStorage(self.seed_filename).load(progress)
+                seed_books = list(seed_books)
+                self.save(seed_books)
+                yield from seed_books
+                return
+
+            self._data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+            self._books_by_row = {}
+            saved = connection.execute("SELECT value FROM meta WHERE name = 'next_id'").fetchone()
+            highest = connection.execute("SELECT MAX(id) FROM books").fetchone()[0]
+            self.next_id = next_id_after(saved[0] if saved else 1, highest)
+            total = connection.execute("SELECT COUNT(*) FROM books").fetchone()[0] if progress else None
+            rows = connection.execute(f"SELECT id, {', '.join(self.COLUMNS)} FROM books ORDER BY id")
+            for count, row in enumerate(rows, 1):
+                yield self._row_to_book(row)
+                if progress and (count % 10000 == 0 or count == total):
+                    progress(count, total)
+
+    def _row_to_book(self, row):
+        """
+        Build the Book object of a row and remember it.
+
+        :param row: (tuple) The id followed by the COLUMNS of the row.
+
+        :returns:
+            Book: The Book object.
+        """
+        row_id, title, author, publication_year, genre, is_borrowed, borrowed_timestamp, copies, loans, holds = row
+        book = Book(title, author, publication_year, genre, bool(is_borrowed), borrowed_timestamp, row_id, copies,
+                    json.loads(loans) if loans is not None else None, json.loads(holds) if holds else None)
+        self._remember(book)
+        return book
+
+    def _remember(self, book):
+        """
+        Remember the Book object of a row, to answer queries with. A storage that doesn't answer queries (see
+        GroupCommitStorage) doesn't keep them.
+        """
+        if self.indexed:
+            self._books_by_row[book.id] = book
+
+    @staticmethod
+    def _book_to_row(book):
+        """
+        Convert a Book object to the values of the COLUMNS.
+        """
+        return (book.title, book.author, book.publication_year, book.genre,
+                int(bool(book.is_borrowed)), book.borrowed_timestamp, book.copies,
+                json.dumps(book.loan_records()), json.dumps(list(book.holds)) if book.holds else None)
+
+    def save(self, books):
+        """
+        Replace all the rows of the database with the given books, in a single transaction.
+
+        :param books: (list) List of Book objects to save.
+        """
+        with self._lock:
+            connection = self._connect()
+            self._books_by_row = {}
+            with connection:
+                connection.execute("DELETE FROM books")
+                for book in books:
+                    self._insert(connection, book)
+                self._save_next_id(connection)
+
+    def _insert(self, connection, book):
+        """
+        Insert the row of a book, with the id of the book as its row id, and remember it. A book without an id
+        (imported from a file saved before books had ids) gets the row id SQLite chooses as its id.
+        """
+        cursor = connection.execute(
+            f"INSERT INTO books (id, {', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * (len(self.COLUMNS) + 1))})",
+            (book.id,) + self._book_to_row(book))
+        if book.id is None:
+            book.id = cursor.lastrowid
+        self.next_id = next_id_after(self.next_id, book.id)
+        self._remember(book)
+
+    def _save_next_id(self, connection):
+        """
+        Save the next_id in the meta table, in the transaction of the change.
+        """
+        connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_id', ?)", (self.next_id,))
+
+    def write(self, record, books, changed):
+        """
+        Persist a single change of the library by inserting, updating or deleting the rows of the changed books
+        in a single transaction.
+
+        :param record: (dict) The change that was applied.
+        :param books: (list) The list of Book objects after the change (not needed here).
+        :param changed: (list) The Book objects that were added, updated or deleted by the change.
+        """
+        self.write_many([(record, changed)], books)
+
+    def write_many(self, changes, books):
+        """
+        Persist several changes of the library in a single transaction.
+
+        :param changes: (list) List of (record, changed) tuples, in the order the changes were applied.
+        :param books: (list) The list of Book objects after the changes (not needed here).
+        """
+        with self._lock, self._connect() as connection:
+            for record, changed in changes:
+                if record["op"] == "add":
+                    for book in changed:
+                        self._insert(connection, book)
+                    self._save_next_id(connection)
+                elif record["op"] == "delete":
+                    for book in changed:
+                        self._books_by_row.pop(book.id, None)
+                        connection.execute("DELETE FROM books WHERE id = ?", (book.id,))
+                else:
+                    for book in changed:
+                        connection.execute(
+                            f"UPDATE books SET {', '.join(column + ' = ?' for column in self.COLUMNS)} WHERE id = ?",
+                            self._book_to_row(book) + (book.id,))
+
+    def flush(self):
+        """
+        Write out any change that is not persisted yet. Changes are committed right away here.
+        """
+
+    def query(self, title=None, author=None, genre=None, publication_year=None):
+        """
+        Find the books matching all the given values, using the indexes of the database.
+
+        :param title: (str, optional) Title of the books.
+        :param author: (str, optional) Author's name of the books.
+        :param genre: (str, optional) Genre of the books.
+        :param publication_year: (int, optional) Year of publication of the books.
+
+        :returns:
+            list: List of Book objects that match, in the order they were added.
+        """
+        conditions = []
+        values = []
+        for column, value in (("title", title), ("author", author), ("genre", genre),
+                              ("publication_year", publication_year)):
+            if value:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        sql = "SELECT id FROM books"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._connect().execute(sql + " ORDER BY id", values)
+            return [self._books_by_row[row_id] for row_id, in rows]
+
+
+class GroupCommitStorage:
+    # the name of the background thread
+    thread_name = "library-group-commit"
+
+    def __init__(self, storage, interval=1.0, batch_size=100):
+        """
+        Initialize a GroupCommitStorage object, which wraps another storage and groups its writes.
+
+        A change is kept in memory (the library itself is updated right away) and the pending changes
+        are written together, with a single write_many of the wrapped storage, as soon as batch_size
+        changes are pending or at the latest interval seconds after the last write. A background thread
+        makes the writes, so the thread making a change never waits for the disk. flush() writes the
+        pending changes right away, and close() must be called on shutdown so the last changes aren't lost.
+
+        The background thread writes while the library keeps changing, so it doesn't hand the library's own
+        Book objects to the wrapped storage: it copies every book it writes, holding the lock the library
+        changes the book under (see book_lock), and the wrapped storage serializes the copies.
+
+        Pending changes are not visible to other processes, so a shared storage can't be wrapped. Lookups
+        are answered by the library's own indexes, because the wrapped storage doesn't know the pending
+        changes yet.
+
+        :param storage: The storage to write to.
+        :param interval: (float, optional) Maximum number of seconds a change stays pending, or None to wait
+                         for batch_size changes. Defaults to 1.0.
+        :param batch_size: (int, optional) Number of pending changes that triggers a write. Defaults to 100.
+        """
+        if storage.shared:
+            raise ValueError('Changes to a shared storage can\'t be grouped.')
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        # the number of seconds to wait before writing again after a write failed
+        self.retry_interval = interval or 1.0
+        self.shared = False
+        self.indexed = False
+        # the wrapped storage isn't asked for lookups either, so it needn't keep books for them
+        storage.indexed = False
+        # callable giving the lock to hold while copying a book, set by the library (see Library.__init__)
+        self.book_lock = None
+        self._pending = []
+        self._books = []
+        # the next_id of the pending changes, handed to the wrapped storage with them (a book added and deleted
+        # again before a save is never written, but its id is still used)
+        self._next_id = 1
+        # True when all the books are to be saved again (see save)
+        self._save_all = False
+        self._lock = threading.Lock()
+        # signalled when batch_size changes are pending, or on close
+        self._queued = threading.Condition(self._lock)
+        # serializes the writes to the wrapped storage, which are made without holding _lock
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    @property
+    def filename(self):
+        """
+        The file of the wrapped storage.
+        """
+        return self.storage.filename
+
+    @filename.setter
+    def filename(self, filename):
+        self.storage.filename = filename
+
+    @property
+    def next_id(self):
+        """
+        One more than the highest id given to a book so far, pending changes included (see the top of this
+        module).
+        """
+        return max(self.storage.next_id, self._next_id)
+
+    def transaction(self):
+        """
+        Get the context manager to make a change in (it does nothing, the storage is not shared).
+
+        :returns:
+            A context manager.
+        """
+        return nullcontext()
+
+    def changed(self):
+        """
+        Check whether the storage was written by someone else. It never is, the storage is not shared.
+
+        :returns:
+            bool: False.
+        """
+        return False
+
+    def changes(self):
+        """
+        Catch up with the changes written by someone else (there are none, the storage is not shared).
+
+        :returns:
+            tuple: (False, []).
+        """
+        return False, []
+
+    def load(self, progress=None):
+        """
+        Write out the pending changes, then load the books from the wrapped storage.
+
+        :param progress: (callable, optional) Called while loading, see the load method of the wrapped storage.
+
+        :returns:
+            tuple: The books and the records to replay, see JsonStorage.load.
+        """
+        self.flush()
+        return self.storage.load(progress)
+
+    def save(self, books):
+        """
+        Save all the books to the wrapped storage, on the background thread (flush() waits for it). The pending
+        changes are already part of the books, so they are dropped.
+
+        :param books: (list) List of Book objects to save.
+        """
+        with self._lock:
+            self._pending = []
+            self._books = books
+            self._save_all = True
+            self._start_flusher()
+            self._queued.notify()
+
+    def write(self, record, books, changed):
+        """
+        Add a change to the pending changes (see write_many).
+
+        :param record: (dict) The change that was applied.
+        :param books: (list) The list of Book objects after the change.
+        :param changed: (list) The Book objects that were added, updated or deleted by the change.
+        """
+        self.write_many([(record, changed)], books)
+
+    def write_many(self, changes, books):
+        """
+        Add changes to the pending changes, and have the background thread write them out if there are
+        batch_size of them.
+
+        :param changes: (list) List of (record, changed) tuples, in the order the changes were applied.
+        :param books: (list) The list of Book objects after the changes.
+        """
+        with self._lock:
+            self._pending.extend(changes)
+            self._books = books
+            for record, _ in changes:
+                if record["op"] == "add":
+                    self._next_id = next_id_after(self._next_id, record["book"].get("id"))
+            self._start_flusher()
+            if len(self._pending) >= self.batch_size:
+                self._queued.notify()
+
+    def flush(self):
+        """
+        Write out the pending changes now. If writing fails they stay pending. The books are copied under their
+        locks, so flush() must not be called while holding one of the library's locks.
+
+        New changes can be added while the pending ones are being written; they are written by the next flush.
+        """
+        with self._write_lock:
+            with self._lock:
+                changes, books, save_all = self._pending, self._books, self._save_all
+                self._pending = []
+                self._save_all = False
+                next_id = self._next_id
+            if not changes and not save_all:
+                return
+            self.storage.next_id = max(self.storage.next_id, next_id)
+            copies = {}
+
+            def copy(book):
+                # a book changed several times is copied (at its latest state) once
+                if book not in copies:
+                    copies[book] = self._copy(book)
+                return copies[book]
+
+            try:
+                # the changed books are copied now, all the books only if the wrapped storage writes them
+                all_books = (copy(book) for book in list(books))
+                if save_all:
+                    self.storage.save(all_books)
+                else:
+                    self.storage.write_many([(record, [copy(book) for book in changed]) for record, changed in changes],
+                                            all_books)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = changes
+                    self._save_all = self._save_all or save_all
+                raise
+
+    def close(self):
+        """
+        Stop the background thread, write out the pending changes and close the wrapped storage.
+        """
+        with self._lock:
+            self._stopped.set()
+            self._queued.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self.storage.close()
+
+    def _copy(self, book):
+        """
+        Copy a book, holding its lock (see book_lock) so the copy isn't taken in the middle of a change.
+
+        :param book: (Book) The book to copy.
+
+        :returns:
+            Book: The copy.
+        """
+        with self.book_lock(book) if self.book_lock is not None else nullcontext():
+            return Book(**book.to_storage_dict())
+
+    def _start_flusher(self):
+        """
+        Start the background thread that writes out the pending changes, if it isn't running yet. The storage
+        lock must be held.
+        """
+        if self._flusher is None and not self._stopped.is_set():
+            self._flusher = threading.Thread(target=self._run_flusher, name=self.thread_name, daemon=True)
+            self._flusher.start()
+
+    def _due(self):
+        """
+        Check whether the pending changes are to be written without waiting any longer. The storage lock must
+        be held.
+        """
+        return len(self._pending) >= self.batch_size or self._save_all or self._stopped.is_set()
+
+    def _run_flusher(self):
+        """
+        Body of the background thread.
+        """
+        while True:
+            with self._lock:
+                self._queued.wait_for(self._due, self.interval)
+            if self._stopped.is_set():
+                # close() writes out the rest
+                return
+            try:
+                self.flush()
+            except Exception:
+                # the changes stay pending and are written on the next attempt
+                logger.exception("Writing the pending library changes failed")
+                self._stopped.wait(self.retry_interval)
+
+
+class WriterThreadStorage(GroupCommitStorage):
+    thread_name = "library-writer"
+
+    def __init__(self, storage, retry_interval=1.0):
+        """
+        Initialize a WriterThreadStorage object, which wraps another storage and makes its writes on a
+        dedicated writer thread, so the threads changing the library never wait for the disk.
+
+        A change is queued (the library itself is updated right away) and the writer thread writes it out as
+        soon as it can: the changes queued while a write is in progress are written together by the next one,
+        with a single write_many of the wrapped storage. It is a GroupCommitStorage that doesn't wait for more
+        changes before writing.
+
+        :param storage: The storage to write to.
+        :param retry_interval: (float, optional) Number of seconds to wait before writing again after a
+                               write failed. Defaults to 1.0.
+        """
+        super().__init__(storage, interval=None, batch_size=1)
+        self.retry_interval = retry_interval
+
+
+def open_storage(kind="json", filename="library.json", shared=False, durability="fsync", flush_interval=None,
+                 writer_thread=False):
+    """
+    Create the storage object for the given storage mode.
+
+    :param kind: (str, optional) "json" to rewrite the JSON file on every change, "journal" to append
+                 changes to a journal, or "sqlite" to keep the books in an SQLite database next to the JSON
+                 file (the database is filled from the JSON file the first time). Defaults to "json".
+    :param filename: (str, optional) The JSON file holding the list of books. Defaults to "library.json".
+    :param shared: (bool, optional) True if several processes use the storage at the same time. Defaults to False.
+    :param durability: (str, optional) One of DURABILITY_LEVELS. Defaults to "fsync".
+    :param flush_interval: (float, optional) When given, changes are grouped and written at most every
+                           flush_interval seconds (see GroupCommitStorage). Defaults to None.
+    :param writer_thread: (bool, optional) True to make the writes on a writer thread (see
+                          WriterThreadStorage), instead of grouping them by flush_interval. Defaults to False.
+
+    :returns:
+        The storage object.
+    """
+    if kind == "json":
+        storage = JsonStorage(filename, shared=shared, durability=durability)
+    elif kind == "journal":
+        storage = JournaledStorage(filename, shared=shared, durability=durability)
+    elif kind == "sqlite":
+        storage = SQLiteStorage(os.path.splitext(filename)[0] + ".db", seed_filename=filename, shared=shared,
+                                durability=durability)
+    else:
+        raise ValueError(f'Unknown storage mode "{kind}".')
+    if writer_thread:
+        storage = WriterThreadStorage(storage)
+    elif flush_interval is not None:
+        storage = GroupCommitStorage(storage, interval=flush_interval)
+    return storage
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from api import make_api
+from book import Book
+from library import Library
+from storage import JournaledStorage
+
+
+class CountingStorage(JournaledStorage):
+    """
+    A journaled storage counting its writes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = 0
+
+    def write_many(self, changes, books):
+        self.writes += 1
+        super().write_many(changes, books)
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(storage=CountingStorage(self.filename))
+        self.sapiens = self.library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        self.shining = self.library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        app = Flask(__name__)
+        app.register_blueprint(make_api(self.library, lambda: "visitor", api_key="secret"))
+        self.client = app.test_client()
+        self.client.environ_base["HTTP_X_API_KEY"] = "secret"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_books(self):
+        listed = self.client.get("/api/books?limit=1&sort=title").get_json()
+        self.assertListEqual(["Sapiens"], [book["title"] for book in listed["books"]])
+        listed = self.client.get(f"/api/books?limit=1&sort=title&cursor={listed['next_cursor']}").get_json()
+        self.assertEqual((["The Shining"], None), ([book["title"] for book in listed["books"]], listed["next_cursor"]))
+        self.assertEqual(1, len(self.client.get("/api/books?author=Yuval").get_json()["books"]))
+        self.assertEqual(400, self.client.get("/api/books?year_from=soon").status_code)
+        self.assertEqual("The Shining", self.client.get("/api/search?q=shin").get_json()["books"][0]["title"])
+
+        response = self.client.post("/api/books", json={"title": "It", "author": "Stephen King", "year": 1986,
+                                                        "genre": "Horror"})
+        self.assertEqual(201, response.status_code)
+        book_id = response.get_json()["id"]
+        self.assertEqual("It", self.client.get(f"/api/books/{book_id}").get_json()["title"])
+        self.assertEqual({"error": "Author should not contain numbers."},
+                         self.client.post("/api/books", json={"title": "It", "author": "King 2", "year": 1986,
+                                                              "genre": "Horror"}).get_json())
+
+        response = self.client.patch(f"/api/books/{book_id}", json={"copies": 3, "genre": "Fiction"})
+        self.assertEqual((1986, 3, "Fiction"), tuple(response.get_json()[field]
+                                                     for field in ("publication_year", "copies", "genre")))
+        self.assertEqual(400, self.client.patch(f"/api/books/{book_id}", json={"year": 3000}).status_code)
+        self.assertEqual(204, self.client.delete(f"/api/books/{book_id}").status_code)
+        self.assertEqual(404, self.client.get(f"/api/books/{book_id}").status_code)
+
+    def test_values_of_the_wrong_type_are_rejected(self):
+        url = f"/api/books/{self.shining.id}"
+        for details in ({"title": ["The Shining"]}, {"title": {}}, {"author": 123}, {"genre": ["Horror"]},
+                        {"year": [1977]}, {"copies": None}, {"copies": True}):
+            with self.subTest(details=details):
+                response = self.client.patch(url, json=details)
+                self.assertEqual(400, response.status_code)
+                self.assertIn("error", response.get_json())
+        self.assertEqual("The Shining", self.library.get_book(self.shining.id).title)
+        # numbers are taken as text, as when adding a book
+        self.assertEqual("1984", self.client.patch(url, json={"title": 1984}).get_json()["title"])
+        self.assertListEqual(["1984", "Sapiens"], [book["title"] for book in
+                                                   self.client.get("/api/books?sort=title").get_json()["books"]])
+        self.assertEqual(400, self.client.post("/api/books", json={"title": ["It"], "author": "Stephen King",
+                                                                   "year": 1986, "genre": "Horror"}).status_code)
+        self.assertEqual(400, self.client.post("/api/loans/batch", json={"operations": [
+            {"op": "borrow", "title": ["Sapiens"]}]}).status_code)
+
+    def test_borrow_and_return(self):
+        response = self.client.post(f"/api/books/{self.shining.id}/borrow", json={"user": "alice"})
+        self.assertEqual((200, 0), (response.status_code, response.get_json()["book"]["available"]))
+        self.assertEqual(409, self.client.post(f"/api/books/{self.shining.id}/borrow").status_code)
+        self.assertEqual(409, self.client.delete(f"/api/books/{self.shining.id}").status_code)
+        # without a user, the visitor of the session
+        self.assertEqual(409, self.client.post(f"/api/books/{self.shining.id}/return").status_code)
+        self.assertEqual(200, self.client.post(f"/api/books/{self.shining.id}/return",
+                                               json={"user": "alice"}).status_code)
+
+    def test_book_deleted_after_the_lookup(self):
+        # the book is found once: deleting it while it is borrowed or returned doesn't lose the response
+        with mock.patch.object(self.library, "get_book", side_effect=[self.shining, None]):
+            response = self.client.post(f"/api/books/{self.shining.id}/borrow", json={"user": "alice"})
+        self.assertEqual((200, "The Shining"), (response.status_code, response.get_json()["book"]["title"]))
+        with mock.patch.object(self.library, "get_book", side_effect=[self.shining, None]):
+            response = self.client.post(f"/api/books/{self.shining.id}/return", json={"user": "alice"})
+        self.assertEqual((200, "The Shining"), (response.status_code, response.get_json()["book"]["title"]))
+
+    def test_only_trusted_clients_name_the_user(self):
+        for key in (None, "guess"):
+            with self.subTest(key=key):
+                self.client.environ_base.pop("HTTP_X_API_KEY", None)
+                headers = {"X-API-Key": key} if key else {}
+                response = self.client.post(f"/api/books/{self.sapiens.id}/borrow", json={"user": "alice"},
+                                            headers=headers)
+                self.assertEqual(200, response.status_code)
+                self.client.post("/api/loans/batch", json={"operations": [
+                    {"op": "borrow", "id": self.sapiens.id, "user": "bob"}]}, headers=headers)
+                self.assertListEqual(["visitor", "visitor"], [loan.user for loan in self.sapiens.loans.values()])
+                for _ in range(2):
+                    self.client.post(f"/api/books/{self.sapiens.id}/return", json={"user": "alice"},
+                                     headers=headers)
+                self.assertFalse(self.sapiens.loans)
+
+    def test_batches_are_written_once(self):
+        writes = self.library.storage.writes
+        response = self.client.post("/api/loans/batch", json={"operations": [
+            {"op": "borrow", "id": self.sapiens.id, "user": "alice"},
+            {"op": "borrow", "title": "Sapiens", "user": "bob"},
+            {"op": "borrow", "id": self.sapiens.id, "user": "carol"},
+            {"op": "return", "id": self.sapiens.id, "user": "alice"},
+            {"op": "borrow", "id": self.sapiens.id},
+        ]})
+
+        self.assertListEqual([True, True, False, True, True],
+                             [result["ok"] for result in response.get_json()["results"]])
+        self.assertEqual(writes + 1, self.library.storage.writes)
+        self.assertListEqual([(2, "bob"), (1, "visitor")],
+                             [(loan.copy, loan.user) for loan in self.sapiens.loans.values()])
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertListEqual([(2, "bob"), (1, "visitor")],
+                             [(loan.copy, loan.user) for loan in reloaded.get_book(self.sapiens.id).loans.values()])
+
+        self.assertEqual(400, self.client.post("/api/loans/batch", json={"operations": [{"op": "renew", "id": 1}]})
+                         .status_code)
+        self.assertEqual(400, self.client.post("/api/loans/batch", json={"operations": {}}).status_code)
+
+        writes = self.library.storage.writes
+        response = self.client.post("/api/books/batch", json={"books": [
+            {"title": "It", "author": "Stephen King", "year": 1986, "genre": "Horror"},
+            {"title": "Bad", "author": "Nobody", "genre": "Horror"},
+            {"title": "Sapiens", "author": "Yuval", "publication_year": 2011, "genre": "Science, History"},
+        ]})
+        results = response.get_json()["results"]
+        self.assertListEqual([True, False, True], [result["ok"] for result in results])
+        self.assertEqual((self.sapiens.id, 3), (results[2]["book"]["id"], results[2]["book"]["copies"]))
+        self.assertEqual(writes + 1, self.library.storage.writes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from flask import Flask, Response, request, stream_with_context
+from api import make_api
+from asgi import WsgiToAsgi
+from book import Book
+from library import Library
+from storage import JournaledStorage, WriterThreadStorage
+
+
+async def call(app, method, path, query=b"", body=b"", headers=()):
+    """
+    Send a request to an ASGI application, the way a server would.
+
+    :returns:
+        tuple: The status, the headers dictionary and the list of body messages of the response.
+    """
+    scope = {"type": "http", "method": method, "path": path, "query_string": query, "root_path": "",
+             "headers": [(b"host", b"testserver")] + list(headers), "server": ("testserver", 80),
+             "client": ("127.0.0.1", 5000), "scheme": "http", "http_version": "1.1"}
+    # the body comes in two parts, and then the client stays connected
+    messages = [{"type": "http.request", "body": body[:5], "more_body": True},
+                {"type": "http.request", "body": body[5:], "more_body": False}]
+    connected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await connected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start, bodies = sent[0], sent[1:]
+    return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}, bodies
+
+
+class TestWsgiToAsgi(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(storage=WriterThreadStorage(JournaledStorage(self.filename)))
+        self.library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        self.flask_app = Flask(__name__)
+        self.flask_app.register_blueprint(make_api(self.library, lambda: "visitor"))
+        self.app = WsgiToAsgi(self.flask_app, threads=4)
+
+    def tearDown(self):
+        self.app.executor.shutdown()
+        self.library.close()
+        self.temp_dir.cleanup()
+
+    def test_requests(self):
+        status, headers, bodies = asyncio.run(call(self.app, "GET", "/api/books", b"author=Yuval"))
+        self.assertEqual((200, "application/json"), (status, headers["content-type"]))
+        self.assertEqual(["Sapiens"], [book["title"] for book in json.loads(bodies[0]["body"])["books"]])
+        self.assertFalse(bodies[-1]["more_body"])
+
+        body = json.dumps({"title": "It", "author": "Stephen King", "year": 1986, "genre": "Horror"}).encode()
+        status, _, _ = asyncio.run(call(self.app, "POST", "/api/books", body=body,
+                                        headers=[(b"content-type", b"application/json"),
+                                                 (b"content-length", str(len(body)).encode())]))
+        self.assertEqual(201, status)
+        self.library.flush()
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertEqual(["Sapiens", "It"], [book.title for book in reloaded.books])
+
+        self.assertEqual(404, asyncio.run(call(self.app, "GET", "/nowhere"))[0])
+
+    def test_streamed_responses_are_sent_in_parts(self):
+        @self.flask_app.route('/broken')
+        def broken():
+            raise RuntimeError("broken")
+
+        @self.flask_app.route('/count')
+        def count():
+            def generate():
+                # the request context is still there while the response is streamed
+                for i in range(int(request.args["n"])):
+                    yield f"{i}\n"
+            return Response(stream_with_context(generate()), mimetype="text/plain")
+
+        status, _, bodies = asyncio.run(call(self.app, "GET", "/count", b"n=3"))
+        self.assertEqual(200, status)
+        self.assertEqual([b"0\n", b"1\n", b"2\n", b""], [body["body"] for body in bodies])
+
+        self.flask_app.config["PROPAGATE_EXCEPTIONS"] = True
+        with self.assertLogs("asgi", "ERROR"):
+            self.assertEqual(500, asyncio.run(call(self.app, "GET", "/broken"))[0])
+
+    def test_requests_are_handled_at_the_same_time(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        @self.flask_app.route('/wait')
+        def wait():
+            # fails with BrokenBarrierError unless three requests are waiting here at once
+            barrier.wait()
+            return "done"
+
+        async def main():
+            return await asyncio.gather(*(call(self.app, "GET", "/wait") for _ in range(3)))
+
+        self.assertEqual([200, 200, 200], [status for status, _, _ in asyncio.run(main())])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import random
+import tempfile
+import unittest
+from library import Library
+from book import Book
+from autocomplete import Trie, default_max_distance
+
+
+def edit_distance(a, b):
+    row = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        previous, row = row, [i]
+        for j in range(1, len(b) + 1):
+            row.append(min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (char != b[j - 1])))
+    return row[-1]
+
+
+class TestTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = Trie(["The Shining", "The Stand", "The Hobbit", "Thinking, Fast and Slow", "Dune"])
+
+    def test_prefix_completions(self):
+        self.assertListEqual(["The Hobbit", "The Shining", "The Stand"], self.trie.complete("the "))
+        self.assertListEqual(["The Shining", "The Stand"], self.trie.complete("THE S", max_distance=0))
+        # "the h" is one typo away
+        self.assertListEqual(["The Shining", "The Stand", "The Hobbit"], self.trie.complete("the s"))
+        self.assertListEqual(["Dune"], self.trie.complete("dune"))
+        self.assertListEqual([], self.trie.complete("xyz"))
+
+    def test_typos(self):
+        self.assertListEqual(["The Shining"], self.trie.complete("the shinning"))
+        # closer completions come first
+        self.assertListEqual(["The Stand", "The Shining"], self.trie.complete("the stan", max_distance=2))
+        self.assertListEqual(["Thinking, Fast and Slow"], self.trie.complete("thinkng"))
+        self.assertListEqual([], self.trie.complete("thinkng", max_distance=0))
+
+    def test_add_and_remove(self):
+        self.trie.add("The Shining")
+        self.trie.remove("The Shining")
+        self.assertIn("The Shining", self.trie.complete("the sh"))
+        self.trie.remove("The Shining")
+        self.assertListEqual(["The Stand"], self.trie.complete("the s", max_distance=0))
+        self.trie.remove("The Stand")
+        self.trie.remove("The Hobbit")
+        self.trie.remove("not there")
+        self.assertListEqual(["Thinking, Fast and Slow"], self.trie.complete("th"))
+        self.assertEqual(2, len(self.trie))
+        self.trie.add("The Shining")
+        self.assertListEqual(["The Shining"], self.trie.complete("the"))
+
+    def test_matches_edit_distance_of_every_prefix(self):
+        random.seed(11)
+        values = ["".join(random.choice("abc ") for _ in range(random.randint(1, 8))) for _ in range(300)]
+        trie = Trie(values)
+        for text in ["a", "ab", "abca", "bacab", "cc ba", "abcabca", "b a c"]:
+            for max_distance in (None, 2):
+                distance = default_max_distance(text) if max_distance is None else max_distance
+                best = {}
+                for value in set(values):
+                    if value[0] == text[0]:
+                        closest = min(edit_distance(text, value[:end]) for end in range(len(value) + 1))
+                        if closest <= distance:
+                            best[value] = closest
+                expected = sorted(best, key=lambda value: (best[value], value))[:10]
+                with self.subTest(text=text, max_distance=max_distance):
+                    self.assertListEqual(expected, trie.complete(text, max_distance=max_distance))
+
+
+class TestLibraryAutocomplete(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(self.filename)
+        self.library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        self.library.add_book(Book("Sapiens", "Yuval Noah Harari", 2011, "Science, History"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_autocomplete_follows_changes(self):
+        self.assertListEqual(["Stephen King"], self.library.autocomplete("author", "steph"))
+
+        self.library.add_book(Book("The Stand", "Stephen King", 1978, "Horror"))
+        self.library.delete_book("The Shining")
+        self.library.edit_book("Sapiens", {"author": "Yuval Harari"})
+
+        self.assertListEqual(["The Stand"], self.library.autocomplete("title", "the s"))
+        self.assertListEqual(["Stephen King"], self.library.autocomplete("author", "stepen"))
+        self.assertListEqual(["Yuval Harari"], self.library.autocomplete("author", "yuval"))
+        self.assertListEqual(["Horror", "Science, History"], self.library.autocomplete("genre", ""))
+        with self.assertRaises(ValueError):
+            self.library.autocomplete("year", "19")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import unittest
+from book import Book, HoldQueue
+
+
+class TestCompactBook(unittest.TestCase):
+
+    def test_book_has_no_instance_dict(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History")
+
+        self.assertFalse(hasattr(book, "__dict__"))
+        with self.assertRaises(AttributeError):
+            book.publisher = "Harvill Secker"
+
+    def test_author_and_genre_are_shared_between_books(self):
+        # json.loads creates a separate string object for every value
+        book_dicts = json.loads(json.dumps([{"title": f"Book {i}", "author": "Yuval Noah Harari",
+                                             "publication_year": 2011, "genre": "Science, History"}
+                                            for i in range(2)]))
+        book1, book2 = (Book(**book_dict) for book_dict in book_dicts)
+
+        self.assertIs(book1.author, book2.author)
+        self.assertIs(book1.genre, book2.genre)
+
+        book2.update(genre="".join(["Science", ", ", "History"]))
+        self.assertIs(book1.genre, book2.genre)
+
+    def test_to_dict_is_unchanged(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History", False, None, 7)
+
+        self.assertDictEqual({"title": "Sapiens", "author": "Yuval", "publication_year": 2011,
+                              "genre": "Science, History", "is_borrowed": False,
+                              "borrowed_timestamp": None}, book.to_dict())
+        # the fields only the storages need are in to_storage_dict
+        self.assertDictEqual(dict(book.to_dict(), id=7, copies=1, loans=[], holds=[]), book.to_storage_dict())
+        self.assertDictEqual(book.to_storage_dict(), Book(**book.to_storage_dict()).to_storage_dict())
+
+
+class TestCopies(unittest.TestCase):
+
+    def test_borrow_and_return_copies(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History", copies=3)
+
+        self.assertListEqual([1, 2, 3], [book.borrow() for _ in range(3)])
+        self.assertIsNone(book.borrow())
+        self.assertTrue(book.is_borrowed)
+
+        self.assertEqual(2, book.return_book(2))
+        self.assertEqual(1, book.return_book())
+        self.assertIsNone(book.return_book(2))
+        self.assertEqual((2, False), (book.available, book.is_borrowed))
+        self.assertListEqual([3], list(book.loans))
+
+        reloaded = Book(**json.loads(json.dumps(book.to_storage_dict())))
+        self.assertDictEqual(book.to_storage_dict(), reloaded.to_storage_dict())
+        self.assertEqual(2, reloaded.available)
+
+    def test_set_copies_keeps_copies_on_loan(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History", copies=3)
+        book.borrow(3)
+
+        with self.assertRaises(ValueError):
+            book.set_copies(2)
+        book.set_copies(5)
+
+        self.assertEqual(4, book.available)
+        self.assertListEqual([1, 2, 4, 5], sorted(book.borrow() for _ in range(4)))
+
+    def test_books_saved_before_copies(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History", True, "01-01-2024   10:00")
+
+        self.assertListEqual([{"copy": 1, "borrowed_timestamp": "01-01-2024   10:00", "user": None, "borrowed_at": None,
+                               "due_at": None}],
+                             book.to_storage_dict()["loans"])
+        self.assertTrue(book.is_borrowed)
+
+
+class TestHoldQueue(unittest.TestCase):
+
+    def test_first_come_first_served(self):
+        queue = HoldQueue(["alice", "bob"])
+
+        self.assertEqual(3, queue.append("carol"))
+        with self.assertRaises(ValueError):
+            queue.append("bob")
+        self.assertEqual(("alice", 3), (queue.first(), queue.position("carol")))
+        self.assertTrue(queue.remove("alice"))
+        self.assertEqual(("bob", 2), (queue.first(), queue.position("carol")))
+        self.assertTrue(queue.remove("carol"))
+        self.assertFalse(queue.remove("carol"))
+        self.assertEqual(2, queue.append("dave"))
+        self.assertListEqual(["bob", "dave"], list(queue))
+        self.assertIsNone(queue.position("alice"))
+
+    def test_holds_are_saved_with_the_book(self):
+        book = Book("Sapiens", "Yuval", 2011, "Science, History")
+        book.borrow()
+        self.assertEqual((1, 2), (book.hold("alice"), book.hold("bob")))
+
+        copy = Book(**json.loads(json.dumps(book.to_storage_dict())))
+        self.assertListEqual(["alice", "bob"], list(copy.holds))
+        self.assertEqual(2, copy.hold_position("bob"))
+        self.assertTrue(copy.cancel_hold("alice") and copy.cancel_hold("bob"))
+        self.assertEqual((), copy.holds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from library import Library
+from book import Book
+from columnar import ColumnarCatalog
+
+
+class TestColumnarCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(self.filename, columnar=True)
+        authors = ["Yuval", "Shibel", "Bahaa"]
+        genres = ["Science, History", "Action", "Comedy, Science"]
+        for i in range(40):
+            self.library.add_book(Book(f"Title {i % 9}", authors[i % 3], 1990 + i % 13, genres[i % 4 % 3]))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_list_books_matches_scan(self):
+        self.library.edit_book("Title 4", {"author": "Bahaa", "publication_year": 1991})
+        self.library.delete_book("Title 2")
+        self.library.borrow_book("Title 5")
+
+        for author in (None, "Yuval", "Bahaa", "Nobody"):
+            for genre in (None, "Action", "Comedy, Science"):
+                for year in (None, 1991, 1995):
+                    for is_borrowed in (None, False):
+                        expected = [book for book in self.library.books
+                                    if (not author or book.author == author) and (not genre or book.genre == genre)
+                                    and (not year or book.publication_year == year)
+                                    and (is_borrowed is None or not book.is_borrowed)]
+                        self.assertListEqual(expected, self.library.list_books(author, genre, year,
+                                                                               is_borrowed=is_borrowed))
+
+    def test_added_copies_are_counted(self):
+        book = self.library.find_books("Title 0")[0]
+        self.library.borrow_book(book_id=book.id)
+        self.library.add_book(Book(book.title, book.author, book.publication_year, book.genre, copies=2))
+        self.library.add_books([Book(book.title, book.author, book.publication_year, book.genre)])
+
+        row = self.library._rows[book]
+        self.assertEqual((4, 4), (book.copies, self.library.columnar.copies[row]))
+        self.assertNotIn(row, self.library.columnar.select(is_borrowed=True))
+
+    def test_exact_filters_use_the_indexes(self):
+        with mock.patch.object(self.library.columnar, "select", wraps=self.library.columnar.select) as select:
+            self.assertEqual(14, len(self.library.list_books(author="Yuval")))
+            select.assert_not_called()
+            self.assertEqual(40, len(self.library.list_books(is_borrowed=False)))
+            select.assert_called_once_with(is_borrowed=False)
+
+    def test_aggregates(self):
+        catalog = self.library.columnar
+        self.library.delete_book("Title 0")
+        self.library.borrow_book("Title 1")
+        self.library.borrow_book("Title 1")
+        books = self.library.books
+
+        self.assertEqual(len(books), len(catalog))
+        self.assertEqual(sum(book.genre == "Action" for book in books), catalog.count_by_genre()["Action"])
+        self.assertEqual(sum("Science" in book.genre for book in books),
+                         catalog.count_by_genre(split=True)["Science"])
+        self.assertEqual(sum(book.author == "Yuval" for book in books), catalog.count_by_author()["Yuval"])
+        self.assertEqual(sum(1990 <= book.publication_year < 2000 for book in books),
+                         catalog.year_histogram(bucket_size=10)[1990])
+        self.assertAlmostEqual(2 / len(books), catalog.borrowed_ratio())
+        self.assertEqual(2, len(catalog.select(is_borrowed=True)))
+        self.assertEqual(len(books) - 2, len(catalog.select(is_borrowed=False)))
+        # the library's catalog is a mirror of the Book objects, without the details to materialize them
+        self.assertEqual(({}, {}), (catalog.loans, catalog.holds))
+        with self.assertRaises(ValueError):
+            catalog.book(0)
+
+    def test_rows_are_materialized_on_demand(self):
+        self.library.borrow_book("Title 3")
+        catalog = ColumnarCatalog.from_books(Book(**book.to_storage_dict()) for book in self.library.books)
+
+        rows = catalog.select(author="Yuval", is_borrowed=True)
+
+        self.assertEqual([self.library.find_books("Title 3")[0].to_storage_dict()],
+                         [catalog.book(row).to_storage_dict() for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from book import Book, Loan
+from history import LoanHistory
+from library import Library
+from storage import JournaledStorage
+
+HOUR = 3600
+DAY = 86400
+
+
+class TestLoanHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.loans.jsonl")
+        self.sapiens = Book("Sapiens", "Yuval", 2011, "Science, History", id=1)
+        self.shining = Book("The Shining", "Stephen King", 1977, "Horror", id=2)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def lend(self, history, book, borrowed_at, returned_at=None):
+        loan = Loan(1, borrowed_at=borrowed_at)
+        history.record("borrow", book, loan, borrowed_at)
+        if returned_at is not None:
+            history.record("return", book, loan, returned_at)
+
+    def test_aggregates_per_hour_and_day(self):
+        history = LoanHistory(self.filename)
+        start = 1000 * DAY
+        self.lend(history, self.sapiens, start, start + 2 * HOUR)
+        self.lend(history, self.sapiens, start + HOUR, start + 5 * HOUR)
+        self.lend(history, self.shining, start + DAY + 30, start + DAY + 60)
+
+        first_day = history.stats(start, start + DAY)
+        self.assertEqual(2, first_day.loans)
+        self.assertEqual({"Sapiens": 2}, first_day.titles)
+        self.assertEqual({"Science": 2, "History": 2}, first_day.genres)
+        self.assertEqual(3 * HOUR, first_day.average_duration)
+
+        self.assertEqual(3, history.stats().loans)
+        self.assertEqual({"Horror": 1}, history.stats(start + DAY).genres)
+        self.assertEqual(1, history.stats(start + HOUR, start + 2 * HOUR, resolution="hour").loans)
+        self.assertListEqual([(start, 1), (start + HOUR, 1), (start + DAY, 1)],
+                             [(bucket, stats.loans) for bucket, stats in history.buckets("hour") if stats.loans])
+        self.assertIsNone(history.stats(start + 2 * DAY).average_duration)
+        with self.assertRaises(ValueError):
+            history.stats(resolution="week")
+
+    def test_old_buckets_are_dropped(self):
+        history = LoanHistory()
+        self.lend(history, self.sapiens, 0)
+        self.lend(history, self.sapiens, 30 * DAY)
+
+        self.assertEqual(1, len(history.buckets("hour")))
+        self.assertEqual(2, history.stats().loans)
+
+    def test_events_are_read_back_and_shared(self):
+        history = LoanHistory(self.filename)
+        other = LoanHistory(self.filename)
+        self.lend(history, self.sapiens, 1000 * DAY, 1000 * DAY + HOUR)
+        self.lend(other, self.shining, 1000 * DAY + HOUR)
+        with open(self.filename, 'ab') as file:
+            file.write(b'{"event": "borr')
+
+        for reader in (history, other, LoanHistory(self.filename)):
+            stats = reader.stats()
+            self.assertEqual((2, HOUR), (stats.loans, stats.average_duration))
+
+        # the line is read once it is complete
+        with open(self.filename, 'ab') as file:
+            file.write(b'ow", "time": 86400000, "book": 2, "copy": 1, "user": null, "title": "The Shining", '
+                       b'"genres": ["Horror"]}\n')
+        self.assertEqual(3, history.stats().loans)
+
+
+class TestLibraryHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_borrows_and_returns_are_recorded_once(self):
+        library = Library(storage=JournaledStorage(self.filename))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        library.borrow_book("Sapiens", user="alice")
+        library.borrow_book("Sapiens", user="bob")
+        library.return_book("Sapiens", user="alice")
+
+        stats = library.history.stats()
+        self.assertEqual((2, 1), (stats.loans, stats.returns))
+        self.assertGreaterEqual(stats.average_duration, 0)
+
+        # replaying the journal doesn't record the loans again, and the loans keep their time
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertEqual((2, 1), (reloaded.history.stats().loans, reloaded.history.stats().returns))
+        self.assertEqual([loan.borrowed_at for loan in library.books[0].loans.values()],
+                         [loan.borrowed_at for loan in reloaded.books[0].loans.values()])
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, "library.loans.jsonl")))
+
+
+if __name__ == '__main__':
+    unittest.main()
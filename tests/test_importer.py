@@ -0,0 +1,139 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from book import Book
+from importer import format_of, import_books, main
+from library import Library
+from storage import JournaledStorage, SQLiteStorage
+from validation import validate_book, validate_details
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_rules_of_the_librarians_page(self):
+        book = validate_book({"title": "Sapiens", "author": "Yuval", "year": "2011", "genre": "History"})
+        self.assertEqual(("Sapiens", 2011, 1), (book.title, book.publication_year, book.copies))
+        book = validate_book({"title": "Sapiens", "author": "Yuval", "publication_year": 2011, "genre": "History",
+                              "copies": 3})
+        self.assertEqual((2011, 3), (book.publication_year, book.copies))
+
+        for row, message in (({"title": "Sapiens", "author": "Yuval", "genre": "History"}, "fill in all fields"),
+                             ({"title": "Sapiens", "author": "Yuval", "year": "20x1", "genre": "History"},
+                              "Invalid year"),
+                             ({"title": "Sapiens", "author": "Yuval", "year": "2011", "genre": "History",
+                               "copies": "0"}, "copies"),
+                             ({"title": "Sapiens", "author": "Yuval 2", "year": "2011", "genre": "History"},
+                              "Author"),
+                             ({"title": "Sapiens", "author": "Yuval", "year": "2011", "genre": "History 2"},
+                              "Genre")):
+            with self.subTest(row=row), self.assertRaisesRegex(ValueError, message):
+                validate_book(row)
+
+    def test_rules_of_the_edit_page(self):
+        self.assertDictEqual({"title": "", "author": "Yuval", "publication_year": 2011, "genre": "", "copies": 2},
+                             validate_details("", "Yuval", "2011", "", "2"))
+        for details, message in ((("", "", None, "", "1"), "Invalid year"),
+                                 (("", "", "2011", "", "-1"), "copies"),
+                                 (("", "", "2011", "Horror 2", "1"), "Genre"),
+                                 (("", "", "9999", "", "1"), "future")):
+            with self.subTest(details=details), self.assertRaisesRegex(ValueError, message):
+                validate_details(*details)
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_csv_rows_are_imported_and_errors_reported(self):
+        library = Library(storage=JournaledStorage(self.filename))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        catalog = io.StringIO("title,author,year,genre,copies\n"
+                              "The Shining,Stephen King,1977,Horror,2\n"
+                              "Bad Year,Someone,soon,Horror,1\n"
+                              "Sapiens,Yuval,2011,\"Science, History\",\n"
+                              "It,Stephen King,1986,Horror,1\n"
+                              "The Shining,Stephen King,1977,Horror,1\n")
+
+        report = import_books(library, catalog, "csv")
+
+        self.assertListEqual([(3, 'Invalid year format. Please enter a valid year.')], report.errors)
+        self.assertListEqual(["The Shining", "Sapiens", "It", "The Shining"], [book.title for book in report.books])
+        self.assertListEqual([("Sapiens", 2), ("The Shining", 3), ("It", 1)],
+                             [(book.title, book.copies) for book in library.books])
+        self.assertListEqual(["It", "Sapiens", "The Shining"],
+                             [book.title for book in library.list_books(sort="title")])
+        # the first book and the four imported rows are journaled
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertListEqual([(book.id, book.title, book.copies) for book in library.books],
+                             [(book.id, book.title, book.copies) for book in reloaded.books])
+        self.assertEqual(5, reloaded.storage.journal_length)
+
+    def test_json_lines_are_imported_into_sqlite(self):
+        library = Library(storage=SQLiteStorage(os.path.join(self.temp_dir.name, "library.db")))
+        catalog = io.StringIO(json.dumps(Book("Sapiens", "Yuval", 2011, "History").to_dict()) + "\n"
+                              "\n"
+                              "{not json\n"
+                              "[1, 2]\n"
+                              '{"title": "Sapiens", "author": "Yuval", "year": 2011, "genre": "History"}\n')
+
+        report = import_books(library, catalog, "jsonl")
+
+        self.assertListEqual([(3, 'Invalid JSON.'), (4, 'Expected a JSON object.')], report.errors)
+        self.assertListEqual([("Sapiens", 2)], [(book.title, book.copies) for book in library.books])
+        library.close()
+        reloaded = Library(storage=SQLiteStorage(os.path.join(self.temp_dir.name, "library.db")))
+        self.assertListEqual([("Sapiens", 2)], [(book.title, book.copies) for book in reloaded.books])
+
+    def test_worker_processes_keep_the_order_of_the_file(self):
+        lines = []
+        for i in range(50):
+            lines.append(json.dumps({"title": f"Title {i % 20}", "author": "Yuval", "year": 2000 + i % 20,
+                                     "genre": "History" if i % 7 else "History 7"}))
+        lines.insert(10, "{not json")
+        catalog = "\n".join(lines) + "\n"
+
+        results = []
+        for workers in (1, 3):
+            library = Library(os.path.join(self.temp_dir.name, f"library{workers}.json"))
+            report = import_books(library, io.StringIO(catalog), "jsonl", workers=workers, chunk_size=4)
+            results.append((report.errors, [book.id for book in report.books],
+                            [(book.title, book.copies) for book in library.books]))
+
+        self.assertEqual(results[0], results[1])
+        errors, _, books = results[1]
+        self.assertListEqual([1, 8, 11, 16, 23, 30, 37, 44, 51], [number for number, _ in errors])
+        self.assertEqual(("Title 1", 2), books[0])
+
+    def test_exports_can_be_imported_again(self):
+        library = Library(self.filename)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        library.add_book(Book("It", "Stephen King", 1986, "Horror"))
+
+        for format in ("jsonl", "csv"):
+            copy = Library(os.path.join(self.temp_dir.name, f"copy.{format}.json"))
+            report = import_books(copy, io.StringIO("".join(library.iter_export(format))), format)
+            self.assertListEqual([], report.errors)
+            self.assertListEqual([book.to_storage_dict() for book in library.books],
+                                 [book.to_storage_dict() for book in copy.books])
+
+    def test_command_line(self):
+        catalog = os.path.join(self.temp_dir.name, "catalog.csv")
+        with open(catalog, "w", encoding="utf-8") as file:
+            file.write("title,author,year,genre\nIt,Stephen King,1986,Horror\nIt,Stephen King,1986,\n")
+
+        self.assertEqual(1, main([catalog, "--library", self.filename]))
+        self.assertListEqual(["It"], [book.title for book in Library(self.filename).books])
+        self.assertEqual("jsonl", format_of("books.JSONL"))
+        with self.assertRaises(ValueError):
+            format_of("books.xml")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,509 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from library import Library
+from book import Book
+from storage import GroupCommitStorage, JournaledStorage, JsonStorage, SQLiteStorage
+
+
+class TestLibraryIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(self.filename)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def scan(self, author=None, genre=None, publication_year=None):
+        """
+        The original linear scan of list_books, used as the reference result.
+        """
+        filtered_books = self.library.books
+        if author:
+            filtered_books = [book for book in filtered_books if book.author == author]
+        if genre:
+            filtered_books = [book for book in filtered_books if book.genre == genre]
+        if publication_year:
+            filtered_books = [book for book in filtered_books if book.publication_year == publication_year]
+        return filtered_books
+
+    def test_list_books_matches_scan_after_edit_and_delete(self):
+        authors = ["Yuval", "Shibel", "Bahaa"]
+        genres = ["Science, History", "Action", "Horror"]
+        for i in range(30):
+            self.library.add_book(Book(f"Title {i % 7}", authors[i % 3], 2000 + i % 4, genres[i % 5 % 3]))
+
+        self.library.edit_book("Title 3", {"author": "Bahaa", "publication_year": 2001})
+        self.library.edit_book("Title 5", {"title": "Title 1"})
+        self.library.delete_book("Title 2")
+
+        for author in [None] + authors:
+            for genre in [None] + genres:
+                for year in [None, 2000, 2001, 2003]:
+                    self.assertListEqual(self.scan(author, genre, year),
+                                         self.library.list_books(author, genre, year))
+
+    def test_combined_filters_match_scan(self):
+        authors = ["Yuval Noah Harari", "Shibel", "Bahaa Yuval"]
+        genres = ["Science, History", "Action", "History", "Comedy, Fantasy, history"]
+        for i in range(40):
+            self.library.add_book(Book(f"Title {i % 9}", authors[i % 3], 1990 + i % 11, genres[i % 4]))
+        self.library.borrow_book("Title 1")
+        self.library.borrow_book("Title 4")
+        self.library.edit_book("Title 2", {"genre": "Fantasy", "publication_year": 1995})
+        self.library.delete_book("Title 3")
+
+        queries = [
+            {"has_genre": "history"},
+            {"has_genre": "Fantasy", "year_from": 1994},
+            {"year_from": 1992, "year_to": 1995},
+            {"year_to": 1991, "author": "Shibel"},
+            {"year_from": 2050},
+            {"is_borrowed": True},
+            {"is_borrowed": False},
+            {"is_borrowed": False, "genre": "Action"},
+            {"author_contains": "yuval"},
+            {"author_contains": "yuval", "has_genre": "History", "is_borrowed": False, "year_from": 1995},
+            {"author_contains": "nobody"},
+        ]
+        for query in queries:
+            expected = [
+                book for book in self.library.books
+                if ("has_genre" not in query or query["has_genre"].casefold() in
+                    [name.casefold() for name in book.genre.split(", ")])
+                and book.publication_year >= query.get("year_from", 0)
+                and book.publication_year <= query.get("year_to", 9999)
+                and book.is_borrowed == query.get("is_borrowed", book.is_borrowed)
+                and query.get("author_contains", "").casefold() in book.author.casefold()
+                and book.author == query.get("author", book.author)
+                and book.genre == query.get("genre", book.genre)
+            ]
+            with self.subTest(**query):
+                self.assertListEqual(expected, self.library.list_books(**query))
+
+    def test_find_books_keeps_library_order_after_edit(self):
+        book1 = Book("Sapiens", "Yuval", 2011, "Science, History")
+        book2 = Book("21 lessons", "Yuval", 2018, "Social philosophy")
+        self.library.add_book(book1)
+        self.library.add_book(book2)
+
+        self.library.edit_book("Sapiens", {"title": "21 lessons"})
+
+        self.assertListEqual([book1, book2], self.library.find_books("21 lessons"))
+        self.assertListEqual([], self.library.find_books("Sapiens"))
+
+    def test_adding_the_same_work_adds_copies(self):
+        book1 = Book("Sapiens", "Yuval", 2011, "Science, History")
+        book2 = Book("Sapiens", "Yuval", 2011, "Science, History", copies=2)
+        self.assertIs(book1, self.library.add_book(book1))
+        self.assertIs(book1, self.library.add_book(book2))
+        edition = Book("Sapiens", "Yuval", 2015, "Science, History")
+        self.assertIs(edition, self.library.add_book(edition))
+
+        self.assertTrue(self.library.borrow_book("Sapiens")[0])
+        self.assertTrue(self.library.borrow_book("Sapiens")[0])
+        self.assertTrue(self.library.borrow_book("Sapiens")[0])
+        self.assertEqual((3, 0, True), (book1.copies, book1.available, book1.is_borrowed))
+        self.assertEqual([book1], self.library.list_books(is_borrowed=True))
+        # the next copy comes from the other edition
+        self.assertTrue(self.library.borrow_book("Sapiens")[0])
+        self.assertFalse(self.library.borrow_book("Sapiens")[0])
+        self.assertFalse(self.library.edit_book("Sapiens", {"genre": "History"}))
+
+        self.assertTrue(self.library.return_book("Sapiens")[0])
+        self.assertEqual(1, book1.available)
+        self.assertEqual([edition], self.library.list_books(is_borrowed=True))
+
+        reloaded = Library(self.filename)
+        self.assertListEqual([(3, 1), (1, 0)], [(book.copies, book.available) for book in reloaded.books])
+
+    def test_load_library_rebuilds_indexes(self):
+        self.library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        self.library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+
+        reloaded = Library(self.filename)
+
+        self.assertEqual(["The Shining"], [book.title for book in reloaded.list_books(genre="Horror")])
+        self.assertEqual(1, len(reloaded.find_books("Sapiens")))
+
+
+
+class TestBookIds(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def fill(self, library):
+        for i in range(3):
+            library.add_book(Book("Sapiens", "Yuval", 2011 + i, "Science, History"))
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+
+    def test_ids_tell_apart_books_with_the_same_title(self):
+        library = Library(self.filename)
+        self.fill(library)
+        self.assertListEqual([1, 2, 3, 4], [book.id for book in library.books])
+
+        self.assertTrue(library.borrow_book(book_id=2)[0])
+        self.assertFalse(library.borrow_book(book_id=2)[0])
+        self.assertTrue(library.edit_book(new_details={"publication_year": 1999}, book_id=3))
+        library.delete_book(book_id=1)
+
+        self.assertIsNone(library.get_book(1))
+        self.assertTrue(library.get_book(2).is_borrowed)
+        self.assertEqual(1999, library.get_book(3).publication_year)
+        self.assertListEqual([2, 3], [book.id for book in library.find_books("Sapiens")])
+        self.assertFalse(library.borrow_book(book_id=1)[0])
+        self.assertTrue(library.return_book(book_id=2)[0])
+
+        # ids are not reused
+        library.add_book(Book("Dune", "Frank Herbert", 1965, "Science Fiction"))
+        self.assertEqual(5, library.find_books("Dune")[0].id)
+
+    def test_ids_are_persisted(self):
+        for storage in (None, JournaledStorage(self.filename),
+                        SQLiteStorage(os.path.join(self.temp_dir.name, "library.db"))):
+            with self.subTest(storage=type(storage).__name__):
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                library = Library(self.filename, storage=storage)
+                self.fill(library)
+                library.borrow_book(book_id=3)
+                library.delete_book(book_id=2)
+                library.close()
+
+                reloaded = Library(self.filename, storage=type(library.storage)(library.storage.filename)
+                                   if storage is not None else None)
+
+                self.assertListEqual([(1, False), (3, True), (4, False)],
+                                     [(book.id, book.is_borrowed) for book in reloaded.books])
+                reloaded.add_book(Book("Dune", "Frank Herbert", 1965, "Science Fiction"))
+                self.assertEqual(5, reloaded.find_books("Dune")[0].id)
+                reloaded.close()
+
+    def test_ids_of_deleted_books_are_not_reused_after_a_restart(self):
+        storages = {
+            "json": lambda: JsonStorage(self.filename),
+            "jsonl": lambda: JsonStorage(os.path.join(self.temp_dir.name, "library.jsonl")),
+            "journal": lambda: JournaledStorage(self.filename),
+            "compacted journal": lambda: JournaledStorage(self.filename, compact_every=1),
+            "sqlite": lambda: SQLiteStorage(os.path.join(self.temp_dir.name, "library.db")),
+            "group commit": lambda: GroupCommitStorage(JsonStorage(self.filename), interval=None),
+        }
+        for name, open_storage in storages.items():
+            with self.subTest(storage=name):
+                for filename in os.listdir(self.temp_dir.name):
+                    os.remove(os.path.join(self.temp_dir.name, filename))
+                library = Library(storage=open_storage())
+                library.add_book(Book("Sapiens", "Yuval", 2011, "History"))
+                library.add_book(Book("Dune", "Frank Herbert", 1965, "Science Fiction"))
+                library.delete_book(book_id=2)
+                library.close()
+
+                reloaded = Library(storage=open_storage())
+                self.assertEqual(3, reloaded.add_book(Book("It", "Stephen King", 1986, "Horror")).id)
+                reloaded.delete_book(book_id=3)
+                reloaded.close()
+                reloaded = Library(storage=open_storage())
+                self.assertEqual(4, reloaded.add_book(Book("It", "Stephen King", 1986, "Horror")).id)
+                reloaded.close()
+
+    def test_books_saved_without_ids_get_them(self):
+        with open(self.filename, 'w') as file:
+            json.dump([{"title": "Sapiens", "author": "Yuval", "publication_year": 2011, "genre": "History",
+                        "is_borrowed": False, "borrowed_timestamp": None}] * 2, file)
+
+        library = Library(self.filename)
+        library.borrow_book(book_id=2)
+
+        self.assertListEqual([1, 2], [book.id for book in Library(self.filename).books])
+        self.assertTrue(Library(self.filename).get_book(2).is_borrowed)
+
+
+class TestLoans(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def loans(self, library, user):
+        return sorted((book.title, loan.copy) for book, loan in library.loans_of(user))
+
+    def test_loans_are_kept_per_user(self):
+        library = Library(storage=JournaledStorage(self.filename))
+        sapiens = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=3))
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+
+        library.borrow_book(book_id=sapiens.id, user="alice")
+        library.borrow_book(book_id=sapiens.id, user="bob")
+        library.borrow_book("The Shining", user="alice")
+        library.borrow_book(book_id=sapiens.id, user="alice")
+
+        self.assertListEqual([("Sapiens", 1), ("Sapiens", 3), ("The Shining", 1)], self.loans(library, "alice"))
+        self.assertListEqual([("Sapiens", 2)], self.loans(library, "bob"))
+        self.assertListEqual([], self.loans(library, "carol"))
+
+        # a user only returns their own copies, oldest first
+        self.assertFalse(library.return_book("The Shining", user="bob")[0])
+        self.assertTrue(library.return_book(book_id=sapiens.id, user="alice")[0])
+        self.assertListEqual([2, 3], list(sapiens.loans))
+        self.assertListEqual([("Sapiens", 3), ("The Shining", 1)], self.loans(library, "alice"))
+
+        # replayed from the journal, then loaded from the compacted file
+        for reload in (lambda: Library(storage=JournaledStorage(self.filename)),
+                       lambda: library.save_library() or Library(self.filename)):
+            reloaded = reload()
+            self.assertListEqual([("Sapiens", 3), ("The Shining", 1)], self.loans(reloaded, "alice"))
+            self.assertListEqual([("Sapiens", 2)], self.loans(reloaded, "bob"))
+
+    def test_deleted_books_leave_the_loans(self):
+        library = Library(self.filename)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.borrow_book("Sapiens", user="alice")
+
+        library.delete_book("Sapiens")
+
+        self.assertListEqual([], library.loans_of("alice"))
+
+
+class TestHolds(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_returned_copies_go_to_the_holds_in_order(self):
+        library = Library(storage=JournaledStorage(self.filename))
+        sapiens = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        library.borrow_book("Sapiens", user="alice")
+
+        # a book with a copy on the shelf is borrowed, not held
+        self.assertEqual((False, None), library.hold_book("Sapiens", user="bob"))
+        library.borrow_book("Sapiens", user="bob")
+        self.assertEqual((True, 1), library.hold_book("Sapiens", user="carol"))
+        self.assertEqual((True, 2), library.hold_book(book_id=sapiens.id, user="dave"))
+        self.assertEqual((True, 3), library.hold_book("Sapiens", user="erin"))
+        self.assertEqual((False, None), library.hold_book("Sapiens", user="dave"))
+        self.assertTrue(library.cancel_hold("Sapiens", user="dave"))
+        self.assertFalse(library.cancel_hold("Sapiens", user="dave"))
+        self.assertEqual((2, 2), (len(sapiens.holds), library.hold_position(sapiens, "erin")))
+
+        library.return_book("Sapiens", user="bob")
+        self.assertTrue(sapiens.is_borrowed)
+        self.assertListEqual([(sapiens, 2)], [(book, loan.copy) for book, loan in library.loans_of("carol")])
+        self.assertEqual(1, library.hold_position(sapiens, "erin"))
+        self.assertIsNone(library.hold_position(sapiens, "carol"))
+
+        # replayed from the journal, then loaded from the compacted file, then from SQLite
+        for reload in (lambda: Library(storage=JournaledStorage(self.filename)),
+                       lambda: library.save_library() or Library(self.filename),
+                       lambda: Library(storage=SQLiteStorage(os.path.join(self.temp_dir.name, "library.db"),
+                                                             seed_filename=self.filename)),
+                       lambda: Library(self.filename, columnar=True)):
+            reloaded = reload()
+            book = reloaded.get_book(sapiens.id)
+            self.assertListEqual(["erin"], list(book.holds))
+            self.assertListEqual([(1, "alice"), (2, "carol")], [(loan.copy, loan.user) for loan in book.loans.values()])
+
+        library.return_book("Sapiens", user="alice")
+        self.assertEqual(1, len(library.loans_of("erin")))
+        self.assertFalse(sapiens.holds)
+        library.return_book("Sapiens", user="carol")
+        self.assertEqual(1, sapiens.available)
+
+    def test_added_copies_go_to_the_holds(self):
+        library = Library(self.filename)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.borrow_book("Sapiens", user="alice")
+        library.hold_book("Sapiens", user="bob")
+
+        sapiens = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+
+        self.assertEqual(1, len(library.loans_of("bob")))
+        self.assertEqual((0, 1), (len(sapiens.holds), sapiens.available))
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.library = Library(os.path.join(self.temp_dir.name, "library.json"))
+        for i in range(25):
+            self.library.add_book(Book(f"Title {i:02}", "Stephen King" if i % 2 else "Yuval", 2000 + i % 5, "Horror"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_json_lines_in_batches(self):
+        batches = list(self.library.iter_export(batch_size=10))
+
+        self.assertListEqual([10, 10, 5], [batch.count("\n") for batch in batches])
+        records = [json.loads(line) for line in "".join(batches).splitlines()]
+        self.assertListEqual([book.title for book in self.library.books], [record["title"] for record in records])
+        self.assertDictEqual({"id": 1, "title": "Title 00", "author": "Yuval", "publication_year": 2000,
+                              "genre": "Horror", "copies": 1, "is_borrowed": False}, records[0])
+
+    def test_csv_with_filters_and_sort(self):
+        self.library.borrow_book("Title 03")
+        text = "".join(self.library.iter_export("csv", sort="-title", batch_size=2, author="Stephen King",
+                                                year_from=2003))
+
+        rows = list(csv.DictReader(io.StringIO(text)))
+        self.assertListEqual(["Title 23", "Title 19", "Title 13", "Title 09", "Title 03"],
+                             [row["title"] for row in rows])
+        self.assertEqual("True", rows[-1]["is_borrowed"])
+        with self.assertRaises(ValueError):
+            self.library.iter_export("xml")
+        with self.assertRaises(ValueError):
+            self.library.iter_export(sort="pages")
+        with self.assertRaises(TypeError):
+            self.library.iter_export(title="Title 03")
+
+    def test_books_changed_during_an_export(self):
+        batches = self.library.iter_export(batch_size=10)
+        first = next(batches)
+        self.library.delete_book("Title 05")
+        self.library.delete_book("Title 15")
+        self.library.add_book(Book("Title 25", "Yuval", 2000, "Horror"))
+
+        titles = [json.loads(line)["title"] for line in (first + "".join(batches)).splitlines()]
+        self.assertEqual(25, len(titles))
+        self.assertIn("Title 05", titles)
+        self.assertNotIn("Title 15", titles)
+        self.assertEqual("Title 25", titles[-1])
+
+
+class TestLibraryPaging(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(self.filename)
+        authors = ["yuval", "Shibel", "Bahaa"]
+        for i in range(25):
+            self.library.add_book(Book(f"Title {(i * 7) % 25:02}", authors[i % 3], 2000 + i % 4, "Horror"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def pages(self, sort=None, limit=4, **filters):
+        """
+        List all the pages of books, following the cursors.
+        """
+        books, cursor = [], None
+        while True:
+            listed = self.library.list_books(sort=sort, limit=limit, cursor=cursor, **filters)
+            books.extend(listed)
+            if len(listed) < limit:
+                return books
+            cursor = self.library.cursor_after(listed[-1], sort)
+
+    def test_pages_follow_the_sort(self):
+        books = list(self.library.books)
+        orders = {
+            None: books,
+            "title": sorted(books, key=lambda book: book.title),
+            "author": sorted(books, key=lambda book: book.author.casefold()),
+            "year": sorted(books, key=lambda book: book.publication_year),
+            "-year": sorted(books, key=lambda book: book.publication_year)[::-1],
+        }
+        for sort, expected in orders.items():
+            with self.subTest(sort=sort):
+                self.assertListEqual(expected, self.pages(sort))
+                self.assertListEqual(expected[5:8], self.library.list_books(sort=sort, offset=5, limit=3))
+        self.assertListEqual([book for book in orders["year"] if book.author == "Bahaa"],
+                             self.pages("year", author="Bahaa"))
+
+    def test_cursor_survives_changes(self):
+        first_page = self.library.list_books(sort="title", limit=5)
+        cursor = self.library.cursor_after(first_page[-1], "title")
+
+        self.library.delete_book("Title 00")
+        self.library.add_book(Book("Title 01b", "Bahaa", 2001, "Horror"))
+        self.library.add_book(Book("Title 99", "Bahaa", 2001, "Horror"))
+        self.library.edit_book("Title 20", {"title": "Title 05b"})
+
+        expected = sorted((book for book in self.library.books if book.title > first_page[-1].title),
+                          key=lambda book: book.title)
+        self.assertListEqual(expected, self.library.list_books(sort="title", cursor=cursor))
+        self.assertEqual("Title 05b", self.library.list_books(sort="title")[6].title)
+
+    def test_cursor_survives_a_reload(self):
+        expected = self.pages("author")
+        cursor = self.library.cursor_after(expected[3], "author")
+        # the books added before the cursor's book are deleted, then the library is loaded again (as on a restart)
+        deleted = [book for book in self.library.books if book.id < expected[3].id and book not in expected[:4]]
+        for book in deleted:
+            self.library.delete_book(book_id=book.id)
+        self.library.load_library()
+
+        self.assertListEqual([book.id for book in expected[4:] if book not in deleted],
+                             [book.id for book in self.library.list_books(sort="author", cursor=cursor)])
+
+    def test_invalid_sort_or_cursor(self):
+        cursor = self.library.cursor_after(self.library.books[0], "title")
+        for sort, cursor in (("pages", None), ("year", cursor), ("title", "not a cursor"), (None, "e30")):
+            with self.subTest(sort=sort, cursor=cursor):
+                with self.assertRaises(ValueError):
+                    self.library.list_books(sort=sort, cursor=cursor)
+
+
+class TestLibraryThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_borrows_never_borrow_a_copy_twice(self):
+        library = Library(storage=JournaledStorage(self.filename))
+        for _ in range(5):
+            library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        results = []
+
+        self.run_threads(lambda i: results.append(library.borrow_book("Sapiens")[0]), 20)
+
+        self.assertEqual(5, results.count(True))
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertTrue(all(book.is_borrowed for book in reloaded.books))
+
+    def test_concurrent_adds_and_listing(self):
+        library = Library(self.filename)
+
+        def work(i):
+            for j in range(20):
+                library.add_book(Book(f"Title {i} {j}", f"Author {i % 3}", 2000, "Action"))
+                library.list_books(author=f"Author {i % 3}")
+
+        self.run_threads(work, 8)
+
+        self.assertEqual(160, len(library.books))
+        self.assertEqual(160, len(Library(self.filename).books))
+
+
+if __name__ == '__main__':
+    unittest.main()
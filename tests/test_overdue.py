@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from book import Book, Loan
+from library import Library
+from overdue import OverdueTracker
+from storage import JournaledStorage
+
+DAY = 86400
+
+
+class TestOverdueTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.sapiens = Book("Sapiens", "Yuval", 2011, "Science, History", id=1, copies=2)
+        self.shining = Book("The Shining", "Stephen King", 1977, "Horror", id=2)
+
+    def test_loans_past_their_due_date_are_marked(self):
+        notified = []
+        tracker = OverdueTracker(lambda book, loan: notified.append((book, loan.copy)))
+        first, second, other = Loan(1, due_at=300), Loan(2, due_at=100), Loan(1, due_at=200)
+        tracker.add(self.sapiens, first)
+        tracker.add(self.sapiens, second)
+        tracker.add(self.shining, other)
+        tracker.add(self.shining, Loan(2))
+
+        self.assertEqual(100, tracker.next_due())
+        self.assertListEqual([(self.sapiens, second), (self.shining, other)], tracker.check(now=250))
+        self.assertListEqual([(self.sapiens, 2), (self.shining, 1)], notified)
+        self.assertEqual((1, 1), (tracker.count(self.sapiens), tracker.count(self.shining)))
+        self.assertTrue(tracker.is_overdue(self.sapiens, second))
+        self.assertFalse(tracker.is_overdue(self.sapiens, first))
+        self.assertEqual(300, tracker.next_due())
+        self.assertListEqual([], tracker.check(now=250))
+
+        tracker.remove(self.sapiens, second)
+        self.assertEqual(0, tracker.count(self.sapiens))
+        self.assertListEqual([(self.shining, other)], tracker.overdue_loans())
+
+    def test_returned_loans_are_skipped(self):
+        tracker = OverdueTracker()
+        loans = [Loan(copy, due_at=copy) for copy in range(1, 201)]
+        for loan in loans:
+            tracker.add(self.sapiens, loan)
+        for loan in loans[:150]:
+            tracker.remove(self.sapiens, loan)
+
+        self.assertEqual(151, tracker.next_due())
+        self.assertEqual(50, len(tracker.check(now=1000)))
+        self.assertIsNone(tracker.next_due())
+
+    def test_scheduler_wakes_up_at_the_next_due_date(self):
+        found = threading.Event()
+        tracker = OverdueTracker(lambda book, loan: found.set())
+        tracker.start(interval=60)
+        try:
+            tracker.add(self.sapiens, Loan(1, due_at=time.time() + 0.05))
+            self.assertTrue(found.wait(5))
+            self.assertEqual(1, tracker.count(self.sapiens))
+        finally:
+            tracker.stop()
+
+
+class TestLibraryOverdue(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_loans_are_due_after_the_loan_period(self):
+        library = Library(storage=JournaledStorage(self.filename), loan_period=DAY)
+        book = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        library.borrow_book("Sapiens", user="alice")
+        library.borrow_book("Sapiens", user="bob")
+        library.return_book("Sapiens", user="bob")
+        loan = book.loans[1]
+        self.assertAlmostEqual(loan.borrowed_at + DAY, loan.due_at)
+
+        self.assertListEqual([], library.overdue.check())
+        self.assertListEqual([(book, loan)], library.overdue.check(now=loan.due_at))
+        self.assertEqual(1, library.overdue.count(book))
+        library.return_book("Sapiens", user="alice")
+        self.assertEqual(0, library.overdue.count(book))
+
+    def test_due_dates_are_replayed(self):
+        library = Library(storage=JournaledStorage(self.filename), loan_period=DAY)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.borrow_book("Sapiens", user="alice")
+        due_at = library.books[0].loans[1].due_at
+
+        # the loan period of the library reading the journal back doesn't change the recorded due date
+        reloaded = Library(storage=JournaledStorage(self.filename), loan_period=2 * DAY)
+        self.assertEqual(due_at, reloaded.books[0].loans[1].due_at)
+        self.assertEqual(due_at, reloaded.overdue.next_due())
+        reloaded.overdue.check(now=due_at)
+        self.assertTrue(reloaded.overdue.is_overdue(reloaded.books[0], reloaded.books[0].loans[1]))
+
+
+    def test_overdue_loans_stay_marked_after_a_reload(self):
+        notified = []
+        library = Library(storage=JournaledStorage(self.filename), loan_period=DAY,
+                          on_overdue=lambda book, loan: notified.append((book.id, loan.user)))
+        book = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=3))
+        library.borrow_book("Sapiens", user="alice")
+        library.borrow_book("Sapiens", user="bob")
+        due_at = book.loans[2].due_at
+        library.overdue.check(now=due_at)
+        library.return_book("Sapiens", user="bob")
+        library.borrow_book("Sapiens", user="carol")
+
+        library.load_library()
+        book = library.get_book(book.id)
+        self.assertEqual(1, library.overdue.count(book))
+        self.assertTrue(library.overdue.is_overdue(book, book.loans[1]))
+        # alice's loan isn't notified again, carol's is once it falls due
+        self.assertListEqual([], library.overdue.check(now=due_at))
+        library.overdue.check(now=book.loans[2].due_at)
+        self.assertListEqual([(book.id, "alice"), (book.id, "bob"), (book.id, "carol")], notified)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import random
+import tempfile
+import unittest
+from library import Library
+from book import Book
+from search import SearchIndex, tokenize
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.books = [
+            Book("Harry Potter and the Philosopher's Stone", "J. K. Rowling", 1997, "Fantasy"),
+            Book("The History of Potter's Wheels", "Harriet Smith", 2001, "History"),
+            Book("Sapiens: A Brief History of Humankind", "Yuval Noah Harari", 2011, "Science, History"),
+            Book("Good Omens", "Neil Gaiman and Terry Pratchett", 1990, "Comedy, Fantasy"),
+        ]
+        self.index = SearchIndex(self.books)
+
+    def test_tokenize(self):
+        self.assertListEqual(["sapiens", "a", "brief", "history"], tokenize("Sapiens: A brief HISTORY"))
+
+    def test_prefix_and_multi_term_queries(self):
+        self.assertListEqual([self.books[0]], self.index.search("harry pot"))
+        self.assertListEqual([self.books[3]], self.index.search("omen fant"))
+        self.assertListEqual([], self.index.search("harry omens"))
+        self.assertListEqual([], self.index.search("nothing"))
+        self.assertListEqual([], self.index.search("  "))
+
+    def test_ranking(self):
+        # a title match ranks before an author match
+        self.assertListEqual([self.books[0], self.books[1]], self.index.search("harr"))
+        # equally ranked books keep their order
+        self.assertListEqual([self.books[1], self.books[2]], self.index.search("history", order=self.books.index))
+        self.assertListEqual(self.books[:2], self.index.search("potter", order=self.books.index))
+        self.assertEqual(1, len(self.index.search("fantasy", limit=1)))
+
+    def test_incremental_updates(self):
+        self.index.remove(self.books[0])
+        self.assertListEqual([], self.index.search("rowling"))
+        self.books[0].update(author="Someone Else")
+        self.index.add(self.books[0])
+        self.assertListEqual([self.books[0]], self.index.search("someone"))
+        self.assertEqual(len(self.books), len(self.index))
+
+    def test_top_results_match_scoring_every_book(self):
+        random.seed(7)
+        words = ["alpha", "alps", "beta", "bet", "gamma", "gam", "delta", "del", "epsilon"]
+        books = [Book(" ".join(random.sample(words, 3)), random.choice(words), 2000, random.choice(words))
+                 for _ in range(500)]
+        index = SearchIndex(books)
+        order = {book: position for position, book in enumerate(books)}
+        for query in ["al", "alpha", "bet gam", "d e", "del alpha", "gamma beta epsilon", "a"]:
+            terms = list(dict.fromkeys(tokenize(query)))
+            scored = [(index._score(terms, index._book_tokens[book], len(books)), -order[book], book)
+                      for book in books]
+            expected = sorted((item for item in scored if item[0] is not None),
+                              key=lambda item: item[:2], reverse=True)[:10]
+            with self.subTest(query=query):
+                self.assertListEqual([book for *_, book in expected],
+                                     index.search(query, limit=10, order=order.__getitem__))
+
+
+class TestLibrarySearch(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.library = Library(self.filename)
+        self.library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        self.library.add_book(Book("The Stand", "Stephen King", 1978, "Horror"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_search_follows_changes(self):
+        self.assertListEqual(["The Shining", "The Stand"], [book.title for book in self.library.search("king")])
+
+        self.library.add_book(Book("Kingdom Come", "Mark Waid", 1996, "Comic"))
+        self.library.edit_book("The Stand", {"title": "The Long Walk"})
+        self.library.delete_book("The Shining")
+
+        self.assertListEqual(["The Long Walk", "Kingdom Come"], [book.title for book in self.library.search("king")])
+        self.assertListEqual([], self.library.search("shining"))
+        self.assertListEqual(["The Long Walk"], [book.title for book in self.library.search("long wal")])
+
+    def test_small_batches_keep_the_indexes(self):
+        self.library.add_books(Book(f"Book {i}", "Someone", 2000, "Drama") for i in range(6))
+        self.library.search("king")
+        self.library.autocomplete("title", "th")
+        self.library.list_books(sort="title", limit=1)
+        index, tries = self.library._search_index, self.library._autocomplete
+
+        self.library.add_books([Book("Kingdom Come", "Mark Waid", 1996, "Comic"),
+                                Book("The Stand", "Stephen King", 1978, "Horror")])
+        self.assertIs(index, self.library._search_index)
+        self.assertIs(tries, self.library._autocomplete)
+        # the second is a copy of a book already there
+        self.assertCountEqual(["The Shining", "The Stand", "Kingdom Come"],
+                              [book.title for book in self.library.search("king")])
+        self.assertIn("Kingdom Come", self.library.autocomplete("title", "kin"))
+        self.assertEqual("Book 0", self.library.list_books(sort="title", limit=1)[0].title)
+
+        # a batch as large as a quarter of the library drops them
+        self.library.add_books(Book(f"King {i}", "Someone", 2000, "Drama") for i in range(3))
+        self.assertIsNone(self.library._search_index)
+        self.assertIsNone(self.library._autocomplete)
+        self.assertEqual(6, len(self.library.search("king")))
+
+    def test_search_after_reload(self):
+        self.library.search("king")
+        self.library.load_library()
+        self.assertListEqual(self.library.books, self.library.search("stephen"))
+
+
+if __name__ == '__main__':
+    unittest.main()
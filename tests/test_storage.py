@@ -0,0 +1,563 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from library import Library
+from book import Book, Loan
+import storage
+from storage import JsonStorage, JournaledStorage, SQLiteStorage, GroupCommitStorage, WriterThreadStorage, \
+    iter_json_array
+
+
+def wait_until(condition, timeout=2.0):
+    """
+    Wait (up to timeout seconds) for a background thread to make the condition true.
+
+    :returns:
+        bool: The condition.
+    """
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        threading.Event().wait(0.01)
+    return condition()
+
+
+class TestJournaledStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def open_library(self, compact_every=1000):
+        return Library(storage=JournaledStorage(self.filename, compact_every=compact_every))
+
+    def fill(self, library):
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        library.borrow_book("Sapiens")
+        library.edit_book("21 lessons", {"author": "Yuval Noah Harari"})
+        library.delete_book("The Shining")
+
+    def test_mutations_append_to_journal_without_rewriting_snapshot(self):
+        library = self.open_library()
+        self.fill(library)
+
+        self.assertFalse(os.path.exists(self.filename))
+        with open(library.storage.journal_filename, 'r') as file:
+            self.assertEqual(7, len(file.read().splitlines()))
+
+    def test_load_replays_snapshot_and_journal(self):
+        library = self.open_library()
+        library.add_book(Book("Good Omens", "Neil Gaiman", 1990, "Comedy, Fantasy"))
+        library.save_library()
+        self.fill(library)
+
+        reloaded = self.open_library()
+
+        self.assertEqual([book.to_storage_dict() for book in library.books],
+                         [book.to_storage_dict() for book in reloaded.books])
+
+    def test_copies_and_loans_are_replayed(self):
+        library = self.open_library()
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        library.save_library()
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History", copies=2))
+        for _ in range(3):
+            library.borrow_book("Sapiens")
+        library.return_book("Sapiens")
+
+        reloaded = self.open_library()
+
+        self.assertEqual([book.to_storage_dict() for book in library.books],
+                         [book.to_storage_dict() for book in reloaded.books])
+        self.assertEqual((4, 2), (reloaded.books[0].copies, reloaded.books[0].available))
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        library = self.open_library(compact_every=3)
+        self.fill(library)
+
+        with open(self.filename, 'r') as file:
+            snapshot = json.load(file)["books"]
+        self.assertEqual(["Sapiens", "21 lessons"], [book["title"] for book in snapshot])
+        self.assertEqual(0, library.storage.journal_length)
+        self.assertEqual(snapshot, [book.to_storage_dict() for book in self.open_library().books])
+
+    def test_journal_of_an_older_snapshot_is_not_replayed(self):
+        library = self.open_library()
+        self.fill(library)
+        with open(library.storage.journal_filename, 'r') as file:
+            journal = file.read()
+        library.save_library()
+        # a compaction that stopped after writing the snapshot but before emptying the journal
+        with open(library.storage.journal_filename, 'w') as file:
+            file.write(journal)
+
+        self.assertEqual(2, len(self.open_library().books))
+
+    def test_torn_last_record_is_ignored(self):
+        library = self.open_library()
+        self.fill(library)
+        with open(library.storage.journal_filename, 'a') as file:
+            file.write('{"op":"add","book":{"tit')
+
+        self.assertEqual(2, len(self.open_library().books))
+
+    def test_first_write_compacts_the_given_books(self):
+        self.fill(self.open_library())
+        books = self.open_library().books
+        # a storage that wasn't loaded yet, compacting on its first write
+        storage = JournaledStorage(self.filename, compact_every=1)
+        storage.write({"op": "add_copies", "id": books[0].id, "count": 0}, books, [books[0]])
+
+        self.assertEqual(["Sapiens", "21 lessons"], [book.title for book in self.open_library().books])
+
+    def test_json_storage_rewrites_file(self):
+        library = Library(storage=JsonStorage(self.filename))
+        self.fill(library)
+
+        with open(self.filename, 'r') as file:
+            # the id of the deleted book isn't given again
+            self.assertEqual({"next_id": 4, "books": [book.to_storage_dict() for book in library.books]},
+                             json.load(file))
+
+
+
+
+class TestAtomicSave(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_failed_save_keeps_the_previous_file(self):
+        library = Library(self.filename)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+
+        with mock.patch.object(storage.os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                library.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+
+        self.assertEqual(["Sapiens"], [book.title for book in Library(self.filename).books])
+        self.assertEqual(["library.json"], os.listdir(self.temp_dir.name))
+
+    def test_saves_keep_the_permissions_of_the_files(self):
+        library = Library(storage=JournaledStorage(self.filename, compact_every=2))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        # compacted: the JSON file and the new journal are written
+        library.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+        for filename in (self.filename, library.storage.journal_filename):
+            self.assertEqual(0o666 & ~storage.UMASK, stat.S_IMODE(os.stat(filename).st_mode))
+
+        for filename in (self.filename, library.storage.journal_filename):
+            os.chmod(filename, 0o640)
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        library.add_book(Book("It", "Stephen King", 1986, "Horror"))
+        for filename in (self.filename, library.storage.journal_filename):
+            self.assertEqual(0o640, stat.S_IMODE(os.stat(filename).st_mode))
+
+    def test_durability_levels(self):
+        for durability in storage.DURABILITY_LEVELS:
+            with self.subTest(durability=durability):
+                library = Library(storage=JournaledStorage(self.filename, durability=durability))
+                library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+                library.save_library()
+                self.assertEqual(1, len(Library(self.filename).books))
+                os.remove(self.filename)
+
+        with mock.patch.object(storage.os, "fsync") as fsync:
+            Library(storage=JsonStorage(self.filename, durability="none")).add_book(Book("A", "B", 2000, "C"))
+        fsync.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            JsonStorage(self.filename, durability="sometimes")
+
+
+
+class TestGroupCommitStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_changes_are_written_in_batches(self):
+        inner = JournaledStorage(self.filename)
+        library = Library(storage=GroupCommitStorage(inner, interval=60, batch_size=3))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.borrow_book("Sapiens")
+
+        self.assertTrue(library.list_books(author="Yuval")[0].is_borrowed)
+        self.assertEqual(0, len(Library(storage=JournaledStorage(self.filename)).books))
+
+        library.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+
+        # the background thread writes the batch right away
+        self.assertTrue(wait_until(lambda: inner.journal_length == 3))
+        self.assertEqual(2, len(Library(storage=JournaledStorage(self.filename)).books))
+        library.close()
+
+    def test_close_writes_the_pending_changes(self):
+        for inner in (JsonStorage(self.filename), SQLiteStorage(os.path.join(self.temp_dir.name, "library.db"))):
+            with self.subTest(storage=type(inner).__name__):
+                library = Library(storage=GroupCommitStorage(inner, interval=60))
+                library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+                library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+                library.borrow_book("Sapiens")
+                library.delete_book("The Shining")
+
+                library.close()
+
+                reloaded = Library(storage=type(inner)(inner.filename))
+                self.assertEqual(["Sapiens"], [book.title for book in reloaded.books])
+                self.assertTrue(reloaded.books[0].is_borrowed)
+                reloaded.close()
+
+    def test_background_thread_writes_after_the_interval(self):
+        library = Library(storage=GroupCommitStorage(JsonStorage(self.filename), interval=0.01))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+
+        self.assertTrue(wait_until(lambda: os.path.exists(self.filename)))
+        self.assertEqual(1, len(Library(self.filename).books))
+        library.close()
+
+    def test_loading_doesnt_hold_the_storage_lock_while_flushing(self):
+        library = Library(storage=GroupCommitStorage(JsonStorage(self.filename), interval=None))
+        book = library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        loader = threading.Thread(target=library.load_library)
+        # a borrow holds the lock of its book, then waits for the storage lock to write
+        with library._book_lock(book):
+            loader.start()
+            # the loader waits for the book lock to copy the pending change
+            time.sleep(0.05)
+            self.assertTrue(library._storage_lock.acquire(timeout=2))
+            library._storage_lock.release()
+        loader.join(timeout=2)
+        self.assertFalse(loader.is_alive())
+        self.assertEqual(["Sapiens"], [book.title for book in Library(self.filename).books])
+        library.close()
+
+    def test_shared_storage_cannot_be_grouped(self):
+        with self.assertRaises(ValueError):
+            GroupCommitStorage(JsonStorage(self.filename, shared=True))
+
+
+
+class TestWriterThreadStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_changes_are_written_by_the_writer_thread(self):
+        inner = JournaledStorage(self.filename)
+        writers = []
+        write_many = inner.write_many
+
+        def record_writer(changes, books):
+            writers.append(threading.current_thread().name)
+            write_many(changes, books)
+
+        inner.write_many = record_writer
+        library = Library(storage=WriterThreadStorage(inner))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.borrow_book("Sapiens")
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+
+        self.assertTrue(wait_until(lambda: inner.journal_length == 3))
+        self.assertTrue(writers and set(writers) == {"library-writer"})
+        reloaded = Library(storage=JournaledStorage(self.filename))
+        self.assertEqual(["Sapiens", "The Shining"], [book.title for book in reloaded.books])
+        self.assertTrue(reloaded.books[0].is_borrowed)
+        library.close()
+
+    def test_close_writes_the_queued_changes(self):
+        inner = JsonStorage(self.filename)
+        library = Library(storage=WriterThreadStorage(inner))
+        # the writer thread is stuck until the test lets it go
+        release = threading.Event()
+        write_many = inner.write_many
+        inner.write_many = lambda changes, books: (release.wait(5), write_many(changes, books))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        library.delete_book("The Shining")
+
+        release.set()
+        library.close()
+
+        self.assertEqual(["Sapiens"], [book.title for book in Library(self.filename).books])
+
+    def test_books_are_copied_under_their_locks_while_they_change(self):
+        to_dict = Loan.to_dict
+
+        def yielding_to_dict(loan):
+            # let the other threads run in the middle of the serialization of a book
+            time.sleep(0)
+            return to_dict(loan)
+
+        for inner in (JsonStorage(self.filename), JournaledStorage(self.filename, compact_every=5),
+                      SQLiteStorage(os.path.join(self.temp_dir.name, "library.db"))):
+            with self.subTest(storage=type(inner).__name__):
+                for name in ("library.json", "library.json.journal", "library.db"):
+                    if os.path.exists(os.path.join(self.temp_dir.name, name)):
+                        os.remove(os.path.join(self.temp_dir.name, name))
+                library = Library(storage=WriterThreadStorage(inner))
+                library.add_books(Book(f"Title {i}", "Yuval", 2000 + i, "History", copies=40) for i in range(50))
+                errors = []
+
+                def borrow_and_return(i):
+                    try:
+                        for _ in range(100):
+                            library.borrow_book(book_id=i % 2 + 1, user=f"user {i}")
+                            library.return_book(book_id=i % 2 + 1, user=f"user {i}")
+                    except Exception as e:
+                        errors.append(e)
+
+                # the writer thread logs the writes that fail
+                with self.assertNoLogs("storage", "ERROR"), mock.patch.object(Loan, "to_dict", yielding_to_dict):
+                    threads = [threading.Thread(target=borrow_and_return, args=(i,)) for i in range(16)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    library.close()
+
+                self.assertListEqual([], errors)
+                reloaded = Library(storage=type(inner)(inner.filename))
+                self.assertListEqual([(book.title, book.copies, {}) for book in library.books],
+                                     [(book.title, book.copies, book.loans) for book in reloaded.books])
+                reloaded.close()
+
+    def test_shared_storage_cannot_be_wrapped(self):
+        with self.assertRaises(ValueError):
+            WriterThreadStorage(JsonStorage(self.filename, shared=True))
+
+
+class TestStreamingLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+        self.book_dicts = [Book(f"Ünïcode title {i}", "Yuval", 2000 + i, "Science, History", i % 2 == 0,
+                                id=i + 1).to_storage_dict() for i in range(50)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def chunks(self, data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_iter_json_array_handles_any_chunk_boundary(self):
+        data = json.dumps(self.book_dicts, indent=1, ensure_ascii=False).encode()
+        for size in (1, 2, 3, 7, 64, len(data)):
+            with self.subTest(size=size):
+                self.assertEqual(self.book_dicts, list(iter_json_array(self.chunks(data, size))))
+        self.assertEqual([], list(iter_json_array([b" [ ] "])))
+        # the books of a file saved with its next_id
+        data = json.dumps({"next_id": 51, "books": self.book_dicts}).encode()
+        for size in (1, 7, len(data)):
+            with self.subTest(size=size):
+                header = {}
+                self.assertEqual(self.book_dicts, list(iter_json_array(self.chunks(data, size), header)))
+                self.assertEqual({"next_id": 51}, header)
+        self.assertEqual([1, 23, 456], list(iter_json_array(self.chunks(b"[1, 23,456]", 1))))
+
+    def test_iter_json_array_rejects_broken_files(self):
+        for data in (b'{"title": "x"}', b'{"books": [}', b'[{"title": "x"}', b'[{"title": "x"} {"title": "y"}]',
+                     b'[1] 2'):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(self.chunks(data, 3)))
+
+    def test_load_streams_books_and_reports_progress(self):
+        with open(self.filename, 'w') as file:
+            json.dump(self.book_dicts, file)
+        storage = JournaledStorage(self.filename)
+        storage.chunk_size = 100
+        progress = []
+
+        library = Library(storage=storage, progress=lambda done, total: progress.append((done, total)))
+
+        self.assertEqual(self.book_dicts, [book.to_storage_dict() for book in library.books])
+        self.assertEqual(50, len(library.list_books(author="Yuval")))
+        size = os.path.getsize(self.filename)
+        self.assertEqual((size, size), progress[-1])
+        self.assertGreater(len(progress), 10)
+
+        library.borrow_book("Ünïcode title 1")
+        self.assertTrue(Library(storage=JournaledStorage(self.filename)).books[1].is_borrowed)
+
+    def test_json_lines_file(self):
+        filename = os.path.join(self.temp_dir.name, "library.jsonl")
+        library = Library(filename)
+        for book_dict in self.book_dicts:
+            library.add_book(Book(**book_dict))
+
+        with open(filename, 'r') as file:
+            # and the next_id first
+            self.assertEqual(51, len(file.read().splitlines()))
+        self.assertEqual(self.book_dicts, [book.to_storage_dict() for book in Library(filename).books])
+
+
+def add_books_in_process(filename, kind, worker):
+    library = Library(storage=JournaledStorage(filename, shared=True) if kind == "journal"
+                      else JsonStorage(filename, shared=True))
+    for i in range(10):
+        library.add_book(Book(f"Book {worker} {i}", "Yuval", 2011, "Science, History"))
+
+
+class TestSharedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_refresh_replays_only_new_journal_records(self):
+        first = Library(storage=JournaledStorage(self.filename, shared=True))
+        second = Library(storage=JournaledStorage(self.filename, shared=True))
+        first.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        self.assertTrue(second.refresh())
+        sapiens = second.books[0]
+
+        first.borrow_book("Sapiens")
+
+        self.assertTrue(second.refresh())
+        self.assertIs(sapiens, second.books[0])
+        self.assertTrue(sapiens.is_borrowed)
+        self.assertFalse(second.refresh())
+
+    def test_changes_are_made_on_top_of_the_other_writers_changes(self):
+        first = Library(storage=JsonStorage(self.filename, shared=True))
+        second = Library(storage=JsonStorage(self.filename, shared=True))
+        first.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+
+        second.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+        first.borrow_book("21 lessons")
+
+        self.assertEqual(["Sapiens", "21 lessons"], [book.title for book in Library(self.filename).books])
+        self.assertTrue(Library(self.filename).books[1].is_borrowed)
+
+    def test_worker_processes_do_not_lose_changes(self):
+        for kind in ("json", "journal"):
+            with self.subTest(kind=kind):
+                filename = os.path.join(self.temp_dir.name, f"{kind}.json")
+                processes = [multiprocessing.Process(target=add_books_in_process, args=(filename, kind, worker))
+                             for worker in range(4)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+
+                storage = JournaledStorage(filename) if kind == "journal" else JsonStorage(filename)
+                self.assertEqual(40, len(Library(storage=storage).books))
+
+    def test_sqlite_refresh_sees_other_connection_changes(self):
+        filename = os.path.join(self.temp_dir.name, "library.db")
+        first = Library(storage=SQLiteStorage(filename, shared=True))
+        second = Library(storage=SQLiteStorage(filename, shared=True))
+        first.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+
+        self.assertTrue(second.refresh())
+        self.assertEqual(["Sapiens"], [book.title for book in second.books])
+        self.assertFalse(second.refresh())
+        first.storage.close()
+        second.storage.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "library.db")
+        self.storages = []
+
+    def tearDown(self):
+        for storage in self.storages:
+            storage.close()
+        self.temp_dir.cleanup()
+
+    def open_library(self, seed_filename=None):
+        storage = SQLiteStorage(self.filename, seed_filename=seed_filename)
+        self.storages.append(storage)
+        return Library(storage=storage)
+
+    def test_changes_are_persisted_row_by_row(self):
+        library = self.open_library()
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.add_book(Book("Sapiens", "Yuval", 2011, "Science, History"))
+        library.add_book(Book("21 lessons", "Yuval", 2018, "Social philosophy"))
+        library.add_book(Book("The Shining", "Stephen King", 1977, "Horror"))
+        library.borrow_book("Sapiens")
+        library.edit_book("21 lessons", {"author": "Yuval Noah Harari"})
+        library.delete_book("The Shining")
+
+        reloaded = self.open_library()
+
+        self.assertEqual([book.to_storage_dict() for book in library.books],
+                         [book.to_storage_dict() for book in reloaded.books])
+
+    def test_lookups_return_the_library_book_objects(self):
+        library = self.open_library()
+        book1 = Book("Sapiens", "Yuval", 2011, "Science, History")
+        book2 = Book("21 lessons", "Yuval", 2018, "Social philosophy")
+        book3 = Book("Sapiens", "Shibel", 2011, "Science, History")
+        for book in (book1, book2, book3):
+            library.add_book(book)
+
+        self.assertListEqual([book1, book2], library.list_books(author="Yuval"))
+        self.assertListEqual([book1, book3], library.list_books(publication_year=2011))
+        self.assertListEqual([book1, book3], library.find_books("Sapiens"))
+        self.assertTrue(library.borrow_book("Sapiens")[0])
+        self.assertTrue(book1.is_borrowed)
+
+    def test_database_from_before_copies_is_upgraded(self):
+        connection = sqlite3.connect(self.filename)
+        with connection:
+            connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT NOT NULL, author TEXT, "
+                               "publication_year INTEGER, genre TEXT, is_borrowed INTEGER NOT NULL DEFAULT 0, "
+                               "borrowed_timestamp TEXT)")
+            connection.execute("INSERT INTO books VALUES (1, 'Sapiens', 'Yuval', 2011, 'History', 1, 'then')")
+        connection.close()
+
+        library = self.open_library()
+        self.assertEqual("then", library.books[0].loans[1].borrowed_timestamp)
+        library.add_book(Book("Sapiens", "Yuval", 2011, "History"))
+        self.assertTrue(library.borrow_book("Sapiens")[0])
+
+        reloaded = self.open_library()
+        self.assertEqual((2, 0), (reloaded.books[0].copies, reloaded.books[0].available))
+
+    def test_empty_database_is_filled_from_json_file(self):
+        json_filename = os.path.join(self.temp_dir.name, "library.json")
+        with open(json_filename, 'w') as file:
+            json.dump([Book("Sapiens", "Yuval", 2011, "Science, History").to_dict()], file)
+
+        self.open_library(seed_filename=json_filename)
+        reloaded = self.open_library()
+
+        self.assertEqual(["Sapiens"], [book.title for book in reloaded.books])
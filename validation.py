@@ -0,0 +1,198 @@
+from datetime import datetime
+from book import Book
+
+# ---------------------------
+# The checks the details of a book must pass before they go into the
+# library. The librarian's page and the edit page (see app.py), the JSON API
+# (see api.py) and the bulk importer (see importer.py) use the same rules, so
+# a catalog file accepts exactly the books the librarian's page does.
+#
+# The checks are plain functions of the submitted values, without any
+# library state, so the importer can run them in worker processes over
+# chunks of rows (see validate_rows).
+# ---------------------------
+
+
+def _text(value, name):
+    """
+    Convert the value of a field to a string (JSON values may be numbers). None is left as it is.
+
+    :raises ValueError: If it is neither a string nor a number, like a list or an object of a JSON body.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f'Invalid {name}, expected a text.')
+
+
+def _field(data, *names):
+    """
+    Get the first of the given fields that has a value, as a string (JSON values may be numbers).
+    """
+    for name in names:
+        value = data.get(name)
+        if value is not None and value != '':
+            return _text(value, name)
+    return None
+
+
+def _check_year(year):
+    """
+    Convert a publication year to an integer.
+
+    :raises ValueError: If it isn't one.
+    """
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid year format. Please enter a valid year.')
+
+
+def _check_copies(copies):
+    """
+    Convert a number of copies to an integer.
+
+    :raises ValueError: If it isn't a positive number.
+    """
+    if not copies.isdigit() or int(copies) < 1:
+        raise ValueError('The number of copies should be a positive number.')
+    return int(copies)
+
+
+def _check_names(author, genre):
+    """
+    Check that the author and the genre don't contain digits.
+
+    :raises ValueError: If one of them does.
+    """
+    if any(char.isdigit() for char in author):
+        raise ValueError('Author should not contain numbers.')
+
+    if any(char.isdigit() for char in genre):
+        raise ValueError('Genre should not contain numbers.')
+
+
+def validate_fields(data):
+    """
+    Check the fields of a new book.
+
+    :param data: (dict) The fields of the book: title, author, genre, year (or publication_year, as in
+                 Book.to_dict) and optionally copies (1 by default). The values may be strings, like the fields
+                 of a form or of a CSV row, or numbers, like the values of a JSON object.
+
+    :returns:
+        tuple: The title, author, publication year and genre of the book, and its number of copies.
+
+    :raises ValueError: If a field is missing or invalid, with a message saying which.
+    """
+    title = _field(data, 'title')
+    author = _field(data, 'author')
+    genre = _field(data, 'genre')
+    year = _field(data, 'year', 'publication_year')
+    copies = _field(data, 'copies') or '1'
+
+    # Check for empty fields
+    if not title or not author or not genre or not year:
+        raise ValueError('Please fill in all fields.')
+
+    publication_year = _check_year(year)
+    number_of_copies = _check_copies(copies)
+    _check_names(author, genre)
+    return title, author, publication_year, genre, number_of_copies
+
+
+def validate_book(data):
+    """
+    Check the fields of a new book (see validate_fields) and build it.
+
+    :param data: (dict) The fields of the book.
+
+    :returns:
+        Book: The new book (without an id).
+
+    :raises ValueError: If a field is missing or invalid, with a message saying which.
+    """
+    title, author, publication_year, genre, copies = validate_fields(data)
+    return Book(title, author, publication_year, genre, copies=copies)
+
+
+def validate_rows(rows):
+    """
+    Check the fields of many new books (see validate_fields). A module-level function, so it can be run in a
+    worker process.
+
+    :param rows: (list) List of (line number, fields dictionary) tuples.
+
+    :returns:
+        list: List of (line number, fields tuple, error message) tuples in the same order, with either the fields
+              or the error message None.
+    """
+    checked = []
+    for number, data in rows:
+        try:
+            checked.append((number, validate_fields(data), None))
+        except ValueError as e:
+            checked.append((number, None, str(e)))
+    return checked
+
+
+def validate_details(title, author, year, genre, copies):
+    """
+    Check the new details of a book being edited. Empty title, author and genre are left unchanged.
+
+    :param title: (str) The new title.
+    :param author: (str) The new author.
+    :param year: (str) The new publication year.
+    :param genre: (str) The new genre.
+    :param copies: (str) The new number of copies.
+
+    The values may also be numbers, like the values of a JSON object.
+
+    :returns:
+        dict: The details for Library.edit_book.
+
+    :raises ValueError: If a value is invalid (or isn't a string or a number), or the year is in the future.
+    """
+    title, author, genre = _text(title, 'title'), _text(author, 'author'), _text(genre, 'genre')
+    publication_year = _check_year(_text(year, 'year'))
+    number_of_copies = _check_copies(_text(copies, 'copies') or '')
+    _check_names(author or '', genre or '')
+
+    if publication_year > datetime.now().year:
+        raise ValueError('Publication year cannot be in the future.')
+
+    return {
+        "title": title,
+        "author": author,
+        "publication_year": publication_year,
+        "genre": genre,
+        "copies": number_of_copies
+    }
+
+
+def validate_filters(args):
+    """
+    Check the filters of Library.list_books given as strings, like the query string of a request: author,
+    genre, publication_year, has_genre, year_from, year_to, is_borrowed ("true" or "false") and author_contains.
+    Missing or empty filters are left out.
+
+    :param args: (dict) The filters.
+
+    :returns:
+        dict: The filters for list_books, with the years as integers and is_borrowed as a boolean.
+
+    :raises ValueError: If a year or is_borrowed is invalid.
+    """
+    filters = {name: args.get(name) or None for name in ('author', 'genre', 'has_genre', 'author_contains')}
+    for name in ('publication_year', 'year_from', 'year_to'):
+        if args.get(name):
+            try:
+                filters[name] = int(args[name])
+            except ValueError:
+                raise ValueError(f'Invalid {name} "{args[name]}".')
+    if args.get('is_borrowed'):
+        if args['is_borrowed'] not in ('true', 'false'):
+            raise ValueError('is_borrowed should be "true" or "false".')
+        filters['is_borrowed'] = args['is_borrowed'] == 'true'
+    return filters